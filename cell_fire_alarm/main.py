@@ -1,7 +1,13 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.responses import StreamingResponse
+from typing import List, NamedTuple, Optional
 import os
+import json
+from rules import (
+    ENGINE, SIZING, normalize_occupancy, estimate_points, alarm_load_amps, battery_ah,
+    select_panel, select_battery, size_batch,
+)
 
 app = FastAPI(title="Cicuma Cell: Fire Alarm", version="2.0.0")
 
@@ -10,6 +16,8 @@ PROTOCOL_PATH = "/app/knowledge_base/FIRE_ALARM_DESIGN_PROTOCOL.md"
 if not os.path.exists(PROTOCOL_PATH):
     PROTOCOL_PATH = "../FIRE_ALARM_DESIGN_PROTOCOL.md"
 
+RULESET_HEADER = "X-Ruleset-Version"
+
 class BuildingInput(BaseModel):
     occupancy: str  # e.g., "R-2", "Business", "Mercantile", "Assembly"
     sqft: int
@@ -19,6 +27,17 @@ class BuildingInput(BaseModel):
     num_units: int = 0  # Crucial for R-2
     sprinklered: bool = False
     ai_overrides: Optional[dict] = {}
+    ahj: Optional[str] = None  # Jurisdiction overlay, e.g. "south_fl"
+
+class Sizing(NamedTuple):
+    points: int
+    panel: str
+    alarm_load: float
+    required_ah: float
+    battery: str
+
+PANEL_LABELS = [label for _, label in SIZING["panels"]]
+BATTERY_LABELS = [label for _, label in SIZING["batteries"]]
 
 class DesignOutput(BaseModel):
     status: str
@@ -26,48 +45,51 @@ class DesignOutput(BaseModel):
     compliance_notes: List[str]
     bom_tier_a: List[str]
     bom_tier_b: List[str]
+    point_count: int = 0  # Estimated addressable points
+
+@app.get("/ruleset")
+def ruleset():
+    return {"version": ENGINE.version, "jurisdictions": ENGINE.jurisdictions}
 
 @app.post("/analyze", response_model=DesignOutput)
-def analyze(input_data: BuildingInput):
+def analyze(input_data: BuildingInput, response: Response):
     """
     Deterministic Logic for Fire Alarm Design.
     implements NFPA 101 (Life Safety) and NFPA 72 (National Fire Alarm Code).
+    Thresholds live in the compiled rule tables in rules.py.
     """
     print(f"[CELL] Analyzing: {input_data}")
-    
+    # Callers memoize results per rule set version
+    response.headers[RULESET_HEADER] = ENGINE.version
+    return design(input_data)
+
+def count_ai_points(ai_overrides: Optional[dict]) -> int:
+    ai_points = 0
+    if ai_overrides:
+        rooms = ai_overrides.get("rooms", [])
+        for r in rooms:
+            ai_points += len(r.get("components", []))
+    return ai_points
+
+def design(input_data: BuildingInput, sizing: Optional[Sizing] = None, verbose: bool = True) -> dict:
+    """
+    Builds one DesignOutput. `sizing` carries precomputed point/power numbers
+    (from the vectorized batch path); when omitted they are computed here.
+    """
     notes = []
     bom_a = []
     bom_b = []
     system_type = "None Required"
     
     # --- LOGIC ENGINE ---
+    profile = normalize_occupancy(input_data.occupancy)
     
-    # 1. Occupancy & Requirement Analysis (NFPA 101)
-    is_required = False
-    
-    if "R-2" in input_data.occupancy.upper() or "RESIDENTIAL" in input_data.occupancy.upper():
-        # NFPA 101 30.3.4.1: Manual fire alarm system required if > 4 stories OR > 16 dwelling units.
-        if input_data.num_stories > 4 or input_data.num_units > 16:
-            is_required = True
-            notes.append("System REQUIRED: R-2 Occupancy > 16 Units or > 4 Stories (NFPA 101 30.3.4.1).")
-        elif input_data.num_units > 11:
-             # Often a gray area or local amendment, flagging for check.
-             notes.append("Check Local Amendments: R-2 with 12-16 units often requires system in South FL.")
-        else:
-            notes.append("System may NOT be required (Below R-2 Thresholds). Verify Local Amendments.")
-
-    elif input_data.occupancy.lower() == "assembly":
-        # Previous logic kept for compatibility
-        if input_data.occupants > 300:
-             is_required = True
-             notes.append("Voice Evacuation System REQUIRED (>300 occupants/Assembly).")
-             system_type = "Voice/Evac"
-
-    elif input_data.occupancy.lower() in ["mercantile", "business", "mixed-use"]:
-         # NFPA 101 36.3.4.1 (Mercantile): Class A > 30,000 sqft or 3 stories.
-         if input_data.sqft > 30000 or input_data.num_stories > 3:
-             is_required = True
-             notes.append("System REQUIRED: Mercantile/Business threshold met.")
+    # 1. Occupancy & Requirement Analysis (NFPA 101, compiled rule tables + AHJ overlay)
+    outcome = ENGINE.evaluate(input_data, profile.key, input_data.ahj)
+    is_required = outcome.required
+    notes.extend(outcome.notes)
+    if outcome.system_type:
+        system_type = outcome.system_type
     
     # 2. System Type Determination
     if is_required and system_type == "None Required":
@@ -79,33 +101,23 @@ def analyze(input_data: BuildingInput):
     # Phase 5: System Architecture & Power (AI Driven)
     
     # 5.1 FACP Selection (Point Count)
-    # Estimate Points: 1 per Unit + 2 per Corridor + Pull Stations
-    est_points = input_data.num_units + (input_data.num_stories * 2) + (input_data.num_stories * 2 + 1)
-    
     # Add AI Override points
-    if input_data.ai_overrides:
-        rooms = input_data.ai_overrides.get("rooms", [])
-        for r in rooms:
-            est_points += len(r.get("components", []))
-            
-    facp_model = "Kidde VS4-G-2 (250 pts)" if est_points > 64 else "Kidde VS1-G-2 (64 pts)"
+    if sizing is None:
+        est_points = estimate_points(input_data.num_units, input_data.num_stories,
+                                     count_ai_points(input_data.ai_overrides))
+        alarm_load = alarm_load_amps(input_data.num_units, input_data.num_stories)
+        required_ah = battery_ah(alarm_load)
+        sizing = Sizing(est_points, select_panel(est_points), alarm_load, required_ah, select_battery(required_ah))
+    est_points, facp_model = sizing.points, sizing.panel
     if is_required:
         notes.append(f"System Load: {est_points} Estimated Addressable Points. Selected Panel: {facp_model}.")
     
     # 5.2 Power Calculations (24VDC)
     # Standby: 24 Hours, Alarm: 5 Minutes
-    # Avg load per strobe: 0.035A, per sounder: 0.035A
-    # Est Load: (Units + Corridors) * 0.035
-    alarm_load_amps = (input_data.num_units + (input_data.num_stories * 2)) * 0.035
-    standby_load_amps = 0.150 # Base panel load
-    
-    battery_ah = ((standby_load_amps * 24) + (alarm_load_amps * 0.0833)) * 1.2 # 20% Safety
-    batt_size = "7Ah"
-    if battery_ah > 7: batt_size = "10Ah"
-    if battery_ah > 10: batt_size = "18Ah" # Requires external box usually
+    alarm_load, required_ah, batt_size = sizing.alarm_load, sizing.required_ah, sizing.battery
     
     if is_required:
-        notes.append(f"Power Analysis: {alarm_load_amps:.2f}A Alarm Load. Battery Required: {battery_ah:.2f}Ah -> Use (2) 12V {batt_size}.")
+        notes.append(f"Power Analysis: {alarm_load:.2f}A Alarm Load. Battery Required: {required_ah:.2f}Ah -> Use (2) 12V {batt_size}.")
     
     # 3. Notification Rules (NFPA 72)
     if is_required:
@@ -120,11 +132,11 @@ def analyze(input_data: BuildingInput):
         ]
         
         # Check for Booster (BPS)
-        if alarm_load_amps > 6.0:
+        if alarm_load > SIZING["booster_threshold_amps"]:
              bom_a.append("Booster Power Supply (BPS-10A) - Load Exceeds 6A")
              
         # Tier B: Notification Logic
-        if "R-2" in input_data.occupancy.upper():
+        if profile.sleeping:
             notes.append("Sleeping Areas: 520Hz Low Frequency Sounders REQUIRED (NFPA 72 18.4.5).")
             bom_b.append(f"{input_data.num_units} x LF Sounder Bases / Mini-Horns (520Hz) [One per unit minimum]")
             bom_b.append(f"{input_data.num_stories} x Notification Circuits (Risers estimate)")
@@ -142,7 +154,8 @@ def analyze(input_data: BuildingInput):
 
     # 4. Integrate AI Vision Overrides (Phase 3: Automated Layout)
     if input_data.ai_overrides:
-        print("[CELL] Processing AI Overrides...")
+        if verbose:
+            print("[CELL] Processing AI Overrides...")
         rooms = input_data.ai_overrides.get("rooms", [])
         if rooms:
              notes.append(f"AI Vision Analysis Integrated: {len(rooms)} Rooms Scanned.")
@@ -162,9 +175,51 @@ def analyze(input_data: BuildingInput):
         "system_type": system_type,
         "compliance_notes": notes,
         "bom_tier_a": bom_a,
-        "bom_tier_b": bom_b
+        "bom_tier_b": bom_b,
+        "point_count": est_points
     }
 
+# Records sized per NumPy pass (and streamed per chunk)
+BATCH_CHUNK_SIZE = int(os.getenv("CELL_BATCH_CHUNK_SIZE", "1000"))
+MAX_BATCH_SIZE = int(os.getenv("CELL_MAX_BATCH_SIZE", "50000"))
+
+def iter_batch(inputs: List[BuildingInput], chunk_size: int = BATCH_CHUNK_SIZE):
+    """
+    Yields one NDJSON line per input, in order. Point counts, loads and battery Ah are
+    computed for a whole chunk at once; only the rule lookup and BOM text are per record.
+    """
+    for start in range(0, len(inputs), chunk_size):
+        chunk = inputs[start:start + chunk_size]
+        sized = size_batch(
+            [b.num_units for b in chunk],
+            [b.num_stories for b in chunk],
+            [count_ai_points(b.ai_overrides) for b in chunk],
+        )
+        points = sized["points"].tolist()
+        loads = sized["alarm_load"].tolist()
+        ahs = sized["required_ah"].tolist()
+        panels = [PANEL_LABELS[i] for i in sized["panel_idx"].tolist()]
+        batteries = [BATTERY_LABELS[i] for i in sized["battery_idx"].tolist()]
+        lines = []
+        for offset, building in enumerate(chunk):
+            sizing = Sizing(points[offset], panels[offset], loads[offset], ahs[offset], batteries[offset])
+            result = design(building, sizing, verbose=False)
+            result["index"] = start + offset
+            lines.append(json.dumps(result))
+        yield "\n".join(lines) + "\n"
+
+@app.post("/analyze-batch")
+def analyze_batch(inputs: List[BuildingInput]):
+    """
+    Bulk /analyze for what-if sweeps. Streams one DesignOutput per line (NDJSON),
+    each tagged with the `index` of its input.
+    """
+    if len(inputs) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {MAX_BATCH_SIZE} buildings).")
+    print(f"[CELL] Batch analyzing {len(inputs)} buildings")
+    return StreamingResponse(iter_batch(inputs), media_type="application/x-ndjson",
+                             headers={RULESET_HEADER: ENGINE.version})
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,259 @@
+"""
+Declarative NFPA 101 / NFPA 72 rule tables and their compiled evaluator.
+
+Requirement rules are plain data: each one names an occupancy, a condition over the
+BuildingInput fields and an outcome. `RuleEngine` compiles them once at import into
+per-occupancy lists of closures, so evaluating a building is a dict lookup plus a
+few comparisons. Jurisdictions (AHJs) layer overlays on top of the base table.
+"""
+import math
+import operator
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+
+# Bump on any change to the tables below (used to invalidate cached designs)
+RULESET_VERSION = "2026.10.2"
+
+# --- Occupancy Normalization ---
+# Checked in order; first match wins. "contains" = substring of the upper-cased input,
+# "exact" = whole lower-cased input.
+OCCUPANCY_CLASSES = [
+    {"key": "r2", "match": "contains", "values": ["R-2", "RESIDENTIAL"]},
+    {"key": "assembly", "match": "exact", "values": ["assembly"]},
+    {"key": "mercantile", "match": "exact", "values": ["mercantile", "business", "mixed-use"]},
+]
+
+# --- Requirement Rules (NFPA 101) ---
+# Evaluated per occupancy by ascending priority; the first matching rule applies.
+REQUIREMENT_RULES = [
+    {
+        "id": "nfpa101-30.3.4.1",
+        "occupancy": "r2",
+        "priority": 10,
+        # NFPA 101 30.3.4.1: Manual fire alarm system required if > 4 stories OR > 16 dwelling units.
+        "when": {"any": [["num_stories", ">", 4], ["num_units", ">", 16]]},
+        "required": True,
+        "note": "System REQUIRED: R-2 Occupancy > 16 Units or > 4 Stories (NFPA 101 30.3.4.1).",
+    },
+    {
+        "id": "r2-local-amendment-check",
+        "occupancy": "r2",
+        "priority": 20,
+        # Often a gray area or local amendment, flagging for check.
+        "when": {"all": [["num_units", ">", 11]]},
+        "required": False,
+        "note": "Check Local Amendments: R-2 with 12-16 units often requires system in South FL.",
+    },
+    {
+        "id": "r2-below-threshold",
+        "occupancy": "r2",
+        "priority": 99,
+        "when": {},
+        "required": False,
+        "note": "System may NOT be required (Below R-2 Thresholds). Verify Local Amendments.",
+    },
+    {
+        "id": "assembly-voice-evac",
+        "occupancy": "assembly",
+        "priority": 10,
+        "when": {"all": [["occupants", ">", 300]]},
+        "required": True,
+        "system_type": "Voice/Evac",
+        "note": "Voice Evacuation System REQUIRED (>300 occupants/Assembly).",
+    },
+    {
+        "id": "nfpa101-36.3.4.1",
+        "occupancy": "mercantile",
+        "priority": 10,
+        # NFPA 101 36.3.4.1 (Mercantile): Class A > 30,000 sqft or 3 stories.
+        "when": {"any": [["sqft", ">", 30000], ["num_stories", ">", 3]]},
+        "required": True,
+        "note": "System REQUIRED: Mercantile/Business threshold met.",
+    },
+]
+
+# --- AHJ Overlays ---
+# Rules with an existing id replace it; new ids are merged in by priority.
+AHJ_OVERLAYS = {
+    "south_fl": [
+        {
+            "id": "south-fl-r2-12-16-units",
+            "occupancy": "r2",
+            "priority": 15,
+            "when": {"all": [["num_units", ">", 11]]},
+            "required": True,
+            "note": "System REQUIRED: R-2 with 12-16 Units (South FL Local Amendment).",
+        },
+    ],
+}
+
+# --- Sizing Tables (NFPA 72 Ch. 10 secondary power) ---
+SIZING = {
+    # (max points, panel), ascending
+    "panels": [(64, "Kidde VS1-G-2 (64 pts)"), (math.inf, "Kidde VS4-G-2 (250 pts)")],
+    # (max Ah, battery), ascending
+    "batteries": [(7, "7Ah"), (10, "10Ah"), (math.inf, "18Ah")],
+    "device_load_amps": 0.035,  # per strobe / sounder
+    "standby_load_amps": 0.150,  # base panel load
+    "standby_hours": 24,
+    "alarm_hours": 0.0833,  # 5 minutes
+    "battery_safety_factor": 1.2,
+    "booster_threshold_amps": 6.0,
+}
+
+OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+
+class OccupancyProfile(NamedTuple):
+    key: Optional[str]
+    sleeping: bool  # R-2 sleeping units (low-frequency sounders)
+
+
+class RuleOutcome(NamedTuple):
+    rule_id: Optional[str]
+    required: bool
+    system_type: Optional[str]
+    notes: Tuple[str, ...]
+
+
+NO_RULE = RuleOutcome(None, False, None, ())
+
+
+@lru_cache(maxsize=1024)
+def normalize_occupancy(occupancy: str) -> OccupancyProfile:
+    """Maps a free-text occupancy to its rule-table key (cached; inputs repeat a lot)."""
+    upper, lower = occupancy.upper(), occupancy.lower()
+    key = None
+    for occ in OCCUPANCY_CLASSES:
+        if occ["match"] == "contains":
+            hit = any(v in upper for v in occ["values"])
+        else:
+            hit = lower in occ["values"]
+        if hit:
+            key = occ["key"]
+            break
+    return OccupancyProfile(key, "R-2" in upper)
+
+
+def normalize_ahj(ahj: Optional[str]) -> Optional[str]:
+    if not ahj:
+        return None
+    return ahj.strip().lower().replace("-", "_").replace(" ", "_")
+
+
+def _compile_condition(when: Dict[str, List]) -> Callable[[Any], bool]:
+    def clause(field: str, op: str, value: Any) -> Callable[[Any], bool]:
+        fn = OPERATORS[op]
+        return lambda data: fn(getattr(data, field), value)
+
+    if "any" in when:
+        clauses = [clause(*c) for c in when["any"]]
+        return lambda data: any(c(data) for c in clauses)
+    if "all" in when:
+        clauses = [clause(*c) for c in when["all"]]
+        return lambda data: all(c(data) for c in clauses)
+    return lambda data: True
+
+
+def _merge(base: List[dict], overlay: List[dict]) -> List[dict]:
+    merged = {rule["id"]: rule for rule in base}
+    for rule in overlay:
+        merged[rule["id"]] = rule
+    return list(merged.values())
+
+
+def compile_rules(rules: List[dict]) -> Dict[str, List[Tuple[Callable[[Any], bool], RuleOutcome]]]:
+    """Groups rules by occupancy, orders them by priority and compiles their conditions."""
+    compiled: Dict[str, List[Tuple[Callable[[Any], bool], RuleOutcome]]] = {}
+    for rule in sorted(rules, key=lambda r: r.get("priority", 50)):
+        outcome = RuleOutcome(
+            rule["id"],
+            rule.get("required", False),
+            rule.get("system_type"),
+            (rule["note"],) if rule.get("note") else (),
+        )
+        compiled.setdefault(rule["occupancy"], []).append((_compile_condition(rule.get("when", {})), outcome))
+    return compiled
+
+
+class RuleEngine:
+    """Base rule table plus one pre-merged table per AHJ overlay, all compiled up front."""
+
+    def __init__(self, rules: List[dict], overlays: Dict[str, List[dict]]):
+        self.version = RULESET_VERSION
+        self._tables = {None: compile_rules(rules)}
+        for ahj, overlay in overlays.items():
+            self._tables[normalize_ahj(ahj)] = compile_rules(_merge(rules, overlay))
+
+    @property
+    def jurisdictions(self) -> List[str]:
+        return sorted(k for k in self._tables if k)
+
+    def evaluate(self, data: Any, occupancy_key: Optional[str], ahj: Optional[str] = None) -> RuleOutcome:
+        """First matching requirement rule for this occupancy (unknown AHJs use the base table)."""
+        table = self._tables.get(normalize_ahj(ahj)) or self._tables[None]
+        for condition, outcome in table.get(occupancy_key, ()):
+            if condition(data):
+                return outcome
+        return NO_RULE
+
+
+def _threshold_lookup(table: List[Tuple[float, str]]) -> Callable[[float], str]:
+    limits = [limit for limit, _ in table]
+    labels = [label for _, label in table]
+    return lambda value: labels[bisect_left(limits, value)]
+
+
+select_panel = _threshold_lookup(SIZING["panels"])
+select_battery = _threshold_lookup(SIZING["batteries"])
+
+
+def estimate_points(num_units: int, num_stories: int, ai_points: int = 0) -> int:
+    """1 per Unit + 2 per Corridor + Pull Stations (+ AI-detected devices)."""
+    return num_units + (num_stories * 2) + (num_stories * 2 + 1) + ai_points
+
+
+def alarm_load_amps(num_units: int, num_stories: int) -> float:
+    """(Units + Corridors) * per-device load."""
+    return (num_units + (num_stories * 2)) * SIZING["device_load_amps"]
+
+
+def battery_ah(alarm_load: float) -> float:
+    return ((SIZING["standby_load_amps"] * SIZING["standby_hours"]) +
+            (alarm_load * SIZING["alarm_hours"])) * SIZING["battery_safety_factor"]
+
+
+def size_batch(num_units, num_stories, ai_points) -> Dict[str, np.ndarray]:
+    """
+    Vectorized points / alarm load / battery Ah / panel + battery choice for many buildings.
+    Same arithmetic (in the same order) as the scalar helpers above, so results match exactly.
+    """
+    units = np.asarray(num_units, dtype=np.int64)
+    stories = np.asarray(num_stories, dtype=np.int64)
+    points = units + (stories * 2) + (stories * 2 + 1) + np.asarray(ai_points, dtype=np.int64)
+    load = (units + (stories * 2)) * SIZING["device_load_amps"]
+    ah = ((SIZING["standby_load_amps"] * SIZING["standby_hours"]) +
+          (load * SIZING["alarm_hours"])) * SIZING["battery_safety_factor"]
+    panel_limits = [limit for limit, _ in SIZING["panels"]]
+    battery_limits = [limit for limit, _ in SIZING["batteries"]]
+    return {
+        "points": points,
+        "alarm_load": load,
+        "required_ah": ah,
+        # side="left" == bisect_left
+        "panel_idx": np.searchsorted(panel_limits, points, side="left"),
+        "battery_idx": np.searchsorted(battery_limits, ah, side="left"),
+    }
+
+
+# Compiled once at startup
+ENGINE = RuleEngine(REQUIREMENT_RULES, AHJ_OVERLAYS)
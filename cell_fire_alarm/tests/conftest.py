@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The Cell runs from cell_fire_alarm/ and imports its modules top-level ("from rules import ...").
+# Appended, not prepended: Cortex's tests own the top-level `main` when both suites run together.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
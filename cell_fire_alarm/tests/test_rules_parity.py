@@ -0,0 +1,150 @@
+"""
+The compiled rule tables must reproduce the original hand-written analyze() chain
+(kept below as the reference) for every building without an AHJ overlay.
+"""
+import importlib.util
+import itertools
+import json
+import os
+import rules
+
+# Loaded under its own name: Cortex also has a top-level `main` module
+_spec = importlib.util.spec_from_file_location(
+    "cell_main", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py"))
+cell_main = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(cell_main)
+
+
+def baseline_analyze(input_data) -> dict:
+    """The pre-rules-engine analyze() body, unchanged apart from the removed logging."""
+    notes, bom_a, bom_b = [], [], []
+    system_type = "None Required"
+    is_required = False
+
+    if "R-2" in input_data.occupancy.upper() or "RESIDENTIAL" in input_data.occupancy.upper():
+        if input_data.num_stories > 4 or input_data.num_units > 16:
+            is_required = True
+            notes.append("System REQUIRED: R-2 Occupancy > 16 Units or > 4 Stories (NFPA 101 30.3.4.1).")
+        elif input_data.num_units > 11:
+            notes.append("Check Local Amendments: R-2 with 12-16 units often requires system in South FL.")
+        else:
+            notes.append("System may NOT be required (Below R-2 Thresholds). Verify Local Amendments.")
+    elif input_data.occupancy.lower() == "assembly":
+        if input_data.occupants > 300:
+            is_required = True
+            notes.append("Voice Evacuation System REQUIRED (>300 occupants/Assembly).")
+            system_type = "Voice/Evac"
+    elif input_data.occupancy.lower() in ["mercantile", "business", "mixed-use"]:
+        if input_data.sqft > 30000 or input_data.num_stories > 3:
+            is_required = True
+            notes.append("System REQUIRED: Mercantile/Business threshold met.")
+
+    if is_required and system_type == "None Required":
+        system_type = "Addressable Fire Alarm (Manual + Automatic)"
+        if input_data.sprinklered:
+            notes.append("Sprinkler Monitoring REQUIRED (NFPA 72 / FBC 903.4).")
+
+    est_points = input_data.num_units + (input_data.num_stories * 2) + (input_data.num_stories * 2 + 1)
+    if input_data.ai_overrides:
+        for r in input_data.ai_overrides.get("rooms", []):
+            est_points += len(r.get("components", []))
+    facp_model = "Kidde VS4-G-2 (250 pts)" if est_points > 64 else "Kidde VS1-G-2 (64 pts)"
+    if is_required:
+        notes.append(f"System Load: {est_points} Estimated Addressable Points. Selected Panel: {facp_model}.")
+
+    alarm_load_amps = (input_data.num_units + (input_data.num_stories * 2)) * 0.035
+    standby_load_amps = 0.150
+    battery_ah = ((standby_load_amps * 24) + (alarm_load_amps * 0.0833)) * 1.2
+    batt_size = "7Ah"
+    if battery_ah > 7: batt_size = "10Ah"
+    if battery_ah > 10: batt_size = "18Ah"
+    if is_required:
+        notes.append(f"Power Analysis: {alarm_load_amps:.2f}A Alarm Load. Battery Required: {battery_ah:.2f}Ah -> Use (2) 12V {batt_size}.")
+
+    if is_required:
+        bom_a = [f"Addressable FACP: {facp_model}", "Remote Annunciator (Lobby)", "Cellular/IP Communicator",
+                 "Surge Protection (120V)", "Doc Box", f"Batteries: (2) 12V {batt_size}"]
+        if alarm_load_amps > 6.0:
+            bom_a.append("Booster Power Supply (BPS-10A) - Load Exceeds 6A")
+        if "R-2" in input_data.occupancy.upper():
+            notes.append("Sleeping Areas: 520Hz Low Frequency Sounders REQUIRED (NFPA 72 18.4.5).")
+            bom_b.append(f"{input_data.num_units} x LF Sounder Bases / Mini-Horns (520Hz) [One per unit minimum]")
+            bom_b.append(f"{input_data.num_stories} x Notification Circuits (Risers estimate)")
+        notes.append("Corridors/Common Areas: Visible Notification (Strobes) required per ADA/NFPA.")
+        bom_b.append("Wall Strobes (15cd/30cd based on coverage)")
+        if input_data.sprinklered:
+            bom_b.append("Monitor Modules (Flow/Tamper per Riser)")
+        else:
+            notes.append("Full Smoke Detection likely required if NOT sprinklered (Check 101.30.3.4.4).")
+        bom_b.append(f"{input_data.num_stories * 2 + 1} x Pull Stations (Exits + FACP)")
+
+    if input_data.ai_overrides:
+        rooms = input_data.ai_overrides.get("rooms", [])
+        if rooms:
+            notes.append(f"AI Vision Analysis Integrated: {len(rooms)} Rooms Scanned.")
+            for room in rooms:
+                for comp in room.get("components", []):
+                    bom_b.append(f"[AI MATCH] {comp.get('generic', 'Device')} in "
+                                 f"{room.get('name', 'Unknown Room')} -> Spec: {comp.get('sku', 'Generic')}")
+
+    return {"status": "Design Generated", "system_type": system_type, "compliance_notes": notes,
+            "bom_tier_a": bom_a, "bom_tier_b": bom_b}
+
+
+OCCUPANCIES = ["R-2", "r-2 apartments", "Residential", "Assembly", "assembly", "Mercantile", "business",
+               "Mixed-Use", "Storage", ""]
+AI_OVERRIDES = [{}, {"rooms": [{"name": "Unit 101", "components": [{"sku": "SD-1", "generic": "Smoke"}] * 3},
+                               {"name": "Lobby"}]}]
+
+
+def buildings():
+    grid = itertools.product(
+        OCCUPANCIES,
+        [0, 30000, 30001],  # sqft
+        [0, 300, 301],  # occupants
+        [1, 3, 4, 5, 40],  # stories
+        [0, 11, 12, 16, 17, 80],  # units
+        [False, True],  # sprinklered
+        AI_OVERRIDES,
+    )
+    for occupancy, sqft, occupants, stories, units, sprinklered, ai in grid:
+        yield cell_main.BuildingInput(occupancy=occupancy, sqft=sqft, ceiling_height=10, occupants=occupants,
+                                      num_stories=stories, num_units=units, sprinklered=sprinklered,
+                                      ai_overrides=ai)
+
+
+def without_point_count(result: dict) -> dict:
+    return {k: v for k, v in result.items() if k not in ("point_count", "index")}
+
+
+def test_design_matches_the_baseline_chain():
+    for building in buildings():
+        assert without_point_count(cell_main.design(building, verbose=False)) == baseline_analyze(building), \
+            building
+
+
+def test_batch_path_matches_single_designs():
+    inputs = list(buildings())
+    lines = "".join(cell_main.iter_batch(inputs, chunk_size=97)).splitlines()
+    assert len(lines) == len(inputs)
+    for index, (line, building) in enumerate(zip(lines, inputs)):
+        result = json.loads(line)
+        assert result["index"] == index
+        assert without_point_count(result) == baseline_analyze(building), building
+
+
+def test_south_fl_overlay_only_changes_the_12_to_16_unit_band():
+    for units in (11, 12, 16, 17):
+        base = dict(occupancy="R-2", sqft=9000, ceiling_height=10, num_stories=3, num_units=units)
+        local = cell_main.design(cell_main.BuildingInput(ahj="south_fl", **base), verbose=False)
+        plain = cell_main.design(cell_main.BuildingInput(**base), verbose=False)
+        assert (local == plain) == (units not in (12, 13, 14, 15, 16))
+        if 12 <= units <= 16:
+            assert local["system_type"] == "Addressable Fire Alarm (Manual + Automatic)"
+            assert "South FL Local Amendment" in local["compliance_notes"][0]
+
+
+def test_sizing_thresholds():
+    assert rules.select_panel(64) == "Kidde VS1-G-2 (64 pts)"
+    assert rules.select_panel(65) == "Kidde VS4-G-2 (250 pts)"
+    assert [rules.select_battery(ah) for ah in (7, 7.01, 10, 10.01)] == ["7Ah", "10Ah", "10Ah", "18Ah"]
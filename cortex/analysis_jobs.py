@@ -0,0 +1,385 @@
+"""
+Asynchronous PDF analysis jobs, with the database as the queue.
+
+An upload is stored as an `analysis_jobs` row and answered with its id right away.
+Workers claim the oldest queued job with a conditional UPDATE (one winner per job on any
+database), run the vision pipeline, and write per-sheet progress and a heartbeat as they
+go. A job whose worker died (stale heartbeat) is re-queued, up to ANALYSIS_MAX_ATTEMPTS.
+
+Workers run inside the API process (ANALYSIS_WORKERS per instance) and/or as standalone
+processes against the same database; throughput scales with either.
+
+Usage (standalone worker):
+    python analysis_jobs.py [--workers 2]
+"""
+import os
+import sys
+import copy
+import time
+import signal
+import socket
+import asyncio
+import argparse
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+import sqlalchemy
+from sqlalchemy.orm import undefer
+from database import SessionLocal, ReadSessionLocal
+from models import AnalysisJob
+
+# Worker Pool (in-process workers per API instance; 0 = only standalone workers run jobs)
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "1"))
+ANALYSIS_POLL_INTERVAL = float(os.getenv("ANALYSIS_POLL_INTERVAL_SECONDS", "1.0"))
+# Leases: a running job whose heartbeat is older than this is assumed lost and re-queued
+ANALYSIS_LEASE_SECONDS = int(os.getenv("ANALYSIS_LEASE_SECONDS", "120"))
+ANALYSIS_MAX_ATTEMPTS = int(os.getenv("ANALYSIS_MAX_ATTEMPTS", "3"))
+HEARTBEAT_SECONDS = max(ANALYSIS_LEASE_SECONDS / 4, 1.0)
+# Limits / Retention
+ANALYSIS_MAX_UPLOAD_BYTES = int(os.getenv("ANALYSIS_MAX_UPLOAD_MB", "100")) * 1024 * 1024
+ANALYSIS_RETENTION_HOURS = int(os.getenv("ANALYSIS_JOB_RETENTION_HOURS", "72"))
+# On shutdown, in-flight jobs get this long before they are handed back to the queue
+ANALYSIS_SHUTDOWN_GRACE_SECONDS = float(os.getenv("ANALYSIS_SHUTDOWN_GRACE_SECONDS", "20"))
+CLAIM_CANDIDATES = 5
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+FINISHED = (DONE, FAILED)
+
+
+# --- Queue operations (blocking; run them in the threadpool from async code) ---
+
+def enqueue(pdf_content: bytes, filename: Optional[str], options: Dict[str, Any]) -> str:
+    with SessionLocal() as db:
+        job = AnalysisJob(
+            status=QUEUED,
+            filename=filename,
+            file_size=len(pdf_content),
+            options=options,
+            progress={"stage": QUEUED},
+            pdf_data=pdf_content,
+        )
+        db.add(job)
+        db.commit()
+        return job.id
+
+
+def _claimable(now: datetime):
+    stale = now - timedelta(seconds=ANALYSIS_LEASE_SECONDS)
+    return sqlalchemy.or_(
+        AnalysisJob.status == QUEUED,
+        sqlalchemy.and_(AnalysisJob.status == RUNNING, AnalysisJob.heartbeat_at < stale,
+                        AnalysisJob.attempts < ANALYSIS_MAX_ATTEMPTS),
+    )
+
+
+def claim(worker_id: str) -> Optional[str]:
+    """Leases the oldest claimable job to `worker_id`; None when the queue is empty."""
+    now = datetime.utcnow()
+    with SessionLocal() as db:
+        # Lost jobs that used up their attempts are failed rather than retried forever
+        db.query(AnalysisJob).filter(
+            AnalysisJob.status == RUNNING,
+            AnalysisJob.heartbeat_at < now - timedelta(seconds=ANALYSIS_LEASE_SECONDS),
+            AnalysisJob.attempts >= ANALYSIS_MAX_ATTEMPTS,
+        ).update({"status": FAILED, "error": "Worker lost (attempts exhausted).", "finished_at": now,
+                  "pdf_data": None}, synchronize_session=False)
+        db.commit()
+
+        candidates = db.query(AnalysisJob.id).filter(_claimable(now)) \
+            .order_by(AnalysisJob.created_at).limit(CLAIM_CANDIDATES).all()
+        for (job_id,) in candidates:
+            # Conditional update: whoever changes the row first owns the job
+            claimed = db.query(AnalysisJob).filter(AnalysisJob.id == job_id, _claimable(now)).update(
+                {"status": RUNNING, "worker_id": worker_id, "started_at": now, "heartbeat_at": now,
+                 "attempts": AnalysisJob.attempts + 1, "error": None, "progress": {"stage": "starting"}},
+                synchronize_session=False,
+            )
+            db.commit()
+            if claimed:
+                return job_id
+    return None
+
+
+def load_job(job_id: str) -> Optional[Dict[str, Any]]:
+    with SessionLocal() as db:
+        job = db.query(AnalysisJob).options(undefer(AnalysisJob.pdf_data)).filter(AnalysisJob.id == job_id).first()
+        if job is None:
+            return None
+        return {"id": job.id, "filename": job.filename, "options": job.options or {},
+                "attempts": job.attempts, "pdf_data": job.pdf_data}
+
+
+def update_job(job_id: str, worker_id: str, **fields: Any) -> bool:
+    """Writes fields + heartbeat while `worker_id` still holds the lease (False if it lost it)."""
+    fields.setdefault("heartbeat_at", datetime.utcnow())
+    with SessionLocal() as db:
+        updated = db.query(AnalysisJob).filter(
+            AnalysisJob.id == job_id, AnalysisJob.worker_id == worker_id, AnalysisJob.status == RUNNING
+        ).update(fields, synchronize_session=False)
+        db.commit()
+    return bool(updated)
+
+
+def release_worker_jobs(worker_id: str) -> int:
+    """Hands a stopping worker's unfinished jobs back to the queue."""
+    with SessionLocal() as db:
+        count = db.query(AnalysisJob).filter(
+            AnalysisJob.worker_id == worker_id, AnalysisJob.status == RUNNING
+        ).update({"status": QUEUED, "worker_id": None, "attempts": AnalysisJob.attempts - 1},
+                 synchronize_session=False)
+        db.commit()
+    return count
+
+
+def purge_finished(hours: int = ANALYSIS_RETENTION_HOURS) -> int:
+    cutoff = datetime.utcnow() - timedelta(hours=hours)
+    with SessionLocal() as db:
+        count = db.query(AnalysisJob).filter(
+            AnalysisJob.status.in_(FINISHED), AnalysisJob.finished_at < cutoff
+        ).delete(synchronize_session=False)
+        db.commit()
+    return count
+
+
+def job_status(db, job_id: str, include_result: bool = True) -> Optional[Dict[str, Any]]:
+    """Public view of a job; `result` is loaded only once the job is done."""
+    job = db.query(AnalysisJob).filter(AnalysisJob.id == job_id).first()
+    if job is None:
+        return None
+    status = {
+        "id": job.id,
+        "status": job.status,
+        "filename": job.filename,
+        "progress": job.progress or {},
+        "error": job.error,
+        "attempts": job.attempts,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if include_result and job.status == DONE:
+        status["result"] = job.result
+    return status
+
+
+def queue_counts() -> Dict[str, int]:
+    with ReadSessionLocal() as db:
+        rows = db.query(AnalysisJob.status, sqlalchemy.func.count()).group_by(AnalysisJob.status).all()
+    return {status: count for status, count in rows}
+
+
+# --- Workers ---
+
+class JobWorker:
+    """One job at a time: claim, run the pipeline, persist progress/result."""
+
+    def __init__(self, worker_id: str, pool: "WorkerPool"):
+        self.worker_id = worker_id
+        self.pool = pool
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while not self.pool.stopping:
+            try:
+                job_id = await loop.run_in_executor(None, claim, self.worker_id)
+            except Exception as e:
+                print(f"[CORTEX] Job claim failed ({self.worker_id}): {e}")
+                job_id = None
+            if job_id is None:
+                await self.pool.wait_for_work()
+                continue
+            await self.process(job_id)
+
+    async def process(self, job_id: str):
+        import vision_pipeline
+        loop = asyncio.get_running_loop()
+        job = await loop.run_in_executor(None, load_job, job_id)
+        if job is None or job["pdf_data"] is None:
+            # Never leave a claimed job RUNNING (it would be retried until its attempts run out)
+            error = "Job not found." if job is None else "Job has no PDF data."
+            try:
+                saved = await loop.run_in_executor(None, lambda: update_job(
+                    job_id, self.worker_id, status=FAILED, error=error, progress={"stage": FAILED},
+                    finished_at=datetime.utcnow(), pdf_data=None))
+            except Exception as e:
+                print(f"[CORTEX] Job {job_id} result write failed: {e}")
+                saved = False
+            self.pool.record(FAILED if saved else "lost", 0)
+            print(f"[CORTEX] Job {job_id} failed: {error}")
+            return
+        options = job["options"]
+        progress = {"stage": "rasterizing", "total_pages": None, "pages_done": 0, "pages": []}
+        changed = asyncio.Event()
+        start = time.perf_counter()
+        print(f"[CORTEX] Job {job_id} started on {self.worker_id} (attempt {job['attempts']})")
+
+        def on_event(name: str, data: Dict[str, Any]):
+            if name == "start":
+                progress.update(stage="analyzing", total_pages=data["total_pages"], selected_pages=len(data["pages"]))
+            elif name == "page":
+                progress["pages_done"] += 1
+                progress["pages"].append(data)
+            elif name == "enrich":
+                progress.update(stage="enriching", rooms=data["rooms"])
+            changed.set()
+
+        async def persist():
+            # One writer per job: progress snapshots land in order, and the heartbeat keeps the lease
+            while True:
+                try:
+                    await asyncio.wait_for(changed.wait(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                changed.clear()
+                try:
+                    await loop.run_in_executor(None, lambda: update_job(
+                        job_id, self.worker_id, progress=copy.deepcopy(progress)))
+                except Exception as e:
+                    print(f"[CORTEX] Job {job_id} progress write failed: {e}")
+
+        writer = asyncio.ensure_future(persist())
+        try:
+            db = ReadSessionLocal()
+            try:
+                result = await vision_pipeline.analyze_pdf(
+                    job["pdf_data"], job["filename"], db,
+                    all_pages=options.get("all_pages", False), max_pages=options.get("max_pages"),
+                    use_cache=not options.get("bypass_cache", False), workflow_id=job_id, on_event=on_event,
+                )
+            finally:
+                db.close()
+            fields = {"status": DONE, "result": result}
+            error = None
+        except vision_pipeline.PdfConversionError as e:
+            fields, error = {"status": FAILED}, str(e)
+        except Exception as e:
+            print(f"[CORTEX] Job {job_id} failed: {e}")
+            fields, error = {"status": FAILED}, str(e)
+        finally:
+            writer.cancel()
+
+        progress["stage"] = fields["status"]
+        fields.update(progress=progress, error=error, finished_at=datetime.utcnow(), pdf_data=None)
+        try:
+            saved = await loop.run_in_executor(None, lambda: update_job(job_id, self.worker_id, **fields))
+        except Exception as e:
+            print(f"[CORTEX] Job {job_id} result write failed: {e}")
+            saved = False
+        elapsed_ms = int((time.perf_counter() - start) * 1000)
+        self.pool.record(fields["status"] if saved else "lost", elapsed_ms)
+        print(f"[CORTEX] Job {job_id} {fields['status']} in {elapsed_ms}ms" + ("" if saved else " (lease lost)"))
+
+
+class WorkerPool:
+    """Async workers on the current event loop (the API's, or a standalone worker's)."""
+
+    def __init__(self):
+        self.workers: List[JobWorker] = []
+        self.stopping = False
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._last_purge = 0.0
+        self.completed = 0
+        self.failed = 0
+        self.lost = 0
+        self.last_job_ms = 0
+
+    def start(self, count: int = ANALYSIS_WORKERS):
+        if count <= 0 or self._tasks:
+            return
+        self.stopping = False
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        prefix = f"{socket.gethostname()}-{os.getpid()}"
+        self.workers = [JobWorker(f"{prefix}-{i}", self) for i in range(count)]
+        self._tasks = [asyncio.ensure_future(w.run()) for w in self.workers]
+        print(f"[CORTEX] Analysis workers started: {count}")
+
+    def notify(self):
+        """New job enqueued by this process: wake idle workers now instead of at the next poll."""
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def wait_for_work(self):
+        if time.monotonic() - self._last_purge > 3600:
+            self._last_purge = time.monotonic()
+            try:
+                purged = await asyncio.get_running_loop().run_in_executor(None, purge_finished)
+                if purged:
+                    print(f"[CORTEX] Purged {purged} finished analysis jobs")
+            except Exception as e:
+                print(f"[CORTEX] Job purge failed: {e}")
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), ANALYSIS_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def stop(self, grace: float = ANALYSIS_SHUTDOWN_GRACE_SECONDS):
+        """Lets in-flight jobs finish within `grace`, then re-queues whatever is left."""
+        if not self._tasks:
+            return
+        self.stopping = True
+        self._wakeup.set()
+        done, pending = await asyncio.wait(self._tasks, timeout=grace)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            try:
+                released = await loop.run_in_executor(None, release_worker_jobs, worker.worker_id)
+                if released:
+                    print(f"[CORTEX] Re-queued {released} job(s) from {worker.worker_id}")
+            except Exception as e:
+                print(f"[CORTEX] Could not re-queue jobs of {worker.worker_id}: {e}")
+        self._tasks = []
+
+    def record(self, outcome: str, elapsed_ms: int):
+        if outcome == DONE:
+            self.completed += 1
+        elif outcome == FAILED:
+            self.failed += 1
+        else:
+            self.lost += 1
+        self.last_job_ms = elapsed_ms
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": len(self._tasks),
+            "completed": self.completed,
+            "failed": self.failed,
+            "lost": self.lost,
+            "last_job_ms": self.last_job_ms,
+        }
+
+
+# In-process pool (started by the API lifespan when ANALYSIS_WORKERS > 0)
+job_pool = WorkerPool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=max(ANALYSIS_WORKERS, 1))
+    args = parser.parse_args()
+
+    async def serve():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        job_pool.start(args.workers)
+        await stop.wait()
+        print("[CORTEX] Stopping analysis workers...")
+        await job_pool.stop()
+
+    asyncio.run(serve())
+    if "vision_pipeline" in sys.modules:
+        sys.modules["vision_pipeline"].shutdown_pools()
+    from audit_log import audit_sink
+    audit_sink.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import os
+import time
+import uuid
+import queue
+import atexit
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from database import SessionLocal
+from models import AiAuditLog
+
+# Flush Policy
+AUDIT_QUEUE_MAX = int(os.getenv("AUDIT_QUEUE_MAX", "10000"))  # events held in memory at most
+AUDIT_FLUSH_SIZE = int(os.getenv("AUDIT_FLUSH_SIZE", "200"))  # rows per bulk insert
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL_SECONDS", "1.0"))
+AUDIT_WRITE_RETRIES = 3
+
+_STOP = object()
+
+
+class AuditSink:
+    """
+    In-memory queue of AiAuditLog rows, written by one background thread in bulk inserts
+    when AUDIT_FLUSH_SIZE rows are waiting or AUDIT_FLUSH_INTERVAL has passed.
+    `emit` never blocks: with the queue full (DB down or too slow) new events are dropped
+    and counted. `stop` flushes whatever is queued.
+    """
+
+    def __init__(self, maxsize: int = AUDIT_QUEUE_MAX):
+        self._queue: "queue.Queue" = queue.Queue(maxsize=maxsize)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_ms = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="audit-sink", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Flushes everything queued, then ends the writer thread."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)  # may exceed maxsize by one; the writer is draining
+        thread.join(timeout)
+
+    def emit(self, **fields: Any):
+        """Queues one audit row (AiAuditLog column names). Cheap; safe from any thread."""
+        fields.setdefault("id", str(uuid.uuid4()))
+        fields.setdefault("created_at", datetime.utcnow())
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait(fields)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                print(f"[CORTEX] Audit queue full; {self.dropped} events dropped so far.")
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch: List[Dict[str, Any]] = []
+            deadline = time.monotonic() + AUDIT_FLUSH_INTERVAL
+            while len(batch) < AUDIT_FLUSH_SIZE:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=max(timeout, 0)) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    # Drain the rest (producers may still be racing the shutdown)
+                    while True:
+                        try:
+                            rest = self._queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        if rest is not _STOP:
+                            batch.append(rest)
+                    break
+                batch.append(item)
+            for start in range(0, len(batch), AUDIT_FLUSH_SIZE):
+                self._write(batch[start:start + AUDIT_FLUSH_SIZE])
+
+    def _write(self, rows: List[Dict[str, Any]]):
+        start = time.perf_counter()
+        for attempt in range(AUDIT_WRITE_RETRIES):
+            try:
+                with SessionLocal() as db:
+                    db.bulk_insert_mappings(AiAuditLog, rows)
+                    db.commit()
+                self.written += len(rows)
+                self.flushes += 1
+                self.last_flush_ms = int((time.perf_counter() - start) * 1000)
+                return
+            except Exception as e:
+                if attempt == AUDIT_WRITE_RETRIES - 1:
+                    self.failed += len(rows)
+                    print(f"[CORTEX] Audit flush failed, {len(rows)} events lost: {e}")
+                    return
+                time.sleep(0.5 * 2 ** attempt)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+
+# Process-wide sink (started on first event; the app lifespan stops/flushes it)
+audit_sink = AuditSink()
+atexit.register(audit_sink.stop)
@@ -0,0 +1,87 @@
+"""
+Retrieval benchmark: recall@k and latency of every RAG retrieval path.
+
+Ground truth is the exact cosine top-k over all component embeddings (brute force),
+so the numbers answer two questions at once: how much semantic recall the keyword
+paths (ILIKE, BM25) give up, and how close the ANN index gets to exact search.
+
+Usage:
+    python bench_retrieval.py [--k 5] [--repeats 20] [--queries "Smoke,Strobe,..."]
+"""
+import argparse
+import time
+from typing import Callable, Dict, List
+import numpy as np
+from database import SessionLocal
+from component_index import component_index
+from embeddings import embed_texts
+from vector_search import embedding_matrix, vector_search, hybrid_search
+from vision_service import VisionEngine
+
+DEFAULT_QUERIES = [
+    "Smoke", "Smoke Detector", "Heat Detector", "Strobe", "Horn Strobe", "LF Sounder",
+    "Pull Station", "Duct Detector", "Monitor Module", "Relay Module", "Speaker",
+    "Annunciator", "Battery", "Sprinkler Flow Switch", "Beam Detector",
+]
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    return float(np.percentile(samples, pct)) if samples else 0.0
+
+
+def run_method(name: str, fn: Callable[[int], List[Dict]], truth: List[set], repeats: int, k: int) -> Dict:
+    latencies, recalls = [], []
+    for i, expected in enumerate(truth):
+        results = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            results = fn(i)
+            latencies.append((time.perf_counter() - start) * 1000)
+        got = {r["part_number"] for r in results[:k]}
+        recalls.append(len(got & expected) / len(expected) if expected else 1.0)
+    return {
+        "method": name,
+        "recall": float(np.mean(recalls)) if recalls else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--queries", type=str, default=",".join(DEFAULT_QUERIES))
+    args = parser.parse_args()
+
+    queries = [q.strip() for q in args.queries.split(",") if q.strip()]
+    db = SessionLocal()
+    vision = VisionEngine()  # retrieval only; the model client is never created
+
+    print("Loading indexes...")
+    component_index.refresh(db)
+    embedding_matrix.refresh(db)
+    vectors = embed_texts(queries)
+
+    # Exact ground truth (brute-force cosine over the whole catalog)
+    truth = [{r["part_number"] for r in embedding_matrix.search(v, limit=args.k)} for v in vectors]
+    keywords = [VisionEngine._keywords(q) for q in queries]
+
+    methods = {
+        "ilike_sql": lambda i: vision.search_keyword_sql(db, keywords[i], limit=args.k),
+        "bm25_index": lambda i: component_index.search(keywords[i], limit=args.k),
+        "vector_ann": lambda i: vector_search(db, vectors[i], limit=args.k),
+        "hybrid": lambda i: hybrid_search(db, keywords[i], vectors[i], limit=args.k),
+    }
+
+    rows = [run_method(name, fn, truth, args.repeats, args.k) for name, fn in methods.items()]
+    db.close()
+
+    print(f"\n{len(queries)} queries, k={args.k}, {args.repeats} repeats, dialect={db.bind.dialect.name}")
+    print(f"{'method':<12} {'recall@k':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for row in rows:
+        print(f"{row['method']:<12} {row['recall']:>9.3f} {row['p50_ms']:>9.3f} {row['p95_ms']:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+App-lifetime HTTP client for Cortex -> Cell calls.
+
+One pooled `httpx.AsyncClient` per process (keep-alive, HTTP/2 when the Cell is
+reached over https), per-call deadlines, bounded retries with jittered backoff,
+and a circuit breaker that fails fast while the Cell is down.
+"""
+import os
+import time
+import random
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+import httpx
+
+CELL_URL = os.getenv("CELL_URL", "http://localhost:8002")
+
+# Connection Pool
+CELL_MAX_CONNECTIONS = int(os.getenv("CELL_MAX_CONNECTIONS", "100"))
+CELL_MAX_KEEPALIVE = int(os.getenv("CELL_MAX_KEEPALIVE", "20"))
+CELL_KEEPALIVE_EXPIRY = float(os.getenv("CELL_KEEPALIVE_EXPIRY", "30"))
+# HTTP/2 is negotiated via TLS ALPN, so it only applies to https:// Cell URLs
+CELL_HTTP2 = os.getenv("CELL_HTTP2", "true").lower() == "true"
+
+# Deadlines (seconds). Waiting for a free pooled connection is bounded too (backpressure).
+CELL_CONNECT_TIMEOUT = float(os.getenv("CELL_CONNECT_TIMEOUT", "2"))
+CELL_READ_TIMEOUT = float(os.getenv("CELL_READ_TIMEOUT", "10"))
+CELL_POOL_TIMEOUT = float(os.getenv("CELL_POOL_TIMEOUT", "5"))
+
+# Retries (on connection errors, timeouts and 502/503/504; every Cell endpoint is side-effect free)
+CELL_RETRIES = int(os.getenv("CELL_RETRIES", "2"))
+CELL_RETRY_BACKOFF = float(os.getenv("CELL_RETRY_BACKOFF", "0.2"))
+RETRY_STATUS_CODES = {502, 503, 504}
+
+# Circuit Breaker
+CELL_BREAKER_THRESHOLD = int(os.getenv("CELL_BREAKER_THRESHOLD", "5"))
+CELL_BREAKER_RESET_SECONDS = float(os.getenv("CELL_BREAKER_RESET_SECONDS", "30"))
+
+
+class CircuitOpenError(Exception):
+    """Raised without touching the network while the breaker is open."""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"Cell circuit open; retry in {retry_after:.0f}s")
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `threshold` consecutive failed calls.
+    open -> half_open after `reset_seconds`; one trial call is let through.
+    half_open -> closed on success, back to open on failure; a trial that ends with neither
+    (cancelled mid-call) is released so the next call can try again.
+    """
+
+    def __init__(self, threshold: int = CELL_BREAKER_THRESHOLD, reset_seconds: float = CELL_BREAKER_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._trial_in_flight = False
+
+    def before_call(self) -> bool:
+        """Raises CircuitOpenError, or lets the call through. Returns True for the half-open trial call."""
+        if self.state == "open":
+            remaining = self.reset_seconds - (time.monotonic() - self.opened_at)
+            if remaining > 0:
+                raise CircuitOpenError(remaining)
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._trial_in_flight:
+                raise CircuitOpenError(self.reset_seconds)
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def release_trial(self):
+        """Ends a trial call that recorded no outcome; the breaker stays half-open."""
+        self._trial_in_flight = False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self._trial_in_flight = False
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state != "open":
+                self.times_opened += 1
+                print(f"[CORTEX] Cell circuit OPEN after {self.failures} failures.")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "consecutive_failures": self.failures, "times_opened": self.times_opened}
+
+
+class CellClient:
+    def __init__(self, base_url: str = CELL_URL):
+        self.base_url = base_url
+        self.breaker = CircuitBreaker()
+        self._client: Optional[httpx.AsyncClient] = None
+        self.in_flight = 0
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+
+    def _build_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=CELL_MAX_CONNECTIONS,
+            max_keepalive_connections=CELL_MAX_KEEPALIVE,
+            keepalive_expiry=CELL_KEEPALIVE_EXPIRY,
+        )
+        timeout = httpx.Timeout(CELL_READ_TIMEOUT, connect=CELL_CONNECT_TIMEOUT, pool=CELL_POOL_TIMEOUT)
+        http2 = CELL_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401  (httpx[http2])
+            except ImportError:
+                print("[CORTEX] h2 not installed; Cell client falls back to HTTP/1.1.")
+                http2 = False
+        return httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=timeout, http2=http2)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+        return self._client
+
+    async def start(self):
+        _ = self.client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        # Full jitter: uniform(0, base * 2^attempt)
+        return random.uniform(0, CELL_RETRY_BACKOFF * (2 ** attempt))
+
+    async def request(self, method: str, path: str, payload: Any = None,
+                      timeout: Optional[float] = None) -> httpx.Response:
+        """Request with retries; raises CircuitOpenError, httpx.HTTPStatusError or httpx.TransportError."""
+        trial = self.breaker.before_call()
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            for attempt in range(CELL_RETRIES + 1):
+                try:
+                    response = await self.client.request(method, path, json=payload,
+                                                         timeout=timeout or httpx.USE_CLIENT_DEFAULT)
+                    if response.status_code in RETRY_STATUS_CODES and attempt < CELL_RETRIES:
+                        raise httpx.HTTPStatusError("retryable", request=response.request, response=response)
+                    response.raise_for_status()
+                    self.breaker.record_success()
+                    return response
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code not in RETRY_STATUS_CODES:
+                        # The Cell answered; a 4xx/500 is a bad request or bug, not an outage
+                        self.breaker.record_success()
+                        raise
+                    if attempt == CELL_RETRIES:
+                        raise
+                except httpx.TransportError:
+                    if attempt == CELL_RETRIES:
+                        raise
+                self.retries += 1
+                await asyncio.sleep(self._backoff(attempt))
+        except httpx.TransportError:
+            self._record_failure()
+            raise
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code in RETRY_STATUS_CODES:
+                self._record_failure()
+            raise
+        except Exception:
+            # Anything unexpected (e.g. httpx.DecodingError) counts against the Cell too
+            self._record_failure()
+            raise
+        finally:
+            self.in_flight -= 1
+            if trial:
+                # Cancelled before an outcome was recorded (no-op otherwise)
+                self.breaker.release_trial()
+
+    @asynccontextmanager
+    async def stream(self, method: str, path: str, payload: Any):
+        """Streaming request (no retries once bytes may have been relayed)."""
+        trial = self.breaker.before_call()
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            try:
+                request = self.client.build_request(method, path, json=payload, timeout=httpx.Timeout(
+                    None, connect=CELL_CONNECT_TIMEOUT, pool=CELL_POOL_TIMEOUT))
+                response = await self.client.send(request, stream=True)
+            except Exception:
+                self._record_failure()
+                raise
+            if response.is_error:
+                await response.aread()
+                await response.aclose()
+                if response.status_code in RETRY_STATUS_CODES:
+                    self._record_failure()
+                else:
+                    self.breaker.record_success()
+                response.raise_for_status()
+            self.breaker.record_success()
+            try:
+                yield response
+            finally:
+                await response.aclose()
+        finally:
+            self.in_flight -= 1
+            if trial:
+                self.breaker.release_trial()
+
+    def _record_failure(self):
+        self.failures += 1
+        self.breaker.record_failure()
+
+    def pool_stats(self) -> Dict[str, int]:
+        """Connection counts from httpcore's pool (private API; empty if it changes)."""
+        try:
+            connections = self._client._transport._pool.connections
+        except AttributeError:
+            return {}
+        return {
+            "connections": len(connections),
+            "idle": sum(1 for c in connections if c.is_idle()),
+            "http2": sum(1 for c in connections if "HTTP/2" in repr(c)),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "in_flight": self.in_flight,
+            "limits": {"max_connections": CELL_MAX_CONNECTIONS, "max_keepalive": CELL_MAX_KEEPALIVE},
+            "pool": self.pool_stats() if self._client is not None else {},
+            "breaker": self.breaker.stats(),
+        }
+
+
+# Process-wide client (opened/closed by the app lifespan)
+cell_client = CellClient()
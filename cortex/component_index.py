@@ -0,0 +1,96 @@
+import time
+import threading
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from database import ReadSessionLocal
+from models import Component
+from search_index import BM25Index, tokenize
+
+
+def component_tokens(part_number: Optional[str], category: Optional[str], description: Optional[str]) -> List[str]:
+    tokens = tokenize(part_number) + tokenize(category) + tokenize(description)
+    if part_number:
+        # Keep the whole SKU as one token too, so "SD-355" hits exactly
+        tokens.append(part_number.lower())
+    return tokens
+
+
+class ComponentIndex:
+    """
+    Keyword index over the component catalog, built from the `components` table.
+    Rebuilt in the background at startup and after ingestion; until the first build
+    finishes, `ready` is False and callers fall back to SQL.
+    The index and its payloads are published together as one immutable snapshot, so a
+    search running during a rebuild never pairs the new index with the old rows.
+    """
+
+    def __init__(self):
+        self._snapshot: Optional[Tuple[BM25Index, List[Dict]]] = None
+        self._lock = threading.Lock()
+        self.built_at: Optional[float] = None
+        self.build_ms = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._snapshot is not None
+
+    def refresh(self, db: Optional[Session] = None) -> int:
+        """Rebuilds the index from the DB and swaps it in atomically. Returns the doc count."""
+        start = time.perf_counter()
+        owns_session = db is None
+        db = db or ReadSessionLocal()
+        try:
+            payloads = []
+            token_lists = []
+            # Column projection: never load the embedding vectors here
+            rows = db.query(
+                Component.part_number, Component.category, Component.description, Component.price
+            ).yield_per(5000)
+            for r in rows:
+                payloads.append({
+                    "part_number": r.part_number,
+                    "category": r.category,
+                    "description": r.description,
+                    "price": r.price
+                })
+                token_lists.append(component_tokens(r.part_number, r.category, r.description))
+        finally:
+            if owns_session:
+                db.close()
+
+        index = BM25Index.build(token_lists)
+        with self._lock:
+            self._snapshot = (index, payloads)
+            self.built_at = time.time()
+            self.build_ms = int((time.perf_counter() - start) * 1000)
+        print(f"[CORTEX] Component index built: {len(payloads)} components in {self.build_ms}ms.")
+        return len(payloads)
+
+    def search(self, keywords: List[str], limit: int = 5, require_all: bool = True) -> List[Dict]:
+        snapshot = self._snapshot
+        if snapshot is None:
+            return []
+        index, payloads = snapshot
+        words = []
+        for keyword in keywords:
+            # A full SKU ("SD-355") is matched as one token; anything else is tokenized
+            if keyword.lower() in index.postings:
+                words.append(keyword.lower())
+            else:
+                words.extend(tokenize(keyword))
+        return [dict(payloads[doc_idx], score=round(score, 4))
+                for doc_idx, score in index.search(words, limit=limit, require_all=require_all)]
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "ready": snapshot is not None,
+            "documents": len(snapshot[1]) if snapshot else 0,
+            "terms": len(snapshot[0].vocabulary) if snapshot else 0,
+            "build_ms": self.build_ms,
+            "built_at": self.built_at,
+        }
+
+
+# Process-wide catalog index
+component_index = ComponentIndex()
@@ -0,0 +1,90 @@
+import os
+import copy
+import json
+import hashlib
+import time
+import threading
+from typing import Any, Dict, Optional
+from ttl_cache import TTLCache
+
+# Eviction Policy
+DESIGN_CACHE_SIZE = int(os.getenv("DESIGN_CACHE_SIZE", "2048"))  # 0 disables memoization
+DESIGN_CACHE_TTL_SECONDS = float(os.getenv("DESIGN_CACHE_TTL_SECONDS", "600"))
+# While serving hits, re-read the Cell's rule set version at most this often
+VERSION_CHECK_SECONDS = float(os.getenv("DESIGN_CACHE_VERSION_CHECK_SECONDS", "30"))
+
+# Header the Cell sets on every design response
+RULESET_HEADER = "X-Ruleset-Version"
+
+_cache = TTLCache(maxsize=DESIGN_CACHE_SIZE, ttl=DESIGN_CACHE_TTL_SECONDS)
+_lock = threading.Lock()
+_ruleset_version: Optional[str] = None
+_invalidations = 0
+_version_checked_at = 0.0
+
+
+def normalize_input(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Folds inputs the Cell treats identically onto one form: occupancy matching is
+    case-insensitive and AHJ names are slugged (" South-FL " == "south_fl").
+    """
+    normalized = dict(data)
+    normalized["occupancy"] = (normalized.get("occupancy") or "").lower()
+    ahj = normalized.get("ahj")
+    normalized["ahj"] = ahj.strip().lower().replace("-", "_").replace(" ", "_") if ahj else None
+    normalized["ai_overrides"] = normalized.get("ai_overrides") or {}
+    return normalized
+
+
+def design_key(data: Dict[str, Any]) -> str:
+    """Canonical hash of a full BuildingInput (ai_overrides included) under the current rule set."""
+    canonical = json.dumps(normalize_input(data), sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(f"{_ruleset_version}:{canonical}".encode()).hexdigest()
+
+
+def get(key: str) -> Optional[Dict[str, Any]]:
+    entry = _cache.get(key)
+    return copy.deepcopy(entry) if entry is not None else None
+
+
+def put(data: Dict[str, Any], result: Dict[str, Any], ruleset_version: Optional[str]):
+    """Stores a Cell result; a new rule set version first drops everything cached."""
+    observe_version(ruleset_version)
+    _cache.set(design_key(data), copy.deepcopy(result))
+
+
+def observe_version(ruleset_version: Optional[str]):
+    """Called with the version header of every Cell response (batch included)."""
+    global _ruleset_version, _invalidations, _version_checked_at
+    if not ruleset_version:
+        return
+    _version_checked_at = time.monotonic()
+    if ruleset_version == _ruleset_version:
+        return
+    with _lock:
+        if ruleset_version == _ruleset_version:
+            return
+        if _ruleset_version is not None:
+            _invalidations += 1
+            print(f"[CORTEX] Cell rule set {_ruleset_version} -> {ruleset_version}; design cache cleared.")
+        _ruleset_version = ruleset_version
+        _cache.clear()
+
+
+def version_check_due() -> bool:
+    """True when hits have been served for VERSION_CHECK_SECONDS without hearing from the Cell."""
+    global _version_checked_at
+    now = time.monotonic()
+    if now - _version_checked_at < VERSION_CHECK_SECONDS:
+        return False
+    _version_checked_at = now  # one caller does the check
+    return True
+
+
+def clear():
+    _cache.clear()
+
+
+def stats() -> Dict[str, Any]:
+    return dict(_cache.stats(), ruleset_version=_ruleset_version, invalidations=_invalidations,
+                ttl_seconds=DESIGN_CACHE_TTL_SECONDS)
@@ -0,0 +1,144 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+import numpy as np
+
+# Constants
+PROJECT_ID = os.getenv("GCP_PROJECT", "cicuma-fire-1767585900")
+LOCATION = "us-central1"
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-004")
+EMBEDDING_DIM = 768
+# vertex | stub
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "vertex")
+# Texts per embedding request and concurrent requests (batched ingestion)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_RETRIES = 3
+
+
+class EmbeddingBackend:
+    """Turns texts into EMBEDDING_DIM vectors. Subclasses implement `embed`."""
+    name = "base"
+    max_batch_size = EMBEDDING_BATCH_SIZE
+
+    def embed(self, texts: List[str], task_type: str = "RETRIEVAL_QUERY") -> List[List[float]]:
+        raise NotImplementedError
+
+
+class VertexEmbeddingBackend(EmbeddingBackend):
+    """Vertex AI text embeddings; the model is loaded once per process."""
+    name = "vertex"
+    max_batch_size = 250  # Vertex limit on instances per request
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL):
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from google.cloud import aiplatform
+                    from vertexai.language_models import TextEmbeddingModel
+                    aiplatform.init(project=PROJECT_ID, location=LOCATION)
+                    self._model = TextEmbeddingModel.from_pretrained(self.model_name)
+        return self._model
+
+    def embed(self, texts: List[str], task_type: str = "RETRIEVAL_QUERY") -> List[List[float]]:
+        from vertexai.language_models import TextEmbeddingInput
+        if not texts:
+            return []
+        inputs = [TextEmbeddingInput(text, task_type) for text in texts]
+        return [e.values for e in self.model.get_embeddings(inputs)]
+
+
+class StubEmbeddingBackend(EmbeddingBackend):
+    """
+    Deterministic offline embeddings (feature hashing of word tokens, L2-normalized).
+    Texts sharing words get similar vectors, so retrieval behaves plausibly in tests/dev.
+    """
+    name = "stub"
+    max_batch_size = 1000
+
+    def embed(self, texts: List[str], task_type: str = "RETRIEVAL_QUERY") -> List[List[float]]:
+        vectors = []
+        for text in texts:
+            vec = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+            for token in re.findall(r"[a-z0-9]+", (text or "").lower()):
+                digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % EMBEDDING_DIM
+                vec[bucket] += 1.0 if digest[4] & 1 else -1.0
+            norm = np.linalg.norm(vec)
+            vectors.append((vec / norm if norm else vec).tolist())
+        return vectors
+
+
+_BACKEND_FACTORIES: Dict[str, Callable[[], EmbeddingBackend]] = {
+    "vertex": VertexEmbeddingBackend,
+    "stub": StubEmbeddingBackend,
+}
+_backends: Dict[str, EmbeddingBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def register_backend(name: str, factory: Callable[[], EmbeddingBackend]):
+    _BACKEND_FACTORIES[name] = factory
+
+
+def get_backend(name: Optional[str] = None) -> EmbeddingBackend:
+    """Process-wide backend instance (EMBEDDING_BACKEND by default)."""
+    name = name or EMBEDDING_BACKEND
+    if name not in _backends:
+        with _backends_lock:
+            if name not in _backends:
+                if name not in _BACKEND_FACTORIES:
+                    raise ValueError(f"Unknown embedding backend: {name}")
+                _backends[name] = _BACKEND_FACTORIES[name]()
+    return _backends[name]
+
+
+def embed_texts(texts: List[str], task_type: str = "RETRIEVAL_QUERY",
+                backend: Optional[EmbeddingBackend] = None) -> List[List[float]]:
+    """Embeds a list of texts in one request. Use RETRIEVAL_DOCUMENT for catalog/KB rows."""
+    return (backend or get_backend()).embed(texts, task_type)
+
+
+def embed_query(text: str) -> List[float]:
+    return embed_texts([text], task_type="RETRIEVAL_QUERY")[0]
+
+
+def _embed_with_retry(backend: EmbeddingBackend, texts: List[str], task_type: str) -> List[List[float]]:
+    for attempt in range(EMBEDDING_RETRIES):
+        try:
+            return backend.embed(texts, task_type)
+        except Exception as e:
+            if attempt == EMBEDDING_RETRIES - 1:
+                print(f"Error generating embeddings for batch of {len(texts)}: {e}")
+                return [[0.0] * EMBEDDING_DIM for _ in texts]
+            time.sleep(2 ** attempt)
+
+
+def embed_batched(texts: List[str], task_type: str = "RETRIEVAL_DOCUMENT",
+                  backend: Optional[EmbeddingBackend] = None, batch_size: Optional[int] = None,
+                  concurrency: int = EMBEDDING_CONCURRENCY) -> List[List[float]]:
+    """
+    Embeds many texts as batched requests over a bounded thread pool, preserving order.
+    A batch that still fails after retries gets zero vectors (skipped by vector search).
+    """
+    backend = backend or get_backend()
+    size = min(batch_size or EMBEDDING_BATCH_SIZE, backend.max_batch_size)
+    batches = [texts[i:i + size] for i in range(0, len(texts), size)]
+    if not batches:
+        return []
+    if len(batches) == 1 or concurrency <= 1:
+        results = [_embed_with_retry(backend, b, task_type) for b in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda b: _embed_with_retry(backend, b, task_type), batches))
+    return [vec for batch in results for vec in batch]
@@ -0,0 +1,197 @@
+"""
+Sheet image preparation for the vision model.
+
+A page is rasterized at a target DPI, whitespace margins and the title block are
+trimmed, large sheets are split into overlapping tiles, and every image is encoded
+at the best quality that fits the byte budget. Runs inside the raster process pool,
+so only encoded bytes cross the process boundary.
+"""
+import io
+import os
+import math
+from typing import List, NamedTuple, Optional, Tuple
+import numpy as np
+from PIL import Image, features
+from pdf2image import convert_from_path
+
+# Rasterization
+PREP_DPI = int(os.getenv("VISION_RASTER_DPI", "150"))
+# Trimming
+TRIM_MARGINS = os.getenv("VISION_TRIM_MARGINS", "true").lower() == "true"
+TRIM_TITLE_BLOCK = os.getenv("VISION_TRIM_TITLE_BLOCK", "true").lower() == "true"
+INK_THRESHOLD = 200  # grey level below which a pixel counts as ink
+TITLE_BLOCK_SEARCH = 0.3  # title block border is looked for in this fraction of the right/bottom edge
+TITLE_BLOCK_RULE = 0.6  # a border line must cover this fraction of the sheet height/width
+TITLE_BLOCK_CELLS = 2  # ...and be joined by at least this many cell dividers
+# Tiling (sheets whose long side exceeds TILE_PX after trimming are split)
+TILE_PX = int(os.getenv("VISION_TILE_PX", "1600"))
+TILE_OVERLAP = float(os.getenv("VISION_TILE_OVERLAP", "0.12"))
+MAX_TILES = int(os.getenv("VISION_MAX_TILES", "9"))
+# Encoding
+IMAGE_FORMAT = os.getenv("VISION_IMAGE_FORMAT", "jpeg").lower()  # jpeg | webp
+IMAGE_MAX_BYTES = int(os.getenv("VISION_IMAGE_MAX_BYTES", str(700 * 1024)))
+QUALITY_LADDER = (85, 75, 65, 55, 45)
+MIME_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp"}
+
+
+class PrepSettings(NamedTuple):
+    dpi: int = PREP_DPI
+    trim_margins: bool = TRIM_MARGINS
+    trim_title_block: bool = TRIM_TITLE_BLOCK
+    tile_px: int = TILE_PX
+    overlap: float = TILE_OVERLAP
+    max_tiles: int = MAX_TILES
+    image_format: str = IMAGE_FORMAT
+    max_bytes: int = IMAGE_MAX_BYTES
+
+    def cache_tag(self) -> str:
+        """Part of the vision cache source key: different settings produce different images."""
+        return (f"dpi={self.dpi};trim={int(self.trim_margins)}{int(self.trim_title_block)}c{TITLE_BLOCK_CELLS};"
+                f"tile={self.tile_px}x{self.overlap}x{self.max_tiles};fmt={self.image_format};max={self.max_bytes}")
+
+
+DEFAULT_SETTINGS = PrepSettings()
+
+
+class Tile(NamedTuple):
+    index: int
+    count: int
+    box: Tuple[float, float, float, float]  # (left, top, right, bottom) as fractions of the trimmed sheet
+    data: bytes
+    mime_type: str
+
+    def prompt_context(self) -> str:
+        """Tells the model which part of the sheet it sees and which rooms it owns."""
+        if self.count == 1:
+            return ""
+        left, top, right, bottom = (round(v * 100) for v in self.box)
+        owns = ("Only report rooms whose name label is in this image, and skip labels in the "
+                "overlapping strip along the right and bottom edges when another region continues there "
+                "(that region reports them).")
+        return (f"This image is region {self.index + 1} of {self.count} of one drawing sheet "
+                f"(horizontal {left}-{right}%, vertical {top}-{bottom}%); neighbouring regions overlap. {owns}")
+
+
+def ink_mask(gray: np.ndarray) -> np.ndarray:
+    return gray < INK_THRESHOLD
+
+
+def trim_margins(img: Image.Image, pad: int = 8) -> Image.Image:
+    """Crops uniform whitespace around the drawing."""
+    mask = ink_mask(np.asarray(img.convert("L")))
+    rows, cols = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+    if rows.size == 0 or cols.size == 0:
+        return img
+    box = (max(cols[0] - pad, 0), max(rows[0] - pad, 0),
+           min(cols[-1] + pad + 1, img.width), min(rows[-1] + pad + 1, img.height))
+    return img.crop(box)
+
+
+def _title_rule(mask: np.ndarray) -> Optional[int]:
+    """
+    Column where a title block starts along the right edge of `mask` (None if there is none).
+
+    A long vertical line near the edge is not enough: exterior walls and grid lines look the
+    same. It must also be joined by horizontal rules that run from it to the sheet edge
+    without continuing into the drawing, i.e. the cell dividers of a title block.
+    """
+    width = mask.shape[1]
+    coverage = mask.mean(axis=0)
+    start = int(width * (1 - TITLE_BLOCK_SEARCH))
+    # Ignore the outer frame: the last few percent of the axis
+    end = width - max(int(width * 0.02), 1)
+    gap = max(int(width * 0.01), 2)
+    x = start
+    while x < end:
+        if coverage[x] < TITLE_BLOCK_RULE:
+            x += 1
+            continue
+        rule_end = x
+        while rule_end + 1 < end and coverage[rule_end + 1] >= TITLE_BLOCK_RULE:
+            rule_end += 1
+        strip = mask[:, rule_end + 1:end]
+        if strip.shape[1] >= gap:
+            across = strip.mean(axis=1) >= 0.9
+            stops_at_rule = ~mask[:, max(x - gap, 0):x].any(axis=1)
+            joined = across & stops_at_rule
+            # Count separate horizontal lines, not the rows of one thick line
+            if np.count_nonzero(np.diff(joined.astype(np.int8), prepend=0) == 1) >= TITLE_BLOCK_CELLS:
+                return x
+        x = rule_end + 1
+    return None
+
+
+def trim_title_block(img: Image.Image) -> Image.Image:
+    """
+    Drops the title block: a strip along the right (or bottom) edge separated from the
+    drawing by a rule running almost the full sheet height (or width) and divided into cells.
+    """
+    mask = ink_mask(np.asarray(img.convert("L")))
+    x = _title_rule(mask)
+    if x is not None:
+        return img.crop((0, 0, x, img.height))
+    y = _title_rule(mask.T)
+    if y is not None:
+        return img.crop((0, 0, img.width, y))
+    return img
+
+
+def tile_boxes(width: int, height: int, tile_px: int, overlap: float) -> List[Tuple[int, int, int, int]]:
+    """Overlapping grid covering the image; a single box when it already fits."""
+    def spans(length: int) -> List[Tuple[int, int]]:
+        if length <= tile_px:
+            return [(0, length)]
+        step = tile_px * (1 - overlap)
+        count = math.ceil((length - tile_px) / step) + 1
+        stride = (length - tile_px) / (count - 1)
+        return [(int(round(i * stride)), int(round(i * stride)) + tile_px) for i in range(count)]
+
+    return [(x0, y0, x1, y1) for y0, y1 in spans(height) for x0, x1 in spans(width)]
+
+
+def encode(img: Image.Image, settings: PrepSettings) -> Tuple[bytes, str]:
+    """Highest quality (then largest scale) that fits `max_bytes`."""
+    fmt = settings.image_format if settings.image_format in MIME_TYPES else "jpeg"
+    if fmt == "webp" and not features.check("webp"):
+        fmt = "jpeg"
+    img = img.convert("RGB")
+    data = b""
+    for _ in range(4):
+        for quality in QUALITY_LADDER:
+            buffer = io.BytesIO()
+            img.save(buffer, format=fmt.upper(), quality=quality, optimize=(fmt == "jpeg"))
+            data = buffer.getvalue()
+            if len(data) <= settings.max_bytes:
+                return data, MIME_TYPES[fmt]
+        img = img.resize((max(int(img.width * 0.75), 1), max(int(img.height * 0.75), 1)), Image.LANCZOS)
+    return data, MIME_TYPES[fmt]
+
+
+def prepare_image(img: Image.Image, settings: PrepSettings = DEFAULT_SETTINGS) -> List[Tile]:
+    if settings.trim_title_block:
+        img = trim_title_block(img)
+    if settings.trim_margins:
+        img = trim_margins(img)
+
+    boxes = tile_boxes(img.width, img.height, settings.tile_px, settings.overlap)
+    while len(boxes) > settings.max_tiles:
+        # Too big for the tile budget: downscale until the grid fits
+        img = img.resize((max(int(img.width * 0.85), 1), max(int(img.height * 0.85), 1)), Image.LANCZOS)
+        boxes = tile_boxes(img.width, img.height, settings.tile_px, settings.overlap)
+
+    tiles = []
+    for index, (x0, y0, x1, y1) in enumerate(boxes):
+        x1, y1 = min(x1, img.width), min(y1, img.height)
+        data, mime_type = encode(img.crop((x0, y0, x1, y1)), settings)
+        box = (x0 / img.width, y0 / img.height, x1 / img.width, y1 / img.height)
+        tiles.append(Tile(index, len(boxes), box, data, mime_type))
+    return tiles
+
+
+def prepare_page(pdf_path: str, page_number: int, settings: PrepSettings = DEFAULT_SETTINGS) -> List[Tile]:
+    """Rasterizes one page (1-based) at `settings.dpi` and returns its encoded tiles."""
+    images = convert_from_path(pdf_path, dpi=settings.dpi, first_page=page_number, last_page=page_number)
+    if not images:
+        return []
+    return prepare_image(images[0], settings)
+
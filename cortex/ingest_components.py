@@ -1,17 +1,26 @@
 import os
 import csv
-import sqlalchemy
+import json
+import time
+import uuid
+import hashlib
+import argparse
+from datetime import datetime
 from sqlalchemy.orm import Session
-from database import SessionLocal, engine, Base
+from database import SessionLocal, engine
 from models import Component
-import pandas as pd
-from typing import List
-from google.cloud import aiplatform
-from vertexai.language_models import TextEmbeddingInput, TextEmbeddingModel
+from component_index import component_index
+from vector_search import embedding_matrix
+from embeddings import get_backend, embed_batched, EmbeddingBackend, EMBEDDING_DIM
+from migrations import run_migrations
+from typing import Dict, List, Optional, Tuple
 
-# Constants
-PROJECT_ID = os.getenv("GCP_PROJECT", "cicuma-fire-1767585900")
-LOCATION = "us-central1" 
+# Rows embedded and written per DB transaction (= checkpoint interval)
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "1000"))
+# Where checkpoints go (defaults to next to the CSV)
+INGEST_CHECKPOINT_DIR = os.getenv("INGEST_CHECKPOINT_DIR")
+# Running API to tell about new rows after a standalone run (e.g. http://cortex:8000); unset = none
+CORTEX_URL = os.getenv("CORTEX_URL")
 
 def get_db():
     db = SessionLocal()
@@ -21,84 +30,260 @@ def get_db():
         db.close()
 
 def generate_embedding(text: str) -> List[float]:
-    """Generates a 768-dimensional embedding using Vertex AI."""
+    """Generates a 768-dimensional embedding using the configured backend."""
     try:
-        # Initialize Vertex AI
-        aiplatform.init(project=PROJECT_ID, location=LOCATION)
-        
-        # Load the model
-        model = TextEmbeddingModel.from_pretrained("text-embedding-004")
-        
-        # Vertex AI expects a list of inputs
-        inputs = [TextEmbeddingInput(text, "RETRIEVAL_DOCUMENT")]
-        embeddings = model.get_embeddings(inputs)
-        
-        if embeddings:
-            return embeddings[0].values
-        return [0.0] * 768
-        
+        return get_backend().embed([text], "RETRIEVAL_DOCUMENT")[0]
     except Exception as e:
         print(f"Error generating embedding for '{text[:20]}...': {e}")
-        return [0.0] * 768
+        return [0.0] * EMBEDDING_DIM
 
-def ingest_csv(csv_path: str):
-    """Reads the CSV and ingests components into the Vector DB."""
-    print("Creating database tables if they don't exist...")
-    
-    # Enable pgvector extension
-    with engine.connect() as connection:
-        connection.execute(sqlalchemy.text("CREATE EXTENSION IF NOT EXISTS vector"))
-        connection.commit()
-    
-    Base.metadata.create_all(bind=engine)
-    
-    db = SessionLocal()
-    
-    print(f"Reading CSV from {csv_path}...")
+def parse_price(value) -> float:
+    value = (value or "").strip()
+    if not value:
+        return 0.0
+    return float(value.replace('$', '').replace(',', ''))
+
+def _clean(value) -> Optional[str]:
+    value = (value or "").strip()
+    return value or None
+
+def row_to_mapping(row: dict) -> dict:
+    mapping = {
+        "category": _clean(row.get('Category')),
+        "part_number": _clean(row.get('Part Number')),
+        "description": _clean(row.get('Long Description')),
+        "price": parse_price(row.get('MSRP/Trade Price')),
+        "metadata_info": {
+            "manufacturer": _clean(row.get('Parent Category')),
+            "agency": _clean(row.get('Agency'))
+        },
+    }
+    mapping["content_hash"] = hashlib.sha256(
+        json.dumps(mapping, sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return mapping
+
+def notify_reindex(endpoint: str) -> bool:
+    """
+    Asks the API at CORTEX_URL to rebuild its in-memory index (`endpoint`, e.g.
+    "/components/reindex"), so a standalone ingestion is served without a restart.
+    Reaches one instance; behind a load balancer, call the endpoint on each replica.
+    """
+    if not CORTEX_URL:
+        print(f"CORTEX_URL is not set: call POST {endpoint} on the API to serve the new rows.")
+        return False
+    import httpx
+    url = CORTEX_URL.rstrip("/") + endpoint
     try:
-        df = pd.read_csv(csv_path)
-    except Exception as e:
-        print(f"Error reading CSV: {e}")
-        return
+        response = httpx.post(url, timeout=300)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"Reindex request to {url} failed ({e}); call it manually to serve the new rows.")
+        return False
+    print(f"API reindexed via {url}.")
+    return True
+
+def embedding_text(mapping: dict) -> str:
+    return f"{mapping['category']} {mapping['part_number']} {mapping['description']}"
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_existing_catalog(db: Session) -> Dict[str, Tuple[str, Optional[str]]]:
+    """One query: part_number -> (id, content_hash) for every catalog row."""
+    return {pn: (cid, h) for pn, cid, h in db.query(Component.part_number, Component.id, Component.content_hash)}
+
+
+class Checkpoint:
+    """
+    Progress marker persisted as `<csv name>.checkpoint.json`.
+    A re-run of the same file (same sha256) resumes after `rows_done`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable checkpoint {path}: {e}")
+
+    def resume_row(self, file_hash: str) -> int:
+        if self.data.get("file_hash") != file_hash:
+            return 0
+        return self.data.get("rows_done", 0)
+
+    def is_complete(self, file_hash: str) -> bool:
+        return self.data.get("file_hash") == file_hash and self.data.get("complete", False)
+
+    def save(self, file_hash: str, rows_done: int, complete: bool = False):
+        self.data = {
+            "file_hash": file_hash,
+            "rows_done": rows_done,
+            "complete": complete,
+            "updated_at": datetime.utcnow().isoformat(),
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)  # atomic, so a crash never leaves half a checkpoint
 
-    total = len(df)
-    print(f"Found {total} components. Starting ingestion with Vertex AI...")
-
-    count = 0
-    # Process in batches to be efficient with API calls
-    for index, row in df.iterrows():
-        full_text = f"{row['Category']} {row['Part Number']} {row['Long Description']}"
-        
-        # Simple check to avoid duplicates (naive)
-        exists = db.query(Component).filter(Component.part_number == row['Part Number']).first()
-        if exists:
-            continue
-
-        embedding = generate_embedding(full_text)
-        
-        component = Component(
-            category=row['Category'],
-            part_number=row['Part Number'],
-            description=row['Long Description'],
-            price=float(row['MSRP/Trade Price'].replace('$','').replace(',','')) if pd.notna(row['MSRP/Trade Price']) else 0.0,
-            metadata_info={
-                "manufacturer": row['Parent Category'],
-                "agency": row['Agency'] if pd.notna(row['Agency']) else None
-            },
-            embedding=embedding
+
+class IngestStats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.skipped = 0
+        self.embedded = 0
+        self.embed_failed = 0
+        self.embed_seconds = 0.0
+
+    def report(self, prefix: str = "Processed") -> str:
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        embed_rate = self.embedded / self.embed_seconds if self.embed_seconds else 0.0
+        return (
+            f"{prefix} {self.rows} rows: {self.inserted} inserted, {self.updated} updated, "
+            f"{self.unchanged} unchanged, {self.skipped} skipped, {self.embed_failed} not embedded | "
+            f"{self.rows / elapsed:.1f} rows/s, {embed_rate:.1f} embeddings/s"
         )
-        
-        db.add(component)
-        count += 1
-        
-        if count % 10 == 0:
-            print(f"Processed {count} items...")
-            db.commit()
 
+
+def write_batch(db: Session, inserts: List[dict], updates: List[dict],
+                backend: EmbeddingBackend, stats: IngestStats):
+    """
+    Embeds new/changed rows in bulk requests and writes them in one transaction.
+    A row whose embedding failed (zero vector from embed_batched) is written without a
+    content hash, so the next run sees it as changed and embeds it again.
+    """
+    rows = inserts + updates
+    if not rows:
+        return
+    embed_start = time.perf_counter()
+    embeddings = embed_batched([embedding_text(m) for m in rows], "RETRIEVAL_DOCUMENT", backend=backend)
+    stats.embed_seconds += time.perf_counter() - embed_start
+    for mapping, embedding in zip(rows, embeddings):
+        mapping["embedding"] = embedding
+        if any(embedding):
+            stats.embedded += 1
+        else:
+            mapping["content_hash"] = None
+            stats.embed_failed += 1
+
+    if inserts:
+        db.bulk_insert_mappings(Component, inserts)
+    if updates:
+        db.bulk_update_mappings(Component, updates)
     db.commit()
-    print(f"Successfully ingested {count} components into the Vector Database.")
+    stats.inserted += len(inserts)
+    stats.updated += len(updates)
+
+def _ingest_rows(db: Session, csv_path: str, backend: EmbeddingBackend, batch_size: int, start_row: int,
+                 file_hash: str, checkpoint: Checkpoint, stats: IngestStats):
+    """Reads the CSV after `start_row`, writing batches and checkpoints; totals go into `stats`."""
+    existing = load_existing_catalog(db)
+    print(f"{len(existing)} part numbers already in the catalog. Ingesting with backend '{backend.name}'...")
+
+    seen = set()
+    inserts, updates = [], []
+    row_num = 0
+    # The checkpoint stops advancing at the first batch with failed embeddings, so a re-run
+    # rescans from there (unchanged rows are skipped by hash, failed ones re-embedded)
+    safe_row = start_row
+    with open(csv_path, newline="", encoding="utf-8-sig") as f:
+        for row_num, row in enumerate(csv.DictReader(f), start=1):
+            if row_num <= start_row:
+                continue
+            stats.rows += 1
+            try:
+                mapping = row_to_mapping(row)
+            except ValueError as e:
+                print(f"Row {row_num} skipped: {e}")
+                stats.skipped += 1
+                continue
+            part_number = mapping["part_number"]
+
+            # Missing SKU or duplicate within the file
+            if not part_number or part_number in seen:
+                stats.skipped += 1
+                continue
+            seen.add(part_number)
+
+            current = existing.get(part_number)
+            if current is None:
+                mapping["id"] = str(uuid.uuid4())
+                inserts.append(mapping)
+            elif current[1] == mapping["content_hash"]:
+                stats.unchanged += 1
+            else:
+                mapping["id"] = current[0]
+                updates.append(mapping)
+
+            if len(inserts) + len(updates) >= batch_size:
+                write_batch(db, inserts, updates, backend, stats)
+                inserts, updates = [], []
+                if not stats.embed_failed:
+                    safe_row = row_num
+                checkpoint.save(file_hash, safe_row)
+                print(stats.report() + "...")
+
+    write_batch(db, inserts, updates, backend, stats)
+    if stats.embed_failed:
+        checkpoint.save(file_hash, safe_row)
+        print(stats.report("Ingested") + f" | re-run to retry the {stats.embed_failed} rows without embeddings")
+    else:
+        checkpoint.save(file_hash, row_num, complete=True)
+        print(stats.report("Successfully ingested"))
+
+def ingest_csv(csv_path: str, backend: Optional[EmbeddingBackend] = None,
+               batch_size: int = INGEST_BATCH_SIZE, resume: bool = True) -> IngestStats:
+    """
+    Streams the price book into the Vector DB with constant memory.
+    Rows are read one at a time, written in `batch_size` transactions, and a checkpoint
+    (file hash + last committed row) is saved after each one. Rows whose content hash
+    matches the catalog are skipped; changed rows are re-embedded and updated, and rows
+    without a SKU or with an unreadable price are skipped. Returns the run's stats
+    (all zero when the file was already ingested completely).
+    """
+    print("Creating database tables if they don't exist...")
+    run_migrations(engine)
+    backend = backend or get_backend()
+
+    file_hash = file_sha256(csv_path)
+    checkpoint_dir = INGEST_CHECKPOINT_DIR or os.path.dirname(os.path.abspath(csv_path))
+    checkpoint = Checkpoint(os.path.join(checkpoint_dir, os.path.basename(csv_path) + ".checkpoint.json"))
+    stats = IngestStats()
+    if resume and checkpoint.is_complete(file_hash):
+        print(f"{csv_path} is unchanged since the last complete ingestion. Nothing to do.")
+        return stats
+    start_row = checkpoint.resume_row(file_hash) if resume else 0
+    if start_row:
+        print(f"Resuming {csv_path} after row {start_row}.")
+
+    with SessionLocal() as db:
+        _ingest_rows(db, csv_path, backend, batch_size, start_row, file_hash, checkpoint, stats)
+        # Refresh the in-process indexes (ingestion inside a Cortex process), then the running API's
+        component_index.refresh(db)
+        embedding_matrix.invalidate()
+    if stats.inserted or stats.updated:
+        notify_reindex("/components/reindex")
+    return stats
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest the component price book into the catalog.")
     # Path mapped via Docker volume
-    CSV_PATH = "/data/data_base.csv"
-    ingest_csv(CSV_PATH)
+    parser.add_argument("csv_path", nargs="?", default="/data/data_base.csv")
+    parser.add_argument("--backend", default=None, help="Embedding backend (vertex | stub)")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--no-resume", action="store_true", help="Ignore any checkpoint and rescan from row 1")
+    args = parser.parse_args()
+    ingest_csv(args.csv_path, backend=get_backend(args.backend), batch_size=args.batch_size,
+               resume=not args.no_resume)
@@ -0,0 +1,322 @@
+"""
+Knowledge base ingestion.
+
+Splits extracted code text into section-aware chunks, embeds them and replaces the
+source's rows in `knowledge_base`:
+- code text dumped by documentation_support/extract_pdfs.py (NFPA_72_Extracted.md):
+  page furniture is dropped, every numbered clause ("17.7.3.2* Spot-Type Smoke Detectors.")
+  starts a section, and the titles of its parent clauses are kept as a breadcrumb;
+- plain markdown (knowledge_base/*.md): one section per heading.
+Consecutive clauses under the same titled heading are merged, and long ones split, so a
+chunk stays under KB_CHUNK_TOKENS (approximate) tokens.
+
+Usage:
+    python ingest_kb.py /data/NFPA_72_Extracted.md --source "NFPA 72" [--backend stub] [--dry-run]
+"""
+import os
+import re
+import time
+import uuid
+import argparse
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from database import SessionLocal, engine
+from models import KnowledgeBase
+from embeddings import get_backend, embed_batched, EmbeddingBackend
+from migrations import run_migrations
+from kb_index import estimate_tokens, kb_index
+from ingest_components import notify_reindex
+
+# Chunk Sizing (approximate tokens, see kb_index.estimate_tokens)
+KB_CHUNK_TOKENS = int(os.getenv("KB_CHUNK_TOKENS", "350"))
+
+PAGE_RE = re.compile(r"^## Page \d+\s*$")
+# Body chapters and annexes ("Chapter 17   Initiating Devices"); TOC entries have dot leaders instead
+PART_RE = re.compile(r"^(?:[Δ•N]\s+)?(?:Chapter (\d{1,2})|Annex ([A-Z]))\s{2,}(\S.*)$")
+# "17.7.3.2* Spot-Type ...", "A.17.7.3.2.1   Refer to ...", optionally flagged as revised/new
+CLAUSE_RE = re.compile(r"^(?:[ΔN•]\s*)?((?:[A-Z]\.)?\d{1,2}(?:\.\d+)+)(\*?)(\s+)([A-Z].*)$")
+CAPTION_RE = re.compile(r"^(Table|Figure|Exhibit)\s")
+MARKDOWN_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*\S)\s*$")
+# Repeated on every page of the extract
+NOISE_RES = [re.compile(p) for p in (
+    r"^FOR INDIVIDUAL USE ONLY$",
+    r"^Copyright \d{4} National Fire Protection Association",
+    r"^written permission of NFPA",
+    r"^[0-9A-F]{8}-[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{12}$",
+    r"^(2019 Edition )?Shaded text = Revisions\.",
+    r"^[A-Z][A-Z0-9 ,.&()'/\-–—]*72[-–]\s?\d+$",  # running header: "ANNEX A 72-237"
+    r"^---$",
+    r"^\*\[No text extracted",
+)]
+# Everything after the alphabetical index heading is page references
+END_RE = re.compile(r"^Index$")
+TITLE_MAX_WORDS = 12
+HYPHEN = "‐"  # line-break hyphen used by the extract ("detec‐")
+
+
+class Clause(NamedTuple):
+    number: str
+    title: Optional[str]
+    part: str  # "Chapter 17 Initiating Devices" / "Annex A Explanatory Material"
+    lines: List[str]
+
+
+class Chunk(NamedTuple):
+    section: str
+    content: str
+
+
+def _is_noise(line: str) -> bool:
+    return any(r.match(line) for r in NOISE_RES)
+
+
+def _number_key(number: str) -> Tuple[int, ...]:
+    return tuple(int(p) for p in number.split(".") if p.isdigit())
+
+
+def split_title(marker_space: str, rest: str) -> Tuple[Optional[str], str]:
+    """
+    "Location and Spacing." -> title only; "Visual Characteristics.    Visual notifica‐" ->
+    title + text; a clause with a wide gap right after its number has no title.
+    """
+    if len(marker_space) >= 3:
+        return None, rest
+    head, tail = (re.split(r"\s{3,}", rest, maxsplit=1) + [""])[:2]
+    if tail:
+        return head.strip(), tail.strip()
+    if rest.endswith(".") and len(rest.split()) <= TITLE_MAX_WORDS and " shall " not in rest:
+        return rest.strip(), ""
+    return None, rest
+
+
+def parse_clauses(lines: Iterable[str]) -> Iterator[Clause]:
+    """
+    Yields the numbered clauses of extracted code text, in document order.
+    Numbers are only accepted inside the chapter/annex they belong to and in ascending
+    order, so a cross-reference wrapped to the start of a line ("17.7.3.2.3.1 through")
+    is kept as text instead of starting a bogus clause.
+    """
+    part, chapter = None, None
+    last_key: Tuple[int, ...] = ()
+    current: Optional[Clause] = None
+    for raw in lines:
+        line = raw.strip()
+        if not line or PAGE_RE.match(line) or _is_noise(line):
+            continue
+        if END_RE.match(line):
+            break
+        match = PART_RE.match(line)
+        if match and "...." not in line:
+            if current:
+                yield current
+                current = None
+            chapter = match.group(1) or match.group(2)
+            label = f"Chapter {chapter}" if match.group(1) else f"Annex {chapter}"
+            part, last_key = f"{label} {match.group(3).strip()}", ()
+            continue
+        if part is None:
+            continue  # front matter and table of contents
+
+        match = CLAUSE_RE.match(line)
+        if match:
+            number = match.group(1)
+            head = number.split(".")[0]
+            key = _number_key(number)
+            # "A.14.4.3.2 Table 14.4.3.2 Item 24." is a caption inside a table, not a clause
+            caption = len(match.group(3)) < 3 and CAPTION_RE.match(match.group(4))
+            if head == chapter and key > last_key and not caption:
+                if current:
+                    yield current
+                title, text = split_title(match.group(3), match.group(4))
+                current = Clause(number, title, part, [text] if text else [])
+                last_key = key
+                continue
+        if current:
+            current.lines.append(line)
+    if current:
+        yield current
+
+
+def reflow(lines: List[str]) -> str:
+    """Joins hard-wrapped lines; list items ("(1) ...") keep their own line."""
+    out = ""
+    for line in lines:
+        if not out:
+            out = line
+        elif out.endswith(HYPHEN):
+            out = out[:-1] + line
+        elif re.match(r"^\((\d+|[a-z])\)\*?\s", line):
+            out += "\n" + line
+        else:
+            out += " " + line
+    return out
+
+
+def breadcrumb(clause: Clause, titles: Dict[str, str]) -> List[str]:
+    """Titled ancestors of a clause, outermost first. Annex A notes borrow the titles of the clause they explain."""
+    number = clause.number
+    if number.startswith("A."):
+        number = number[2:]
+    parts = number.split(".")
+    trail = [clause.part]
+    for depth in range(1, len(parts)):
+        prefix = ".".join(parts[:depth + 1])
+        if prefix != number and prefix in titles:
+            trail.append(f"{prefix} {titles[prefix].rstrip('.')}")
+    return trail
+
+
+def clause_text(clause: Clause) -> str:
+    marker = f"{clause.number} {clause.title}" if clause.title else clause.number
+    body = reflow(clause.lines)
+    return f"{marker} {body}".strip() if body else marker
+
+
+def _split_long(text: str, max_tokens: int) -> List[str]:
+    """Splits at sentence boundaries (words for run-on table text) so each piece fits `max_tokens`."""
+    pieces, current = [], ""
+    units = []
+    for sentence in re.split(r"(?<=[.;:])\s+(?=[A-Z(])", text):
+        units.extend(sentence.split(" ") if estimate_tokens(sentence) > max_tokens else [sentence])
+    for sentence in units:
+        if current and estimate_tokens(current + " " + sentence) > max_tokens:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def chunk_clauses(clauses: Iterable[Clause], source: str, max_tokens: int = KB_CHUNK_TOKENS) -> List[Chunk]:
+    """
+    Groups clauses under their nearest titled heading into chunks of at most `max_tokens`.
+    Each chunk starts with a "source > part > headings" line, so it reads on its own in a prompt.
+    """
+    titles: Dict[str, str] = {}
+    chunks: List[Chunk] = []
+    group, header, members, texts = None, "", [], []
+
+    def flush():
+        if texts:
+            section = members[0] if len(members) == 1 else f"{members[0]}-{members[-1]}"
+            chunks.append(Chunk(section, header + "\n" + "\n".join(texts)))
+
+    for clause in clauses:
+        if clause.title:
+            titles[clause.number] = clause.title
+            if not clause.lines:
+                continue  # a bare heading only shows up in its children's breadcrumb
+        trail = breadcrumb(clause, titles)
+        # The nearest titled heading (the clause itself when it has a title)
+        clause_group = f"{clause.number} {clause.title.rstrip('.')}" if clause.title else trail[-1]
+        text = clause_text(clause)
+        size = estimate_tokens(text)
+        if clause_group != group or estimate_tokens("\n".join([header] + texts)) + size > max_tokens:
+            flush()
+            group, members, texts = clause_group, [], []
+            header = " > ".join([source] + trail)
+        room = max_tokens - estimate_tokens(header)
+        if size > room:
+            flush()
+            for piece in _split_long(text, room):
+                members, texts = [clause.number], [piece]
+                flush()
+            members, texts = [], []
+            continue
+        members.append(clause.number)
+        texts.append(text)
+    flush()
+    return chunks
+
+
+def chunk_markdown(lines: Iterable[str], source: str, max_tokens: int = KB_CHUNK_TOKENS) -> List[Chunk]:
+    """One chunk per heading (split further when long), headed by its parent headings."""
+    chunks: List[Chunk] = []
+    headings: List[str] = []
+    body: List[str] = []
+
+    def flush():
+        text = "\n".join(l for l in body if l.strip()).strip()
+        if not text or not headings:
+            return
+        header = " > ".join([source] + headings)
+        for piece in (_split_long(text, max_tokens) if estimate_tokens(text) > max_tokens else [text]):
+            chunks.append(Chunk(headings[-1], header + "\n" + piece))
+
+    for raw in lines:
+        line = raw.rstrip()
+        match = MARKDOWN_HEADING_RE.match(line)
+        if match:
+            flush()
+            body = []
+            level = len(match.group(1))
+            headings = headings[:level - 1] + [match.group(2).strip("*# ")]
+        elif line.strip() != "---":
+            body.append(line)
+    flush()
+    return chunks
+
+
+def chunk_file(path: str, source: str, max_tokens: int = KB_CHUNK_TOKENS, fmt: str = "auto") -> List[Chunk]:
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    if fmt == "auto":
+        fmt = "code" if any(PART_RE.match(l) and "...." not in l for l in lines) else "markdown"
+    if fmt == "code":
+        return chunk_clauses(parse_clauses(lines), source, max_tokens)
+    return chunk_markdown(lines, source, max_tokens)
+
+
+def ingest_chunks(chunks: List[Chunk], source: str, backend: Optional[EmbeddingBackend] = None) -> int:
+    """
+    Embeds the chunks in bulk and swaps them in for every existing row of `source`
+    in one transaction (a re-run never leaves a half-replaced source behind).
+    """
+    backend = backend or get_backend()
+    start = time.perf_counter()
+    embeddings = embed_batched([c.content for c in chunks], "RETRIEVAL_DOCUMENT", backend=backend)
+    print(f"Embedded {len(chunks)} chunks with backend '{backend.name}' in {time.perf_counter() - start:.1f}s.")
+
+    db = SessionLocal()
+    try:
+        removed = db.query(KnowledgeBase).filter(KnowledgeBase.source == source).delete(synchronize_session=False)
+        db.bulk_insert_mappings(KnowledgeBase, [
+            {"id": str(uuid.uuid4()), "source": source, "section": c.section, "content": c.content,
+             "embedding": embedding}
+            for c, embedding in zip(chunks, embeddings)
+        ])
+        db.commit()
+        print(f"Replaced {removed} rows of '{source}' with {len(chunks)} chunks.")
+
+        # Refresh the in-process index (ingestion inside a Cortex process); a CLI run also tells the API
+        kb_index.refresh(db)
+    finally:
+        db.close()
+    return len(chunks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chunk, embed and load code text into the knowledge base.")
+    # Path mapped via Docker volume
+    parser.add_argument("path", nargs="?", default="/data/NFPA_72_Extracted.md")
+    parser.add_argument("--source", default="NFPA 72", help="Source label stored on every chunk (replaced as a whole)")
+    parser.add_argument("--format", default="auto", choices=["auto", "code", "markdown"])
+    parser.add_argument("--max-tokens", type=int, default=KB_CHUNK_TOKENS)
+    parser.add_argument("--backend", default=None, help="Embedding backend (vertex | stub)")
+    parser.add_argument("--dry-run", action="store_true", help="Print chunk statistics and samples; write nothing")
+    args = parser.parse_args()
+
+    chunks = chunk_file(args.path, args.source, args.max_tokens, args.format)
+    sizes = sorted(estimate_tokens(c.content) for c in chunks)
+    if sizes:
+        print(f"{len(chunks)} chunks from {args.path}: median {sizes[len(sizes) // 2]}, "
+              f"max {sizes[-1]} tokens (approx.)")
+    if args.dry_run:
+        for chunk in chunks[:3] + chunks[len(chunks) // 2:len(chunks) // 2 + 2]:
+            print(f"\n[{chunk.section}]\n{chunk.content[:600]}")
+    elif chunks:
+        print("Creating database tables if they don't exist...")
+        run_migrations(engine)
+        ingest_chunks(chunks, args.source, backend=get_backend(args.backend))
+        notify_reindex("/knowledge/reindex")
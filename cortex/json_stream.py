@@ -0,0 +1,92 @@
+"""
+Incremental parsing of JSON that is still arriving (streamed model output).
+
+`JsonArrayStream("rooms")` is fed text chunks and returns each element of the document's
+"rooms" array as soon as the element is complete, long before the closing brace of the
+whole response. Only the new text is scanned on each call.
+"""
+import re
+import json
+from typing import Any, List
+
+_INVALID = object()
+
+
+class JsonArrayStream:
+    def __init__(self, key: str):
+        self._key = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+        self._buffer = ""
+        self._pos = 0
+        self._state = "key"  # key -> items -> done
+        self._start = None  # offset of the element being read
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def done(self) -> bool:
+        return self._state == "done"
+
+    def _take(self, end: int) -> Any:
+        text = self._buffer[self._start:end].strip()
+        self._start = None
+        try:
+            return json.loads(text)
+        except ValueError:
+            return _INVALID
+
+    def feed(self, chunk: str) -> List[Any]:
+        """Appends `chunk`; returns the array elements completed by it (possibly none)."""
+        self._buffer += chunk
+        items: List[Any] = []
+        if self._state == "key":
+            match = self._key.search(self._buffer, self._pos)
+            if match is None:
+                # The key may be split across chunks: rescan a short tail next time
+                self._pos = max(self._pos, len(self._buffer) - len(self._key.pattern) - 16)
+                return items
+            self._state, self._pos = "items", match.end()
+        if self._state != "items":
+            return items
+
+        buffer, i = self._buffer, self._pos
+        while i < len(buffer):
+            ch = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 0:  # a string element just closed
+                        items.append(self._take(i + 1))
+            elif self._start is None:
+                if ch == "]":
+                    self._state = "done"
+                    i += 1
+                    break
+                if ch not in " \t\r\n,":
+                    self._start = i
+                    if ch == '"':
+                        self._in_string = True
+                    elif ch in "{[":
+                        self._depth = 1
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 0:  # scalar element followed by the end of the array
+                    items.append(self._take(i))
+                    self._state = "done"
+                    i += 1
+                    break
+                self._depth -= 1
+                if self._depth == 0:
+                    items.append(self._take(i + 1))
+            elif ch == "," and self._depth == 0:
+                items.append(self._take(i))
+            i += 1
+        self._pos = i
+        return [item for item in items if item is not _INVALID]
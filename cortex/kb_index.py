@@ -0,0 +1,259 @@
+"""
+Knowledge-base retrieval for the vision prompt.
+
+`KnowledgeIndex` keeps every `knowledge_base` chunk in memory: a BM25 index over section
+and text, plus the L2-normalized chunk embeddings for hybrid ranking. `context_for_page`
+turns a sheet's text layer into a query, ranks the chunks and packs the best ones into a
+prompt block under KB_PROMPT_TOKEN_BUDGET. Blocks are cached per query, so a plan set
+whose sheets share room types pays for retrieval once.
+"""
+import os
+import re
+import time
+import hashlib
+import threading
+from typing import Dict, List, NamedTuple, Optional
+import numpy as np
+from sqlalchemy.orm import Session
+from database import ReadSessionLocal
+from models import KnowledgeBase
+from search_index import BM25Index, tokenize
+from ttl_cache import TTLCache
+
+# Retrieval
+KB_TOP_K = int(os.getenv("KB_TOP_K", "8"))
+KB_RETRIEVAL_MODE = os.getenv("KB_RETRIEVAL_MODE", "keyword")  # keyword | hybrid
+# Weight of the vector score in hybrid mode (keyword gets 1 - alpha)
+KB_HYBRID_ALPHA = float(os.getenv("KB_HYBRID_ALPHA", "0.5"))
+# Prompt Budget (approximate tokens of injected clauses; 0 disables injection)
+KB_PROMPT_TOKEN_BUDGET = int(os.getenv("KB_PROMPT_TOKEN_BUDGET", "1200"))
+# Always part of the query: the topics every fire alarm layout needs
+KB_BASE_QUERY = os.getenv(
+    "KB_BASE_QUERY", "smoke detector spacing notification appliance audible visible location")
+KB_CONTEXT_CACHE_SIZE = 256
+CHARS_PER_TOKEN = 4
+
+# Sheet text (room labels) -> code topics the room calls for
+ROOM_TOPICS = [
+    (re.compile(r"bed ?room|sleeping"), "sleeping rooms smoke alarms low frequency audible"),
+    (re.compile(r"corridor|hallway"), "corridors smoke detectors spacing"),
+    (re.compile(r"kitchen|cooking"), "cooking appliances smoke alarms"),
+    (re.compile(r"bath ?room|shower"), "bathroom smoke alarms"),
+    (re.compile(r"garage|parking"), "heat detectors garage"),
+    (re.compile(r"mechanical|electrical|boiler"), "heat detectors mechanical electrical rooms"),
+    (re.compile(r"elevator"), "elevator recall lobby hoistway machine room"),
+    (re.compile(r"stair"), "stairways"),
+    (re.compile(r"attic"), "attic heat detectors"),
+    (re.compile(r"lobby|lounge|amenity|fitness|assembly"), "public mode visible notification"),
+    (re.compile(r"dwelling|apartment|\bunits?\b"), "dwelling units smoke alarms"),
+]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough model token count (~4 characters per token); used for chunking and budgets."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def plan_queries(page_text: str = "") -> List[str]:
+    """The base topics, then one query per room type labelled on the sheet."""
+    text = (page_text or "").lower()
+    return [KB_BASE_QUERY] + [topics for pattern, topics in ROOM_TOPICS if pattern.search(text)]
+
+
+def build_prompt_context(chunks: List[Dict], budget: int = KB_PROMPT_TOKEN_BUDGET) -> str:
+    """
+    Packs ranked chunks (best first) into a prompt block of at most `budget` tokens.
+    A chunk that does not fit is skipped, so a smaller lower-ranked one can still go in.
+    """
+    header = "Relevant NFPA code excerpts (cite the section when you apply one):"
+    used = estimate_tokens(header)
+    parts = []
+    for chunk in chunks:
+        text = f"[{chunk['section']}] {chunk['content']}"
+        cost = estimate_tokens(text) + 1
+        if used + cost > budget:
+            continue
+        parts.append(text)
+        used += cost
+    return "\n\n".join([header] + parts) if parts else ""
+
+
+class KnowledgeSnapshot(NamedTuple):
+    """One immutable build of the index; searches read a single snapshot start to finish."""
+    index: BM25Index
+    payloads: List[Dict]
+    matrix: np.ndarray  # (chunks, dim) normalized embeddings; dim 0 when none are stored
+    version: str
+
+
+class KnowledgeIndex:
+    """
+    In-memory retrieval over the `knowledge_base` table (a few thousand chunks).
+    Rebuilt in the background at startup and after ingestion; until then `ready` is False
+    and no code context is injected.
+    """
+
+    def __init__(self):
+        self._snapshot: Optional[KnowledgeSnapshot] = None
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._contexts = TTLCache(maxsize=KB_CONTEXT_CACHE_SIZE)
+        self.built_at: Optional[float] = None
+        self.build_ms = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._snapshot is not None
+
+    def current(self) -> Optional[KnowledgeSnapshot]:
+        """The published build (None until the first refresh). Pass it on to keep a request consistent."""
+        return self._snapshot
+
+    @property
+    def version(self) -> str:
+        """
+        Identifies the chunk set and retrieval settings ("" while empty). Part of the vision
+        cache keys, so re-ingestion or a new budget does not reuse analyses made with other context.
+        """
+        snapshot = self._snapshot
+        return snapshot.version if snapshot else ""
+
+    def refresh(self, db: Optional[Session] = None) -> int:
+        """Reloads all chunks from the DB and swaps the index in atomically. Returns the chunk count."""
+        start = time.perf_counter()
+        owns_session = db is None
+        db = db or ReadSessionLocal()
+        try:
+            payloads, token_lists, vectors = [], [], []
+            digest = hashlib.sha256()
+            rows = db.query(
+                KnowledgeBase.source, KnowledgeBase.section, KnowledgeBase.content, KnowledgeBase.embedding
+            ).order_by(KnowledgeBase.source, KnowledgeBase.id).yield_per(1000)
+            for r in rows:
+                payloads.append({"source": r.source, "section": r.section, "content": r.content})
+                token_lists.append(tokenize(r.section) + tokenize(r.content))
+                digest.update(f"{r.source}\0{r.section}\0{r.content}\0".encode())
+                vec = np.asarray(r.embedding if r.embedding is not None else [], dtype=np.float32)
+                norm = np.linalg.norm(vec) if vec.size else 0.0
+                vectors.append(vec / norm if norm else None)
+        finally:
+            if owns_session:
+                db.close()
+
+        index = BM25Index.build(token_lists)
+        dim = next((v.size for v in vectors if v is not None), 0)
+        matrix = np.zeros((len(vectors), dim), dtype=np.float32)
+        for i, vec in enumerate(vectors):
+            if vec is not None and vec.size == dim:
+                matrix[i] = vec
+        version = f"{digest.hexdigest()[:16]}:{KB_RETRIEVAL_MODE}:{KB_TOP_K}:{KB_PROMPT_TOKEN_BUDGET}" \
+            if payloads else ""
+        with self._lock:
+            self._snapshot = KnowledgeSnapshot(index, payloads, matrix, version)
+            self._contexts.clear()
+            self.built_at = time.time()
+            self.build_ms = int((time.perf_counter() - start) * 1000)
+        print(f"[CORTEX] Knowledge index built: {len(payloads)} chunks in {self.build_ms}ms.")
+        return len(payloads)
+
+    def ensure_loaded(self):
+        """
+        Builds the index on first use in a process that skipped the startup refresh
+        (e.g. a standalone job worker). A failure is logged and retried on the next call.
+        """
+        if self._snapshot is not None:
+            return
+        with self._build_lock:
+            if self._snapshot is None:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"[CORTEX] Knowledge index build failed: {e}")
+
+    def search(self, query: str, limit: int = KB_TOP_K, mode: Optional[str] = None,
+               snapshot: Optional[KnowledgeSnapshot] = None) -> List[Dict]:
+        """
+        Top chunks for `query`, best first. Keyword mode is pure in-memory BM25; hybrid mode
+        also embeds the query (one model call) and blends in cosine similarity.
+        """
+        snapshot = snapshot or self._snapshot
+        if snapshot is None or not snapshot.payloads:
+            return []
+        index, payloads, matrix = snapshot.index, snapshot.payloads, snapshot.matrix
+        mode = mode or KB_RETRIEVAL_MODE
+        keyword = index.search(tokenize(query), limit=limit if mode != "hybrid" else limit * 4,
+                               require_all=False)
+        if mode != "hybrid" or matrix.shape[1] == 0:
+            return [dict(payloads[i], score=round(s, 4)) for i, s in keyword[:limit]]
+
+        from embeddings import embed_query
+        try:
+            q = np.asarray(embed_query(query), dtype=np.float32)
+        except Exception as e:
+            print(f"KB Semantic Error (falling back to keyword): {e}")
+            return [dict(payloads[i], score=round(s, 4)) for i, s in keyword[:limit]]
+        norm = np.linalg.norm(q)
+        if q.size != matrix.shape[1] or norm == 0:
+            return [dict(payloads[i], score=round(s, 4)) for i, s in keyword[:limit]]
+        sims = matrix @ (q / norm)
+        k = min(limit * 4, sims.size)
+        vector_top = np.argpartition(-sims, k - 1)[:k]
+
+        best_keyword = keyword[0][1] if keyword else 1.0
+        scores: Dict[int, float] = {}
+        for i, s in keyword:
+            scores[i] = (1 - KB_HYBRID_ALPHA) * s / best_keyword
+        for i in vector_top:
+            scores[int(i)] = scores.get(int(i), 0.0) + KB_HYBRID_ALPHA * max(float(sims[i]), 0.0)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [dict(payloads[i], score=round(s, 4)) for i, s in ranked]
+
+    def retrieve(self, queries: List[str], limit: int = KB_TOP_K,
+                 snapshot: Optional[KnowledgeSnapshot] = None) -> List[Dict]:
+        """
+        Runs each query separately and interleaves their rankings (deduplicated), so one
+        room type with rare terms ("hoistway") cannot crowd the others out of the context.
+        """
+        snapshot = snapshot or self._snapshot
+        rankings = [self.search(query, limit=limit, snapshot=snapshot) for query in queries]
+        merged, seen = [], set()
+        for rank in range(limit):
+            for ranking in rankings:
+                if rank < len(ranking) and ranking[rank]["content"] not in seen:
+                    seen.add(ranking[rank]["content"])
+                    merged.append(ranking[rank])
+        return merged[:max(limit, len(queries))]
+
+    def context_for_page(self, page_text: str = "", snapshot: Optional[KnowledgeSnapshot] = None) -> str:
+        """
+        Prompt block for one sheet ("" when the knowledge base is empty or disabled).
+        Built from `snapshot` (default: the current one), whose version goes into the cache keys.
+        """
+        snapshot = snapshot or self._snapshot
+        if KB_PROMPT_TOKEN_BUDGET <= 0 or snapshot is None or not snapshot.payloads:
+            return ""
+        queries = tuple(plan_queries(page_text))
+        # Keyed by build too: a context computed from the old build during a refresh is never served later
+        key = (snapshot.version, queries)
+        context = self._contexts.get(key)
+        if context is None:
+            context = build_prompt_context(self.retrieve(list(queries), snapshot=snapshot))
+            self._contexts.set(key, context)
+        return context
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "ready": snapshot is not None,
+            "chunks": len(snapshot.payloads) if snapshot else 0,
+            "terms": len(snapshot.index.vocabulary) if snapshot else 0,
+            "mode": KB_RETRIEVAL_MODE,
+            "token_budget": KB_PROMPT_TOKEN_BUDGET,
+            "contexts": self._contexts.stats(),
+            "build_ms": self.build_ms,
+            "built_at": self.built_at,
+        }
+
+
+# Process-wide knowledge index
+kb_index = KnowledgeIndex()
@@ -1,29 +1,90 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Response
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Response, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool, iterate_in_threadpool
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session, undefer, undefer_group
 from typing import List, Optional
-import httpx
+from contextlib import asynccontextmanager, AsyncExitStack
+import asyncio
+import base64
 import os
-import re
-from pypdf import PdfReader
-import io
+import sys
 
 # DB Imports
-from database import engine, get_db, Base
-from models import Project, AiAuditLog
-from report_service import PDFReportService
+from database import engine, get_db, get_read_db, pool_stats, SessionLocal, ReadSessionLocal
+from models import Project, split_project_data
+from audit_log import audit_sink
+import report_cache
+import report_export
 
-from vision_service import VisionEngine
+from cell_client import cell_client, CircuitOpenError
+import design_cache
+import analysis_jobs
+from analysis_jobs import job_pool
+from sse import sse_event, KEEPALIVE, KEEPALIVE_SECONDS, SSE_HEADERS
 import json
-import io
-import uuid
 from datetime import datetime
 
-app = FastAPI(title="Cicuma Cortex", version="2.1.0")
+# The vision (pypdf, pdf2image, PIL, Vertex AI), retrieval (NumPy) and report (ReportLab)
+# stacks are imported on first use; `python profile_imports.py` checks startup stays lean.
 
-# Create Tables
-Base.metadata.create_all(bind=engine)
+# Schema: `python migrations.py` is the migration step. Applying it at startup is only the
+# default for SQLite, where the database file lives with the instance.
+AUTO_MIGRATE = os.getenv("CORTEX_AUTO_MIGRATE", str(engine.dialect.name == "sqlite")).lower() == "true"
+# Create the Vertex AI model client at startup (in the background) instead of on the first request
+VISION_WARMUP = os.getenv("VISION_WARMUP", "false").lower() == "true"
+
+
+def _loaded(module_name: str):
+    """The module if something already imported it (shutdown/metrics must not load stacks)."""
+    return sys.modules.get(module_name)
+
+
+def _refresh_component_index():
+    from component_index import component_index
+    component_index.refresh()
+
+
+def _load_knowledge_index():
+    from kb_index import kb_index
+    kb_index.ensure_loaded()
+
+
+def _warm_up_vision():
+    from vision_service import model_registry
+    model_registry.warm_up()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if AUTO_MIGRATE:
+        # Create Tables / apply pending migrations
+        from migrations import run_migrations
+        await run_in_threadpool(run_migrations, engine)
+    # Build the catalog keyword index in the background; retrieval uses SQL until it is ready
+    asyncio.get_running_loop().run_in_executor(None, _refresh_component_index)
+    # Same for the NFPA clause index; an analysis that starts first waits for this build
+    asyncio.get_running_loop().run_in_executor(None, _load_knowledge_index)
+    if VISION_WARMUP:
+        # Vertex AI init + model client off the startup path; /analyze-pdf waits for it if still running
+        asyncio.get_running_loop().run_in_executor(None, _warm_up_vision)
+    await cell_client.start()
+    audit_sink.start()
+    job_pool.start(analysis_jobs.ANALYSIS_WORKERS)
+    yield
+    # Unfinished analysis jobs go back to the queue for another worker
+    await job_pool.stop()
+    await cell_client.close()
+    if _loaded("vision_pipeline"):
+        _loaded("vision_pipeline").shutdown_pools()
+    report_export.shutdown_pool()
+    if _loaded("vision_cache"):
+        await run_in_threadpool(_loaded("vision_cache").flush_hits)
+    # Flush queued audit events before the process exits
+    await run_in_threadpool(audit_sink.stop)
+
+app = FastAPI(title="Cicuma Cortex", version="2.1.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -31,9 +92,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
-CELL_URL = os.getenv("CELL_URL", "http://localhost:8002")
 
 class BuildingInput(BaseModel):
     occupancy: str
@@ -43,151 +104,173 @@ class BuildingInput(BaseModel):
     num_stories: int = 1
     num_units: int = 0
     sprinklered: bool = False
+    ahj: Optional[str] = None  # Jurisdiction overlay (e.g. "south_fl")
     ai_overrides: Optional[dict] = {}
 
-from vision_service import VisionEngine
-import json
-import io
-
 @app.post("/analyze-pdf")
-async def analyze_pdf(file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def analyze_pdf(
+    file: UploadFile = File(...),
+    all_pages: bool = False,
+    max_pages: Optional[int] = None,
+    bypass_cache: bool = False,
+    db: Session = Depends(get_read_db),
+):
     """
     Ingests a PDF, visualizes it, and uses GenAI to extract building parameters.
+    By default only the first sheet is analyzed; `all_pages=true` enables multi-sheet mode,
+    where pages are rasterized one at a time on a bounded process pool and analyzed concurrently.
+    Every blocking stage runs off the event loop, so health checks and /projects stay responsive.
+    Unchanged sheets are served from the vision cache unless `bypass_cache=true`.
+    Large sets should go through POST /analyze-pdf/jobs instead (no request held open).
     """
     print(f"[CORTEX] Analyzing PDF (Visual AI): {file.filename}")
+    import vision_pipeline
     
     try:
         content = await file.read()
-        
-        # Initialize Vision Engine
-        vision = VisionEngine(db)
-        
-        # 1. Convert PDF to Image (Analyze 1st Page for now)
-        # In a real scenario, we'd        # 1. Convert PDF to Image (Analyze 1st Page for now)
-        images = vision.convert_pdf_to_images(content)
-        
-        if not images:
-            raise HTTPException(status_code=400, detail="Could not convert PDF to Image.")
-            
-        print(f"[CORTEX] Converted PDF to {len(images)} images. Analyzing Page 1...")
-        
-        # Convert first page to bytes
-        img_byte_arr = io.BytesIO()
-        images[0].save(img_byte_arr, format='JPEG')
-        img_bytes = img_byte_arr.getvalue()
-        
-        # Start Workflow ID
-        workflow_id = str(uuid.uuid4())
-        
-        # 2. Vision Analysis (RAG + Vision)
-        print("Calling vision.analyze_plan...")
-        ai_response = {}
-        
-        # Log Step 1: Vision Request
-        log_vision = AiAuditLog(
-            workflow_id=workflow_id,
-            step_name="vision_analysis",
-            input_data={"filename": file.filename, "file_size": len(content)},
-            model_name="gemini-1.0-pro-vision" # Hardcoded for now as attribute access failed
+        return await vision_pipeline.analyze_pdf(
+            content, file.filename, db, all_pages=all_pages, max_pages=max_pages, use_cache=not bypass_cache
         )
-        db.add(log_vision)
-        db.commit()
-        
-        start_time = datetime.utcnow()
-        try:
-            ai_response = vision.analyze_plan(img_bytes)
-            print(f"Vision response received (type: {type(ai_response)})")
-        except Exception as e:
-            print(f"CRITICAL ERROR in analyze_plan call: {e}")
-            ai_response = {"error": str(e)}
-        
-        # Log Step 1: Vision Response
-        log_vision.output_data = ai_response if isinstance(ai_response, dict) else {"raw": str(ai_response)}
-        log_vision.latency_ms = int((datetime.utcnow() - start_time).total_seconds() * 1000)
-        db.commit()
-
-        # 3. Parse JSON
-        ai_data = {}
-        if isinstance(ai_response, dict):
-            # It's an error or pre-parsed dict
-            if "error" in ai_response:
-                print(f"[CORTEX] Vision Error: {ai_response['error']}")
-            else:
-                ai_data = ai_response
-        else:
-            try:
-                # It's a string (JSON)
-                clean_json = ai_response.replace("```json", "").replace("```", "")
-                ai_data = json.loads(clean_json)
-                # Update log if we parsed it successfully
-                log_vision.output_data = ai_data
-                db.commit()
-            except json.JSONDecodeError:
-                print(f"[CORTEX] Failed to parse AI JSON: {ai_response}")
-
-        print(f"[CORTEX] Vision AI Result: {ai_data}")
-
-        # 4. Map to Standard Output & RAG Enrichment
-        enriched_rooms = []
-        
-        if "rooms" in ai_data and isinstance(ai_data["rooms"], list):
-            for room in ai_data["rooms"]:
-                if "needs" in room and isinstance(room["needs"], list):
-                    # RAG Step: For each need, find a component
-                    found_components = []
-                    for need in room["needs"]:
-                        
-                        # Log Step 2: RAG Retrieval
-                        log_rag = AiAuditLog(
-                            workflow_id=workflow_id,
-                            step_name="rag_retrieval",
-                            input_data={"query": need},
-                            model_name="keyword_search_ilike"
-                        )
-                        db.add(log_rag)
-                        db.commit()
-                        rag_start = datetime.utcnow()
-                        
-                        # e.g. need="Smoke" -> search DB
-                        matches = vision.retrieve_relevant_components(need, limit=1)
-                        
-                        # Log Step 2: RAG Response
-                        log_rag.output_data = {"matches": matches}
-                        log_rag.latency_ms = int((datetime.utcnow() - rag_start).total_seconds() * 1000)
-                        db.commit()
-                        
-                        if matches:
-                            # Attach the top match
-                            found_components.append({
-                                "generic": need,
-                                "sku": matches[0]["part_number"],
-                                "desc": matches[0]["description"]
-                            })
-                        else:
-                             found_components.append({"generic": need, "sku": "UNKNOWN", "desc": "No Match"})
-                    
-                    room["components"] = found_components
-                enriched_rooms.append(room)
-        
-        # Update ai_data with enriched info
-        ai_data["rooms"] = enriched_rooms
-
-        extracted_data = {
-            "occupancy": ai_data.get("occupancy", "Unknown"),
-            "sqft": 0,
-            "num_stories": 1,
-            "num_units": 0,
-            "sprinklered": False,
-            "ai_analysis": ai_data
-        }
-
-        return extracted_data
-
+    except vision_pipeline.PdfConversionError:
+        raise HTTPException(status_code=400, detail="Could not convert PDF to Image.")
     except Exception as e:
         print(f"Error processing PDF: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/analyze-pdf/stream")
+async def analyze_pdf_stream(
+    file: UploadFile = File(...),
+    all_pages: bool = False,
+    max_pages: Optional[int] = None,
+    bypass_cache: bool = False,
+):
+    """
+    /analyze-pdf as Server-Sent Events, so results render while the pipeline runs:
+    `start`, then `room` for each room as the model output is parsed, `page` when a sheet
+    is done, `components` for each room once that sheet is enriched, and finally `done`
+    with the same payload /analyze-pdf returns (or `error` with status/detail).
+    """
+    print(f"[CORTEX] Streaming PDF analysis: {file.filename}")
+    import vision_pipeline
+    content = await file.read()
+
+    async def events():
+        queue: asyncio.Queue = asyncio.Queue()
+        # Own session: request dependencies are closed before a streamed body runs
+        db = ReadSessionLocal()
+        task = asyncio.ensure_future(vision_pipeline.analyze_pdf(
+            content, file.filename, db, all_pages=all_pages, max_pages=max_pages, use_cache=not bypass_cache,
+            on_event=lambda name, data: queue.put_nowait((name, data)), progressive=True,
+        ))
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield KEEPALIVE
+                    continue
+                if item is None:
+                    break
+                yield sse_event(*item)
+            try:
+                yield sse_event("done", task.result())
+            except vision_pipeline.PdfConversionError:
+                yield sse_event("error", {"status": 400, "detail": "Could not convert PDF to Image."})
+            except Exception as e:
+                print(f"Error processing PDF: {e}")
+                yield sse_event("error", {"status": 500, "detail": str(e)})
+        finally:
+            # Client gone mid-stream: stop the pipeline
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+            db.close()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+# --- Analysis Jobs (queued /analyze-pdf) ---
+
+# Job status poll interval for the SSE stream
+JOB_EVENTS_POLL_SECONDS = float(os.getenv("ANALYSIS_EVENTS_POLL_SECONDS", "0.5"))
+
+@app.post("/analyze-pdf/jobs", status_code=202)
+async def submit_analysis_job(
+    response: Response,
+    file: UploadFile = File(...),
+    all_pages: bool = False,
+    max_pages: Optional[int] = None,
+    bypass_cache: bool = False,
+):
+    """
+    Queues a PDF analysis and returns its job id immediately. Poll `status_url` or
+    subscribe to `events_url` (SSE) for per-sheet progress; the finished job carries the
+    same payload /analyze-pdf returns.
+    """
+    content = await file.read()
+    if not content:
+        raise HTTPException(status_code=400, detail="Empty upload.")
+    if len(content) > analysis_jobs.ANALYSIS_MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="PDF too large.")
+    options = {"all_pages": all_pages, "max_pages": max_pages, "bypass_cache": bypass_cache}
+    job_id = await run_in_threadpool(analysis_jobs.enqueue, content, file.filename, options)
+    job_pool.notify()
+    print(f"[CORTEX] Analysis job queued: {job_id} ({file.filename}, {len(content)} bytes)")
+    status_url = f"/analyze-pdf/jobs/{job_id}"
+    response.headers["Location"] = status_url
+    return {"job_id": job_id, "status": analysis_jobs.QUEUED,
+            "status_url": status_url, "events_url": f"{status_url}/events"}
+
+@app.get("/analyze-pdf/jobs/{job_id}")
+def get_analysis_job(job_id: str, db: Session = Depends(get_db)):
+    """Job status and progress; `result` once the status is "done"."""
+    status = analysis_jobs.job_status(db, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
+
+@app.get("/analyze-pdf/jobs/{job_id}/events")
+async def analysis_job_events(job_id: str):
+    """
+    Server-Sent Events for one job: a `progress` event whenever its progress changes,
+    then `done` (with the result) or `failed`, and the stream ends. Reconnecting simply
+    resumes from the current state.
+    """
+    def load(include_result: bool):
+        with SessionLocal() as db:
+            return analysis_jobs.job_status(db, job_id, include_result=include_result)
+
+    first = await run_in_threadpool(load, False)
+    if first is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        last, idle = None, 0.0
+        status = first
+        while True:
+            if status["status"] in analysis_jobs.FINISHED:
+                final = await run_in_threadpool(load, True)
+                yield sse_event(final["status"], final, event_id=final["status"])
+                return
+            snapshot = (status["status"], status["progress"])
+            if snapshot != last:
+                last, idle = snapshot, 0.0
+                yield sse_event("progress", {"status": status["status"], "progress": status["progress"]})
+            elif idle >= KEEPALIVE_SECONDS:
+                idle = 0.0
+                yield KEEPALIVE
+            await asyncio.sleep(JOB_EVENTS_POLL_SECONDS)
+            idle += JOB_EVENTS_POLL_SECONDS
+            status = await run_in_threadpool(load, False)
+            if status is None:
+                yield sse_event("failed", {"id": job_id, "error": "Job not found"})
+                return
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
 # --- Project Management Endpoints ---
 
 class ProjectCreate(BaseModel):
@@ -207,7 +290,7 @@ class ProjectResponse(BaseModel):
         orm_mode = True
 
 @app.post("/projects")
-def create_project(project: ProjectCreate, db: Session = Depends(get_db)):
+def create_project(project: ProjectCreate, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     """
     Save a new project to the database.
     """
@@ -215,23 +298,78 @@ def create_project(project: ProjectCreate, db: Session = Depends(get_db)):
         name=project.name,
         location_address=project.location,
         status="SAVED",
-        data={
+        **split_project_data({
             "input": project.input_data.dict(),
             "result": project.result_data
-        }
+        })
     )
     db.add(new_project)
     db.commit()
     db.refresh(new_project)
     print(f"[CORTEX] Project Saved: {new_project.id}")
+    background_tasks.add_task(report_cache.prerender, new_project.id)
     return {"id": new_project.id, "status": "Saved"}
 
+# /projects page size
+PROJECTS_PAGE_SIZE = int(os.getenv("PROJECTS_PAGE_SIZE", "50"))
+PROJECTS_PAGE_MAX = int(os.getenv("PROJECTS_PAGE_MAX", "200"))
+
+def encode_cursor(created_at: datetime, project_id: str) -> str:
+    raw = json.dumps([created_at.isoformat(), project_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, project_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(project_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
 @app.get("/projects")
-def list_projects(db: Session = Depends(get_db)):
+def list_projects(
+    response: Response,
+    limit: int = PROJECTS_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    name_prefix: Optional[str] = None,
+    occupancy: Optional[str] = None,
+    system_type: Optional[str] = None,
+    min_sqft: Optional[int] = None,
+    max_sqft: Optional[int] = None,
+    db: Session = Depends(get_read_db),
+):
     """
-    List all projects.
+    List projects, newest first, one page at a time.
+    Pass the `X-Next-Cursor` response header back as `cursor` for the next page
+    (the header is absent on the last page). Only the listed columns are read;
+    the JSON blobs are never loaded.
     """
-    projects = db.query(Project).order_by(Project.created_at.desc()).all()
+    limit = max(1, min(limit, PROJECTS_PAGE_MAX))
+    query = db.query(
+        Project.id, Project.name, Project.location_address, Project.status, Project.created_at,
+        Project.occupancy, Project.sqft, Project.system_type, Project.point_count
+    )
+    if status:
+        query = query.filter(Project.status == status)
+    if occupancy:
+        query = query.filter(Project.occupancy == occupancy)
+    if system_type:
+        query = query.filter(Project.system_type == system_type)
+    if min_sqft is not None:
+        query = query.filter(Project.sqft >= min_sqft)
+    if max_sqft is not None:
+        query = query.filter(Project.sqft <= max_sqft)
+    if name_prefix:
+        query = query.filter(Project.name.startswith(name_prefix, autoescape=True))
+    if cursor:
+        created_at, project_id = decode_cursor(cursor)
+        query = query.filter(tuple_(Project.created_at, Project.id) < (created_at, project_id))
+    rows = query.order_by(Project.created_at.desc(), Project.id.desc()).limit(limit + 1).all()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1].created_at, rows[-1].id)
     # Simple serialization
     return [
         {
@@ -239,61 +377,157 @@ def list_projects(db: Session = Depends(get_db)):
             "name": p.name, 
             "location": p.location_address, 
             "status": p.status,
-            "created_at": p.created_at.isoformat()
+            "created_at": p.created_at.isoformat(),
+            "occupancy": p.occupancy,
+            "sqft": p.sqft,
+            "system_type": p.system_type,
+            "point_count": p.point_count
         } 
-        for p in projects
+        for p in rows
     ]
 
 @app.get("/projects/{project_id}")
-def get_project(project_id: str, db: Session = Depends(get_db)):
+def get_project(project_id: str, db: Session = Depends(get_read_db)):
     """
     Get a single project by ID.
     """
-    project = db.query(Project).filter(Project.id == project_id).first()
+    project = db.query(Project).options(undefer_group("blobs")).filter(Project.id == project_id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
+    input_data = dict(project.input_data or {})
+    input_data["ai_overrides"] = project.ai_analysis or {}
     return {
         "id": project.id,
         "name": project.name,
         "location": project.location_address,
         "status": project.status,
         "created_at": project.created_at.isoformat(),
-        "input_data": project.data.get("input"),
-        "result_data": project.data.get("result")
+        "input_data": input_data,
+        "result_data": project.result_data
     }
 
 @app.get("/projects/{project_id}/pdf")
-def generate_project_pdf(project_id: str, db: Session = Depends(get_db)):
+async def generate_project_pdf(project_id: str, request: Request, db: Session = Depends(get_read_db)):
     """
     Generate and return a PDF report for the project.
+    Reports are cached on disk per project content + template version (usually
+    pre-rendered on save) and revalidated with ETag / If-None-Match.
     """
-    project = db.query(Project).filter(Project.id == project_id).first()
+    def load():
+        project = db.query(Project).options(undefer(Project.result_data)).filter(Project.id == project_id).first()
+        return project, (report_cache.project_report_data(project) if project else None)
+
+    project, project_data = await run_in_threadpool(load)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
-        
-    # Serialize project data for the report service
-    project_data = {
-        "name": project.name,
-        "location_address": project.location_address,
-        "data": project.data
-    }
-    
-    report_service = PDFReportService()
-    pdf_buffer = report_service.generate_report(project_data)
-    
+
+    etag = report_cache.report_etag(project_id, project_data)
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "private, no-cache"}
+    client_tags = {tag.strip().replace("W/", "") for tag in request.headers.get("if-none-match", "").split(",")}
+    if f'"{etag}"' in client_tags or "*" in client_tags:
+        return Response(status_code=304, headers=headers)
+
     filename = f"{project.name.replace(' ', '_')}_Fire_Design.pdf"
-    
-    return Response(
-        content=pdf_buffer.getvalue(),
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    headers["Content-Disposition"] = f"attachment; filename={filename}"
+    if not report_cache.enabled():
+        # No disk cache: render into a spool and stream it out chunk by chunk
+        return StreamingResponse(iterate_in_threadpool(report_cache.get_report_service().stream_report(project_data)),
+                                 media_type="application/pdf", headers=headers)
+
+    # Opened before responding, so a sweep deleting the file mid-send can't fail the response
+    report = await run_in_threadpool(report_cache.open_report, project_id, project_data)
+    headers["Content-Length"] = str(os.fstat(report.fileno()).st_size)
+
+    def chunks():
+        yield from iter(lambda: report.read(64 * 1024), b"")
+
+    async def close():
+        report.close()
+
+    return ClosingStreamingResponse(iterate_in_threadpool(chunks()), close,
+                                    media_type="application/pdf", headers=headers)
+
+class ReportExportRequest(BaseModel):
+    project_ids: Optional[List[str]] = None  # explicit ids, or else the filters below
+    status: Optional[str] = None
+    name_prefix: Optional[str] = None
+    occupancy: Optional[str] = None
+    system_type: Optional[str] = None
+
+@app.post("/projects/export")
+async def export_project_reports(export: ReportExportRequest, db: Session = Depends(get_read_db)):
+    """
+    Bulk report download: a ZIP streamed while reports render in parallel
+    (process pool), with a manifest.json of per-project render timings.
+    """
+    def load():
+        query = db.query(Project).options(undefer(Project.result_data))
+        if export.project_ids is not None:
+            query = query.filter(Project.id.in_(export.project_ids[:report_export.EXPORT_MAX_PROJECTS]))
+        else:
+            if export.status:
+                query = query.filter(Project.status == export.status)
+            if export.name_prefix:
+                query = query.filter(Project.name.startswith(export.name_prefix, autoescape=True))
+            if export.occupancy:
+                query = query.filter(Project.occupancy == export.occupancy)
+            if export.system_type:
+                query = query.filter(Project.system_type == export.system_type)
+            query = query.order_by(Project.created_at.desc(), Project.id.desc())
+        return [
+            {"id": p.id, "name": p.name, "data": report_cache.project_report_data(p)}
+            for p in query.limit(report_export.EXPORT_MAX_PROJECTS)
+        ]
+
+    if export.project_ids is not None and len(export.project_ids) > report_export.EXPORT_MAX_PROJECTS:
+        raise HTTPException(status_code=413, detail=f"Too many projects (max {report_export.EXPORT_MAX_PROJECTS}).")
+    projects = await run_in_threadpool(load)
+    found = {p["id"] for p in projects}
+    missing = [pid for pid in dict.fromkeys(export.project_ids or []) if pid not in found]
+    if not projects:
+        raise HTTPException(status_code=404, detail="No projects matched")
+
+    print(f"[CORTEX] Exporting {len(projects)} project reports")
+    filename = f"Fire_Design_Reports_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.zip"
+    return StreamingResponse(
+        report_export.export_zip(projects, missing),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
     )
 
+@app.post("/components/reindex")
+def reindex_components(db: Session = Depends(get_read_db)):
+    """
+    Rebuilds the in-memory catalog index (call after an ingestion run).
+    """
+    from component_index import component_index
+    from vector_search import embedding_matrix
+    count = component_index.refresh(db)
+    embedding_matrix.invalidate()
+    return {"status": "Reindexed", **component_index.stats(), "documents": count}
+
+@app.post("/knowledge/reindex")
+def reindex_knowledge(db: Session = Depends(get_read_db)):
+    """
+    Reloads the in-memory knowledge base index (call after an ingest_kb.py run).
+    """
+    from kb_index import kb_index
+    count = kb_index.refresh(db)
+    return {"status": "Reindexed", **kb_index.stats(), "chunks": count}
+
 @app.get("/")
 def health():
     return {"status": "Cortex Online", "mode": "Orchestrator"}
 
+async def refresh_ruleset_version():
+    """Picks up a Cell rule set change (clearing the design cache); a Cell outage is ignored here."""
+    try:
+        response = await cell_client.request("GET", "/ruleset")
+        design_cache.observe_version(response.json().get("version"))
+    except Exception as e:
+        print(f"[CORTEX] Rule set version check failed: {e}")
+
 @app.post("/design/fire-alarm")
 async def generate_design(input_data: BuildingInput):
     """
@@ -303,15 +537,84 @@ async def generate_design(input_data: BuildingInput):
     3. Forwards to Cell for deterministic calculation.
     """
     print(f"[CORTEX] Received Input: {input_data}")
+    payload = input_data.dict()
+
+    # The Cell is a pure function of its input; identical payloads are served from memory
+    if design_cache.version_check_due():
+        await refresh_ruleset_version()
+    cached = design_cache.get(design_cache.design_key(payload))
+    if cached is not None:
+        return cached
     
-    async with httpx.AsyncClient() as client:
+    try:
+        # Forwarding to the Cell (pooled client; retries + circuit breaker)
+        response = await cell_client.request("POST", "/analyze", payload)
+        result = response.json()
+        design_cache.put(payload, result, response.headers.get(design_cache.RULESET_HEADER))
+        return result
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=f"Cell Unavailable: {e}",
+                            headers={"Retry-After": str(int(e.retry_after) + 1)})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Cell Communication Failed: {e}")
+
+class ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse that always awaits `on_close` once the ASGI call ends, however it ends."""
+
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
         try:
-            # Forwarding to the Cell
-            response = await client.post(f"{CELL_URL}/analyze", json=input_data.dict())
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Cell Communication Failed: {e}")
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.on_close()
+
+@app.post("/design/fire-alarm/batch")
+async def generate_design_batch(inputs: List[BuildingInput]):
+    """
+    What-if sweeps: forwards every variant to the Cell's /analyze-batch in a single
+    request and relays its NDJSON stream (one DesignOutput per line, tagged with `index`).
+    """
+    print(f"[CORTEX] Batch design: {len(inputs)} variants")
+    stack = AsyncExitStack()
+    try:
+        response = await stack.enter_async_context(
+            cell_client.stream("POST", "/analyze-batch", [i.dict() for i in inputs]))
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=f"Cell Unavailable: {e}",
+                            headers={"Retry-After": str(int(e.retry_after) + 1)})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Cell Communication Failed: {e}")
+
+    design_cache.observe_version(response.headers.get(design_cache.RULESET_HEADER))
+
+    async def relay():
+        async for chunk in response.aiter_raw():
+            yield chunk
+
+    # The upstream response is released when the relay ends, fails, or never starts
+    # (client gone before the body), so its pooled connection and breaker trial are not leaked
+    return ClosingStreamingResponse(relay(), on_close=stack.aclose, media_type="application/x-ndjson")
+
+@app.get("/metrics")
+def metrics():
+    """Runtime stats for sizing pools and caches."""
+    vision_service = _loaded("vision_service")
+    kb = _loaded("kb_index")
+    vision_cache = _loaded("vision_cache")
+    return {
+        "cell_client": cell_client.stats(),
+        "design_cache": design_cache.stats(),
+        "report_renders": report_export.stats(),
+        "audit_sink": audit_sink.stats(),
+        "db_pools": pool_stats(),
+        "analysis_jobs": dict(job_pool.stats(), queue=analysis_jobs.queue_counts()),
+        "vision_model": vision_service.model_registry.stats() if vision_service else {"loaded": False},
+        "knowledge_base": kb.kb_index.stats() if kb else {"loaded": False},
+        "vision_cache": vision_cache.stats() if vision_cache else {"loaded": False},
+    }
 
 if __name__ == "__main__":
     import uvicorn
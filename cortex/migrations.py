@@ -0,0 +1,118 @@
+"""
+Idempotent schema migrations for Cortex.
+
+`Base.metadata.create_all` only creates missing tables; columns and indexes added
+to existing tables are applied here as ordered steps recorded in `schema_migrations`.
+
+This is the deploy step that creates/updates the schema; the API only runs it at
+startup when CORTEX_AUTO_MIGRATE is on (the default for SQLite).
+
+Usage:
+    python migrations.py
+"""
+from typing import Callable, List, Tuple
+import sqlalchemy
+from sqlalchemy.engine import Connection, Engine
+from database import engine, Base
+from models import Project, SchemaMigration, split_project_data
+
+
+def column_exists(conn: Connection, table: str, column: str) -> bool:
+    return column in {c["name"] for c in sqlalchemy.inspect(conn).get_columns(table)}
+
+
+def add_column_if_missing(conn: Connection, table: str, column: str, ddl_type: str):
+    if not column_exists(conn, table, column):
+        conn.execute(sqlalchemy.text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+
+def create_index_if_missing(conn: Connection, name: str, table: str, columns: str):
+    conn.execute(sqlalchemy.text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+# --- Steps (append only; never reorder or rename applied steps) ---
+
+def _components_content_hash(conn: Connection):
+    add_column_if_missing(conn, "components", "content_hash", "VARCHAR")
+
+
+def _pgvector_ann_indexes(conn: Connection):
+    from vector_search import ensure_ann_indexes
+    ensure_ann_indexes(conn)
+
+
+def _projects_keyset_indexes(conn: Connection):
+    create_index_if_missing(conn, "ix_projects_created_at_id", "projects", "created_at, id")
+    create_index_if_missing(conn, "ix_projects_status_created_at_id", "projects", "status, created_at, id")
+    if conn.dialect.name == "postgresql":
+        # LIKE 'prefix%' can only use a btree under the C collation or a pattern opclass
+        create_index_if_missing(conn, "ix_projects_name_pattern", "projects", "name varchar_pattern_ops")
+
+
+PROJECT_HOT_COLUMNS = [
+    ("occupancy", "VARCHAR"), ("sqft", "INTEGER"), ("num_stories", "INTEGER"),
+    ("num_units", "INTEGER"), ("system_type", "VARCHAR"), ("point_count", "INTEGER"),
+]
+BACKFILL_BATCH_SIZE = 500
+
+
+def _projects_split_data(conn: Connection):
+    for column, ddl_type in PROJECT_HOT_COLUMNS:
+        add_column_if_missing(conn, "projects", column, ddl_type)
+        create_index_if_missing(conn, f"ix_projects_{column}", "projects", column)
+    for column in ("input_data", "ai_analysis", "result_data"):
+        add_column_if_missing(conn, "projects", column, "JSON")
+
+    # Backfill in keyed batches so memory stays flat on large tables
+    table = Project.__table__
+    last_id = ""
+    while True:
+        rows = conn.execute(
+            sqlalchemy.select(table.c.id, table.c.data)
+            .where(table.c.id > last_id, table.c.result_data.is_(None))
+            .order_by(table.c.id).limit(BACKFILL_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        updates = [dict(split_project_data(row.data), b_id=row.id) for row in rows]
+        conn.execute(
+            table.update().where(table.c.id == sqlalchemy.bindparam("b_id")),
+            updates,
+        )
+        last_id = rows[-1].id
+        print(f"[CORTEX] Backfilled {len(rows)} projects (through {last_id})")
+
+
+MIGRATIONS: List[Tuple[str, Callable[[Connection], None]]] = [
+    ("0001_components_content_hash", _components_content_hash),
+    ("0002_pgvector_ann_indexes", _pgvector_ann_indexes),
+    ("0003_projects_keyset_indexes", _projects_keyset_indexes),
+    ("0004_projects_split_data", _projects_split_data),
+]
+
+
+def run_migrations(bind: Engine = engine) -> List[str]:
+    """Creates missing tables, then applies pending steps in order. Returns the applied ids."""
+    if bind.dialect.name == "postgresql":
+        with bind.begin() as conn:
+            conn.execute(sqlalchemy.text("CREATE EXTENSION IF NOT EXISTS vector"))
+
+    Base.metadata.create_all(bind=bind)
+
+    applied = []
+    with bind.begin() as conn:
+        done = {row[0] for row in conn.execute(sqlalchemy.select(SchemaMigration.id))}
+    for migration_id, step in MIGRATIONS:
+        if migration_id in done:
+            continue
+        with bind.begin() as conn:
+            step(conn)
+            conn.execute(sqlalchemy.insert(SchemaMigration).values(id=migration_id))
+        applied.append(migration_id)
+        print(f"[CORTEX] Applied migration {migration_id}")
+    return applied
+
+
+if __name__ == "__main__":
+    applied = run_migrations()
+    print(f"Schema up to date ({len(applied)} migrations applied).")
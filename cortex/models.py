@@ -1,9 +1,51 @@
-from sqlalchemy import Column, String, Integer, JSON, DateTime, Boolean, Float
+from sqlalchemy import Column, String, Integer, JSON, DateTime, Boolean, Float, Index, LargeBinary
 from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import deferred
+from sqlalchemy.types import UserDefinedType
+import re
 import uuid
 from datetime import datetime
+from typing import Optional
 from database import Base
 
+class Vector(UserDefinedType):
+    """
+    pgvector `vector(n)` column without importing pgvector (and NumPy) at startup.
+    Values bind as the '[x,y,...]' literal pgvector parses and load as lists of floats;
+    SQLite stores the same text.
+    """
+    cache_ok = True
+
+    def __init__(self, dim: Optional[int] = None):
+        self.dim = dim
+
+    def get_col_spec(self, **kw):
+        return "VECTOR" if self.dim is None else f"VECTOR({self.dim})"
+
+    def bind_processor(self, dialect):
+        def process(value):
+            if value is None or isinstance(value, str):
+                return value
+            return "[" + ",".join(str(float(v)) for v in value) + "]"
+        return process
+
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            if not isinstance(value, str):
+                return value
+            return [float(v) for v in value.strip("[]").split(",") if v]
+        return process
+
+    class comparator_factory(UserDefinedType.Comparator):
+        def l2_distance(self, other):
+            return self.op("<->", return_type=Float)(other)
+
+        def max_inner_product(self, other):
+            return self.op("<#>", return_type=Float)(other)
+
+        def cosine_distance(self, other):
+            return self.op("<=>", return_type=Float)(other)
+
 class Project(Base):
     __tablename__ = "projects"
 
@@ -12,11 +54,64 @@ class Project(Base):
     location_address = Column(String, nullable=True)
     status = Column(String, default="DRAFT") # DRAFT, ANALYZING, COMPLIANT
     
-    # Store the entire intake form and result here
-    data = Column(JSON, default={}) 
+    # Hot fields, copied out of the intake form / Cell result so they can be filtered on
+    occupancy = Column(String, index=True, nullable=True)
+    sqft = Column(Integer, index=True, nullable=True)
+    num_stories = Column(Integer, index=True, nullable=True)
+    num_units = Column(Integer, index=True, nullable=True)
+    system_type = Column(String, index=True, nullable=True)
+    point_count = Column(Integer, index=True, nullable=True)
+
+    # Large payloads, only loaded when accessed (or via undefer_group("blobs"))
+    input_data = deferred(Column(JSON, nullable=True), group="blobs")  # intake form minus ai_overrides
+    ai_analysis = deferred(Column(JSON, nullable=True), group="blobs")  # ai_overrides (vision rooms)
+    result_data = deferred(Column(JSON, nullable=True), group="blobs")  # Cell DesignOutput
+
+    # Legacy: intake form + result in one blob (backfilled into the columns above by migration 0004)
+    data = deferred(Column(JSON, default={}))
     
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    # Keyset pagination of /projects (newest first), optionally within one status
+    __table_args__ = (
+        Index("ix_projects_created_at_id", "created_at", "id"),
+        Index("ix_projects_status_created_at_id", "status", "created_at", "id"),
+    )
+
+# Older Cell results carry the point count only inside the compliance notes
+POINT_COUNT_NOTE = re.compile(r"System Load: (\d+) Estimated Addressable Points")
+
+def _int_or_none(value) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def split_project_data(data: Optional[dict]) -> dict:
+    """Legacy `data` blob -> hot columns + input/ai/result blobs (also used for new saves)."""
+    data = data or {}
+    intake = dict(data.get("input") or {})
+    result = data.get("result") or {}
+    ai_analysis = intake.pop("ai_overrides", None) or None
+    point_count = result.get("point_count")
+    if point_count is None:
+        for note in result.get("compliance_notes") or []:
+            match = POINT_COUNT_NOTE.search(str(note))
+            if match:
+                point_count = match.group(1)
+                break
+    return {
+        "occupancy": intake.get("occupancy"),
+        "sqft": _int_or_none(intake.get("sqft")),
+        "num_stories": _int_or_none(intake.get("num_stories")),
+        "num_units": _int_or_none(intake.get("num_units")),
+        "system_type": result.get("system_type"),
+        "point_count": _int_or_none(point_count),
+        "input_data": intake,
+        "ai_analysis": ai_analysis,
+        "result_data": result,
+    }
+
 class Component(Base):
     __tablename__ = "components"
 
@@ -26,9 +121,10 @@ class Component(Base):
     description = Column(String)
     price = Column(Float, nullable=True)
     metadata_info = Column(JSON, default={})
+    # sha256 of the source price-book row; unchanged rows are skipped on re-ingestion
+    content_hash = Column(String, nullable=True)
     
     # Vector embedding for semantic search (768 dimensions for Gemini 1.5/embedding-001)
-    from pgvector.sqlalchemy import Vector
     embedding = Column(Vector(768))
 
 class KnowledgeBase(Base):
@@ -39,7 +135,6 @@ class KnowledgeBase(Base):
     section = Column(String)
     content = Column(String)
     
-    from pgvector.sqlalchemy import Vector
     embedding = Column(Vector(768))
 
 class AiAuditLog(Base):
@@ -54,3 +149,48 @@ class AiAuditLog(Base):
     model_name = Column(String, nullable=True)
     latency_ms = Column(Integer, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
+
+class VisionAnalysisCache(Base):
+    __tablename__ = "vision_analysis_cache"
+
+    # sha256 of (model, prompt version, page image bytes) or of the source page ("src:" prefix)
+    cache_key = Column(String, primary_key=True)
+    model_name = Column(String)
+    prompt_version = Column(String)
+    result = Column(JSON, default={})
+    image_size = Column(Integer, default=0)
+    hit_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    last_hit_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class AnalysisJob(Base):
+    __tablename__ = "analysis_jobs"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))  # also the audit workflow_id
+    status = Column(String, default="queued")  # queued, running, done, failed
+    filename = Column(String, nullable=True)
+    file_size = Column(Integer, default=0)
+    options = Column(JSON, default={})  # all_pages, max_pages, bypass_cache
+    progress = Column(JSON, default={})  # total_pages, pages_done, per-sheet summaries, stage
+    error = Column(String, nullable=True)
+    attempts = Column(Integer, default=0)
+    worker_id = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)  # running jobs with a stale heartbeat are re-queued
+    finished_at = Column(DateTime, nullable=True, index=True)
+
+    # Uploaded PDF (dropped when the job finishes) and the analysis; only loaded when accessed
+    pdf_data = deferred(Column(LargeBinary, nullable=True))
+    result = deferred(Column(JSON, nullable=True))
+
+    # Workers claim the oldest queued job
+    __table_args__ = (
+        Index("ix_analysis_jobs_status_created_at", "status", "created_at"),
+    )
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+
+    id = Column(String, primary_key=True) # e.g. '0001_components_content_hash'
+    applied_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,91 @@
+"""
+Startup import profile for Cortex.
+
+Imports the app module in a fresh interpreter with `-X importtime` (schema migration
+off, so only import cost is measured), then reports the total, the heaviest modules,
+and any module from the lazily loaded stacks that got pulled in at startup.
+Exits non-zero on a budget overrun or a forbidden import, so it can gate CI.
+
+Usage:
+    python profile_imports.py [--module main] [--top 15] [--budget-ms 1500] [--forbid "reportlab,pypdf"]
+"""
+import os
+import sys
+import argparse
+import subprocess
+from typing import Dict, List, NamedTuple
+
+# Loaded on first use only (vision, retrieval/embeddings, reports, pgvector)
+LAZY_MODULES = [
+    "reportlab", "pypdf", "pdf2image", "PIL", "vertexai", "google.cloud.aiplatform",
+    "pgvector", "numpy", "vision_service", "vision_pipeline", "image_prep",
+    "component_index", "vector_search", "embeddings", "report_service", "kb_index",
+]
+
+
+class ImportRow(NamedTuple):
+    name: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def profile(module: str) -> List[ImportRow]:
+    env = dict(os.environ, CORTEX_AUTO_MIGRATE="false")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        tail = "\n".join(proc.stderr.strip().splitlines()[-5:])
+        raise SystemExit(f"import {module} failed:\n{tail}")
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append(ImportRow(name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", type=str, default="main")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=None)
+    parser.add_argument("--forbid", type=str, default=",".join(LAZY_MODULES))
+    args = parser.parse_args()
+
+    rows = profile(args.module)
+    total = next((r.cumulative_us for r in rows if r.name == args.module), 0) / 1000
+    forbidden = [f.strip() for f in args.forbid.split(",") if f.strip()]
+    loaded: Dict[str, int] = {}
+    for row in rows:
+        for name in forbidden:
+            if row.name == name or row.name.startswith(name + "."):
+                loaded[name] = max(loaded.get(name, 0), row.cumulative_us)
+
+    print(f"import {args.module}: {total:.0f} ms ({len(rows)} modules)\n")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    # Top-level packages only (depth 1 under the app module), so totals don't double count
+    top = sorted((r for r in rows if r.depth <= 1 and r.name != args.module), key=lambda r: -r.cumulative_us)
+    for row in top[:args.top]:
+        print(f"{row.cumulative_us / 1000:>14.1f} {row.self_us / 1000:>9.1f}  {row.name}")
+
+    failed = False
+    if loaded:
+        failed = True
+        print("\nLoaded at startup but expected lazy:")
+        for name, us in sorted(loaded.items(), key=lambda item: -item[1]):
+            print(f"  {name:<28} {us / 1000:>8.1f} ms")
+    if args.budget_ms is not None and total > args.budget_ms:
+        failed = True
+        print(f"\nOver budget: {total:.0f} ms > {args.budget_ms:.0f} ms")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from typing import Any, BinaryIO, Dict, Optional, Tuple
+from database import SessionLocal
+from models import Project
+from sqlalchemy.orm import undefer
+
+# Rendered reports live at <dir>/<project id>/<etag>.pdf; only the latest per project is kept.
+# Set to "" to disable the disk cache (reports are then rendered and streamed per request).
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "cortex_reports"))
+# Disk bound: least recently served reports are deleted beyond either limit (re-rendered on demand)
+REPORT_CACHE_MAX_MB = int(os.getenv("REPORT_CACHE_MAX_MB", "512"))
+REPORT_CACHE_MAX_FILES = int(os.getenv("REPORT_CACHE_MAX_FILES", "2000"))
+# Bump on any layout/content change to report_service (invalidates cached reports and ETags).
+# Kept here so computing an ETag never imports ReportLab.
+TEMPLATE_VERSION = "3"
+
+# One service per process (stylesheet built once; each render gets its own document).
+# ReportLab is imported on the first render, not at startup.
+_report_service = None
+_service_lock = threading.Lock()
+_sweep_lock = threading.Lock()
+
+
+def get_report_service():
+    global _report_service
+    if _report_service is None:
+        with _service_lock:
+            if _report_service is None:
+                from report_service import PDFReportService
+                _report_service = PDFReportService()
+    return _report_service
+
+
+def project_report_data(project: Project) -> Dict[str, Any]:
+    """Report payload for a project (building stats from the hot columns, result blob)."""
+    return {
+        "name": project.name,
+        "location_address": project.location_address,
+        # Projects are not edited after they are saved, so this is also their last change
+        "saved_at": project.created_at.isoformat() if project.created_at else None,
+        "data": {
+            "input": {k: v for k, v in {
+                "occupancy": project.occupancy,
+                "sqft": project.sqft,
+                "num_stories": project.num_stories,
+                "num_units": project.num_units,
+            }.items() if v is not None},
+            "result": project.result_data or {},
+        }
+    }
+
+
+def report_etag(project_id: str, project_data: Dict[str, Any]) -> str:
+    """Project id + content hash + template version; changes whenever the PDF would."""
+    canonical = json.dumps(project_data, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(f"{project_id}:{TEMPLATE_VERSION}:{canonical}".encode()).hexdigest()[:32]
+
+
+def _project_dir(project_id: str) -> str:
+    # Ids are server-generated UUIDs; reduce anything else to a safe file name
+    safe_id = "".join(ch for ch in project_id if ch.isalnum() or ch in "-_") or "_"
+    return os.path.join(REPORT_CACHE_DIR, safe_id)
+
+
+def enabled() -> bool:
+    return bool(REPORT_CACHE_DIR)
+
+
+def cached_path(project_id: str, etag: str) -> Optional[str]:
+    if not enabled():
+        return None
+    path = os.path.join(_project_dir(project_id), f"{etag}.pdf")
+    try:
+        os.utime(path)  # mtime = last served, for the LRU sweep
+    except OSError:
+        return None
+    return path
+
+
+def render(project_id: str, project_data: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    Returns (path, etag) of the rendered report, rendering only on a miss.
+    Blocking (ReportLab); run in the threadpool or a background task.
+    """
+    etag = report_etag(project_id, project_data)
+    path = cached_path(project_id, etag)
+    if path:
+        return path, etag
+
+    directory = _project_dir(project_id)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            get_report_service().generate_report(project_data, f)  # straight to disk, no in-memory copy
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    path = os.path.join(directory, f"{etag}.pdf")
+    os.replace(tmp_path, path)  # atomic; concurrent renders of the same version just overwrite
+
+    # Older versions of this project's report are never served again
+    for name in os.listdir(directory):
+        if name.endswith(".pdf") and name != f"{etag}.pdf":
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+    sweep()
+    return path, etag
+
+
+def open_report(project_id: str, project_data: Dict[str, Any]) -> BinaryIO:
+    """
+    The rendered report opened for reading, rendering it on a miss. The open handle stays
+    readable even if `sweep()` deletes the file while the caller is still sending it.
+    Blocking; run in the threadpool.
+    """
+    path, _ = render(project_id, project_data)
+    try:
+        return open(path, "rb")
+    except FileNotFoundError:
+        # Swept between render and open (cache under pressure): render it once more
+        path, _ = render(project_id, project_data)
+        return open(path, "rb")
+
+
+def sweep() -> int:
+    """
+    Deletes the least recently served reports until the cache is within REPORT_CACHE_MAX_MB
+    and REPORT_CACHE_MAX_FILES. Runs after each render; returns the number of files removed.
+    """
+    if not enabled() or not _sweep_lock.acquire(blocking=False):
+        return 0  # another thread is already sweeping
+    try:
+        files = []
+        with os.scandir(REPORT_CACHE_DIR) as projects:
+            for project_dir in projects:
+                if not project_dir.is_dir():
+                    continue
+                with os.scandir(project_dir.path) as entries:
+                    for entry in entries:
+                        if entry.name.endswith(".pdf"):
+                            stat = entry.stat()
+                            files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        files.sort()
+        removed = 0
+        max_bytes = REPORT_CACHE_MAX_MB * 1024 * 1024
+        for _, size, path in files:
+            if total <= max_bytes and len(files) - removed <= REPORT_CACHE_MAX_FILES:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+            try:
+                os.rmdir(os.path.dirname(path))  # only succeeds once the project has no files left
+            except OSError:
+                pass
+    except OSError as e:
+        print(f"[CORTEX] Report cache sweep failed: {e}")
+        return 0
+    finally:
+        _sweep_lock.release()
+    if removed:
+        print(f"[CORTEX] Report cache evicted {removed} reports.")
+    return removed
+
+
+def prerender(project_id: str):
+    """Background task after a save, so the first download is already a file send."""
+    if not enabled():
+        return
+    try:
+        with SessionLocal() as db:
+            project = db.query(Project).options(undefer(Project.result_data)).filter(Project.id == project_id).first()
+            if project is None:
+                return
+            project_data = project_report_data(project)
+        render(project_id, project_data)
+        print(f"[CORTEX] Report pre-rendered: {project_id}")
+    except Exception as e:
+        print(f"[CORTEX] Report pre-render failed for {project_id}: {e}")
+
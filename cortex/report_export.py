@@ -0,0 +1,174 @@
+import os
+import re
+import json
+import time
+import asyncio
+import multiprocessing
+import zipfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+import report_cache
+
+# Pool Sizing (ReportLab is pure Python, so parallel renders need processes)
+EXPORT_WORKERS = int(os.getenv("REPORT_EXPORT_WORKERS", "2"))
+# Max projects per export request
+EXPORT_MAX_PROJECTS = int(os.getenv("REPORT_EXPORT_MAX_PROJECTS", "500"))
+# Renders slower than this are logged as outliers
+EXPORT_SLOW_MS = int(os.getenv("REPORT_EXPORT_SLOW_MS", "5000"))
+TIMING_WINDOW = 1000  # recent renders kept for /metrics
+
+_export_pool: Optional[ProcessPoolExecutor] = None
+_timings = deque(maxlen=TIMING_WINDOW)
+_timings_lock = threading.Lock()
+_worker_service = None
+
+
+def get_export_pool() -> ProcessPoolExecutor:
+    """Process-wide render pool, created on first use."""
+    global _export_pool
+    if _export_pool is None:
+        # Spawned, not forked: a fork of the running API would copy its event loop, DB pools
+        # and locks (possibly held by another thread) into every worker
+        _export_pool = ProcessPoolExecutor(max_workers=EXPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _export_pool
+
+
+def shutdown_pool():
+    global _export_pool
+    if _export_pool is not None:
+        _export_pool.shutdown(wait=False, cancel_futures=True)
+        _export_pool = None
+
+
+def render_pdf_bytes(project_data: Dict[str, Any]) -> bytes:
+    """Runs inside a pool process; each worker builds its PDFReportService once."""
+    global _worker_service
+    if _worker_service is None:
+        from report_service import PDFReportService
+        _worker_service = PDFReportService()
+    return _worker_service.generate_report(project_data).getvalue()
+
+
+def archive_name(project_id: str, name: Optional[str]) -> str:
+    safe = re.sub(r"[^A-Za-z0-9_-]+", "_", (name or "Untitled")).strip("_") or "Untitled"
+    return f"{safe}_{project_id[:8]}_Fire_Design.pdf"
+
+
+class _ZipSink:
+    """Write-only, unseekable target for ZipFile; the generator drains it after each entry."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+async def _render(project: Dict[str, Any]) -> Dict[str, Any]:
+    """Cached file if the disk cache has this version, otherwise a render in the pool."""
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    entry = {"id": project["id"], "name": project["name"], "file": archive_name(project["id"], project["name"])}
+    try:
+        etag = report_cache.report_etag(project["id"], project["data"])
+        pdf = None
+        path = report_cache.cached_path(project["id"], etag)
+        if path:
+            try:
+                with open(path, "rb") as f:
+                    pdf = await loop.run_in_executor(None, f.read)
+                entry["cached"] = True
+            except FileNotFoundError:
+                pass  # swept since the lookup: render it instead
+        if pdf is None:
+            pdf = await loop.run_in_executor(get_export_pool(), render_pdf_bytes, project["data"])
+            entry["cached"] = False
+        entry["bytes"] = len(pdf)
+    except Exception as e:
+        pdf = None
+        entry["error"] = str(e)
+    entry["render_ms"] = int((time.perf_counter() - start) * 1000)
+    return dict(entry, pdf=pdf)
+
+
+def _record(entry: Dict[str, Any]):
+    if entry.get("cached") is False:
+        with _timings_lock:
+            _timings.append((entry["render_ms"], entry["id"]))
+        if entry["render_ms"] > EXPORT_SLOW_MS:
+            print(f"[CORTEX] Slow report render: {entry['id']} took {entry['render_ms']}ms ({entry.get('bytes', 0)} bytes)")
+
+
+async def export_zip(projects: List[Dict[str, Any]], missing: List[str] = ()) -> AsyncIterator[bytes]:
+    """
+    Streams a ZIP of project reports while they render. Entries are added in completion
+    order as each render finishes (at most 2x pool size in flight); `manifest.json` at the
+    end lists per-project timing, cache use and errors.
+    Each project is {"id", "name", "data"} where data is report_cache.project_report_data().
+    """
+    loop = asyncio.get_running_loop()
+    sink = _ZipSink()
+    zf = zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED)
+    window = asyncio.Semaphore(EXPORT_WORKERS * 2)
+    manifest = [{"id": project_id, "error": "Project not found"} for project_id in missing]
+    started = time.perf_counter()
+
+    async def bounded(project):
+        async with window:
+            return await _render(project)
+
+    tasks = [asyncio.ensure_future(bounded(p)) for p in projects]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            entry = await next_done
+            pdf = entry.pop("pdf")
+            _record(entry)
+            manifest.append(entry)
+            if pdf is not None:
+                info = zipfile.ZipInfo(entry["file"], date_time=datetime.now().timetuple()[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                await loop.run_in_executor(None, zf.writestr, info, pdf)
+                yield sink.drain()
+
+        summary = {
+            "generated_at": datetime.utcnow().isoformat(),
+            "projects": len(projects) + len(missing),
+            "rendered": sum(1 for e in manifest if e.get("cached") is False),
+            "cached": sum(1 for e in manifest if e.get("cached") is True),
+            "errors": sum(1 for e in manifest if "error" in e),
+            "total_ms": int((time.perf_counter() - started) * 1000),
+            "entries": sorted(manifest, key=lambda e: -e.get("render_ms", 0)),  # slowest first
+        }
+        zf.writestr("manifest.json", json.dumps(summary, indent=2))
+        zf.close()
+        yield sink.drain()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def stats() -> Dict[str, Any]:
+    with _timings_lock:
+        samples = sorted(_timings)
+    if not samples:
+        return {"renders": 0}
+    ms = [s[0] for s in samples]
+    return {
+        "renders": len(ms),
+        "p50_ms": ms[len(ms) // 2],
+        "p95_ms": ms[min(len(ms) - 1, int(len(ms) * 0.95))],
+        "max_ms": ms[-1],
+        "slowest": [project_id for _, project_id in samples[-5:][::-1]],
+    }
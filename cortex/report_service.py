@@ -4,6 +4,52 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, Tabl
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from io import BytesIO
 from datetime import datetime
+from itertools import chain, islice
+from typing import BinaryIO, Iterable, Iterator, Optional
+import os
+import tempfile
+
+# BOM rows per Table flowable (keeps ReportLab's row-splitting cheap on huge AI BOMs)
+BOM_CHUNK_ROWS = int(os.getenv("REPORT_BOM_CHUNK_ROWS", "200"))
+# Streamed renders stay in memory up to this size, then spill to a temp file
+SPOOL_MAX_BYTES = int(os.getenv("REPORT_SPOOL_MAX_BYTES", str(8 * 1024 * 1024)))
+STREAM_CHUNK_BYTES = 64 * 1024
+
+BOM_TABLE_STYLE = TableStyle([
+    ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+    ('BACKGROUND', (0,0), (-1,0), colors.darkblue),
+    ('TEXTCOLOR', (0,0), (-1,0), colors.white),
+    ('GRID', (0,0), (-1,-1), 0.5, colors.black),
+    ('ROWBACKGROUNDS', (1,0), (-1,-1), [colors.white, colors.whitesmoke]),
+    ('PADDING', (0,0), (-1,-1), 6),
+])
+
+class LazyFlowables(list):
+    """
+    Flowable list for `doc.build` that is refilled from an iterator as ReportLab consumes
+    it from the front, so only a few flowables (at most one BOM chunk table) exist at a time.
+    """
+    LOOKAHEAD = 2  # ReportLab peeks past the head for keepWithNext chains
+
+    def __init__(self, source: Iterable):
+        super().__init__()
+        self._source = iter(source)
+        self._fill()
+
+    def _fill(self):
+        while self._source is not None and list.__len__(self) < self.LOOKAHEAD:
+            try:
+                self.append(next(self._source))
+            except StopIteration:
+                self._source = None
+
+    def __len__(self):
+        self._fill()
+        return list.__len__(self)
+
+    def __getitem__(self, index):
+        self._fill()
+        return list.__getitem__(self, index)
 
 class PDFReportService:
     def __init__(self):
@@ -11,8 +57,16 @@ class PDFReportService:
         self.styles.add(ParagraphStyle(name='SectionHeader', fontSize=14, leading=16, spaceAfter=10, textColor=colors.darkblue, fontName='Helvetica-Bold'))
         self.styles.add(ParagraphStyle(name='NormalSmall', parent=self.styles['Normal'], fontSize=9, leading=11))
 
-    def generate_report(self, project_data: dict) -> BytesIO:
-        buffer = BytesIO()
+    @staticmethod
+    def _format_saved_at(saved_at: Optional[str]) -> str:
+        """The project's save time (not the render time, which a cached report would freeze)."""
+        if not saved_at:
+            return "N/A"
+        return datetime.fromisoformat(saved_at).strftime("%Y-%m-%d %H:%M UTC")
+
+    def generate_report(self, project_data: dict, output: Optional[BinaryIO] = None) -> BinaryIO:
+        """Renders into `output` (any writable binary file; a new BytesIO by default)."""
+        buffer = output if output is not None else BytesIO()
         doc = SimpleDocTemplate(buffer, pagesize=letter)
         elements = []
 
@@ -30,7 +84,7 @@ class PDFReportService:
         info_data = [
             ["Project Name:", project_name],
             ["Location:", location],
-            ["Date generated:", datetime.now().strftime("%Y-%m-%d %H:%M")],
+            ["Project saved:", self._format_saved_at(project_data.get("saved_at"))],
             ["Occupancy:", input_data.get("occupancy", "N/A")],
             ["Building Stats:", f"{input_data.get('sqft', 0)} SqFt | {input_data.get('num_stories', 0)} Stories | {input_data.get('num_units', 0)} Units"]
         ]
@@ -72,30 +126,48 @@ class PDFReportService:
         # --- BILL OF MATERIALS (BOM) ---
         elements.append(Paragraph("3. Preliminary Bill of Materials", self.styles['SectionHeader']))
         
-        bom_data = [["Item Description", "Category"]]
-        
-        # Tier A (Headend)
-        for item in result_data.get("bom_tier_a", []):
-            bom_data.append([item, "Headend / Control"])
-            
-        # Tier B (Field)
-        for item in result_data.get("bom_tier_b", []):
-            bom_data.append([item, "Notification / Field"])
-            
-        t_bom = Table(bom_data, colWidths=[350, 120])
-        t_bom.setStyle(TableStyle([
-            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-            ('BACKGROUND', (0,0), (-1,0), colors.darkblue),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.white),
-            ('GRID', (0,0), (-1,-1), 0.5, colors.black),
-            ('ROWBACKGROUNDS', (1,0), (-1,-1), [colors.white, colors.whitesmoke]),
-            ('PADDING', (0,0), (-1,-1), 6),
-        ]))
-        elements.append(t_bom)
-
-        elements.append(Spacer(1, 36))
-        elements.append(Paragraph("Generated by Cicuma Fire Brain v2.1", self.styles['NormalSmall']))
+        # Tier A (Headend), then Tier B (Field), in tables of BOM_CHUNK_ROWS rows,
+        # each repeating the header row when it breaks across a page
+        bom_rows = chain(
+            ([item, "Headend / Control"] for item in result_data.get("bom_tier_a", [])),
+            ([item, "Notification / Field"] for item in result_data.get("bom_tier_b", [])),
+        )
+        footer = [
+            Spacer(1, 36),
+            Paragraph("Generated by Cicuma Fire Brain v2.1", self.styles['NormalSmall']),
+        ]
 
-        doc.build(elements)
+        # Chunk tables are built as ReportLab reaches them and dropped once drawn
+        doc.build(LazyFlowables(chain(elements, self._bom_tables(bom_rows), footer)))
         buffer.seek(0)
         return buffer
+
+    @staticmethod
+    def _bom_tables(rows: Iterator[list]) -> Iterator[Table]:
+        """One Table per BOM_CHUNK_ROWS rows (a header-only table when the BOM is empty)."""
+        first = True
+        while True:
+            chunk = list(islice(rows, BOM_CHUNK_ROWS))
+            if not chunk and not first:
+                return
+            first = False
+            t_bom = Table([["Item Description", "Category"]] + chunk, colWidths=[350, 120], repeatRows=1)
+            t_bom.setStyle(BOM_TABLE_STYLE)
+            yield t_bom
+
+    def stream_report(self, project_data: dict) -> Iterator[bytes]:
+        """
+        Renders into a spooled temp file (memory up to SPOOL_MAX_BYTES, disk beyond)
+        and yields it in chunks, so the PDF is never copied into one bytes object.
+        """
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        try:
+            self.generate_report(project_data, spool)
+            spool.seek(0)
+            while True:
+                chunk = spool.read(STREAM_CHUNK_BYTES)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            spool.close()
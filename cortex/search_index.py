@@ -0,0 +1,142 @@
+import re
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# BM25 parameters (standard Okapi defaults)
+K1 = 1.2
+B = 0.75
+# Cap on vocabulary terms a single query word may expand to via prefix matching
+MAX_PREFIX_EXPANSION = 64
+# Prefix hits score slightly below exact token hits
+PREFIX_WEIGHT = 0.8
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    return TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    """
+    In-memory inverted index (token -> postings) with Okapi BM25 ranking.
+
+    Each posting list stores its documents' precomputed BM25 weights, sorted best first,
+    so single-term queries read the top-k straight off the list and multi-term queries
+    only touch the postings of their own terms.
+
+    Query words match whole tokens and token prefixes ("detector" hits "detectors"),
+    which mirrors the substring semantics of the old ILIKE path without a table scan.
+    Documents are addressed by their insertion position; callers keep the payloads.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.vocabulary: List[str] = []
+        self.num_docs = 0
+
+    @classmethod
+    def build(cls, documents: Iterable[List[str]]) -> "BM25Index":
+        """`documents` yields one token list per document, in payload order."""
+        token_ids: Dict[str, int] = {}
+        tok_col, doc_col, tf_col = array("i"), array("i"), array("f")
+        doc_lengths = array("f")
+        for doc_idx, tokens in enumerate(documents):
+            for token, tf in Counter(tokens).items():
+                tok_col.append(token_ids.setdefault(token, len(token_ids)))
+                doc_col.append(doc_idx)
+                tf_col.append(tf)
+            doc_lengths.append(len(tokens))
+
+        index = cls()
+        index.num_docs = len(doc_lengths)
+        if not token_ids:
+            return index
+
+        # All weights in one vectorized pass
+        tok = np.frombuffer(tok_col, dtype=np.int32)
+        doc = np.frombuffer(doc_col, dtype=np.int32)
+        tf = np.frombuffer(tf_col, dtype=np.float32)
+        lengths = np.frombuffer(doc_lengths, dtype=np.float32)
+        avgdl = float(lengths.mean()) or 1.0
+
+        df = np.bincount(tok, minlength=len(token_ids))
+        idf = np.log(1 + (index.num_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        weights = idf[tok] * tf * (K1 + 1) / (tf + K1 * (1 - B + B * lengths[doc] / avgdl))
+
+        # Group by token, best weight first, ties in insertion order
+        order = np.lexsort((doc, -weights, tok))
+        doc, weights = doc[order], weights[order].astype(np.float32)
+        offsets = np.concatenate(([0], np.cumsum(df)))
+
+        for token, tid in token_ids.items():
+            start, end = offsets[tid], offsets[tid + 1]
+            index.postings[token] = (doc[start:end], weights[start:end])
+
+        index.vocabulary = sorted(index.postings)
+        return index
+
+    def __len__(self) -> int:
+        return self.num_docs
+
+    def _expand(self, word: str) -> List[str]:
+        """Vocabulary tokens equal to or starting with `word`."""
+        terms = []
+        pos = bisect_left(self.vocabulary, word)
+        while pos < len(self.vocabulary) and len(terms) < MAX_PREFIX_EXPANSION:
+            term = self.vocabulary[pos]
+            if not term.startswith(word):
+                break
+            terms.append(term)
+            pos += 1
+        return terms
+
+    def search(self, words: List[str], limit: int = 5, require_all: bool = True) -> List[Tuple[int, float]]:
+        """
+        Returns up to `limit` (doc_idx, score) pairs, best first.
+        With `require_all`, a document must match every query word (AND), like the SQL path.
+        """
+        if not words or not self.num_docs or limit <= 0:
+            return []
+
+        query_words = list(dict.fromkeys(w.lower() for w in words))
+        expansions = [self._expand(word) for word in query_words]
+        if require_all and not all(expansions):
+            return []
+
+        # Fast path: one word, one term -> postings are already ranked
+        if len(query_words) == 1 and len(expansions[0]) == 1:
+            term = expansions[0][0]
+            ids, weights = self.postings[term]
+            factor = 1.0 if term == query_words[0] else PREFIX_WEIGHT
+            return [(int(d), float(w) * factor) for d, w in zip(ids[:limit], weights[:limit])]
+
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        hits = np.zeros(self.num_docs, dtype=np.int16)
+        for word, terms in zip(query_words, expansions):
+            word_docs = []
+            for term in terms:
+                ids, weights = self.postings[term]
+                # ids are unique within one posting list, so fancy-index += is safe
+                scores[ids] += weights if term == word else weights * PREFIX_WEIGHT
+                word_docs.append(ids)
+            if len(word_docs) == 1:
+                hits[word_docs[0]] += 1
+            elif word_docs:
+                hits[np.unique(np.concatenate(word_docs))] += 1
+
+        candidates = np.flatnonzero(hits == len(query_words)) if require_all else np.flatnonzero(hits)
+        if candidates.size == 0:
+            return []
+        cand_scores = scores[candidates]
+        if candidates.size > limit:
+            top = np.argpartition(-cand_scores, limit - 1)[:limit]
+            candidates, cand_scores = candidates[top], cand_scores[top]
+        # Ties break on insertion order so results are stable across rebuilds
+        order = np.lexsort((candidates, -cand_scores))
+        return [(int(candidates[i]), float(cand_scores[i])) for i in order]
@@ -0,0 +1,17 @@
+import json
+from typing import Any, Optional
+
+# Comment line sent on idle streams so proxies and load balancers keep the connection open
+KEEPALIVE = ": keepalive\n\n"
+KEEPALIVE_SECONDS = 15
+# Disable buffering in nginx-style proxies so events arrive as they are sent
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_event(event: str, data: Any, event_id: Optional[str] = None) -> str:
+    """One Server-Sent Event frame (data as compact JSON on a single line)."""
+    frame = f"event: {event}\n"
+    if event_id is not None:
+        frame += f"id: {event_id}\n"
+    return frame + f"data: {json.dumps(data, separators=(',', ':'), default=str)}\n\n"
+
@@ -0,0 +1,27 @@
+import os
+import sys
+import tempfile
+
+# The service runs from cortex/ and imports its modules top-level ("from models import ...")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Throwaway SQLite database and offline embeddings; set before any Cortex module is imported
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp(prefix='cortex-tests-')}/cortex.db")
+os.environ.setdefault("EMBEDDING_BACKEND", "stub")
+os.environ.setdefault("CORTEX_AUTO_MIGRATE", "false")
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def schema():
+    from database import engine
+    from migrations import run_migrations
+    run_migrations(engine)
+
+
+@pytest.fixture
+def db(schema):
+    """A session on the throwaway test database."""
+    from database import SessionLocal
+    with SessionLocal() as session:
+        yield session
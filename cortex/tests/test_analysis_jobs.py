@@ -0,0 +1,92 @@
+import asyncio
+from datetime import datetime, timedelta
+import analysis_jobs
+from analysis_jobs import DONE, FAILED, QUEUED, RUNNING, claim, enqueue, update_job
+from database import SessionLocal, engine
+from migrations import run_migrations
+from models import AnalysisJob
+
+run_migrations(engine)
+
+
+def drain():
+    """Finishes whatever earlier tests left claimable, so each test starts from an empty queue."""
+    while (job_id := claim("drain")) is not None:
+        update_job(job_id, "drain", status=DONE)
+
+
+def job(job_id):
+    with SessionLocal() as db:
+        return db.query(AnalysisJob).filter(AnalysisJob.id == job_id).one()
+
+
+def expire_lease(job_id):
+    stale = datetime.utcnow() - timedelta(seconds=analysis_jobs.ANALYSIS_LEASE_SECONDS + 1)
+    with SessionLocal() as db:
+        db.query(AnalysisJob).filter(AnalysisJob.id == job_id).update({"heartbeat_at": stale})
+        db.commit()
+
+
+def test_claim_leases_each_job_to_one_worker_oldest_first():
+    drain()
+    first = enqueue(b"%PDF-1", "a.pdf", {})
+    second = enqueue(b"%PDF-2", "b.pdf", {})
+    assert claim("w1") == first
+    assert claim("w2") == second
+    assert claim("w3") is None
+    claimed = job(first)
+    assert (claimed.status, claimed.worker_id, claimed.attempts) == (RUNNING, "w1", 1)
+    assert update_job(first, "w1", progress={"stage": "analyzing"})
+    assert not update_job(first, "w2", progress={"stage": "analyzing"})  # not w2's lease
+    update_job(first, "w1", status=DONE)
+    update_job(second, "w2", status=DONE)
+
+
+def test_expired_lease_is_reclaimed_and_the_old_worker_loses_it():
+    drain()
+    job_id = enqueue(b"%PDF", "lost.pdf", {})
+    assert claim("w1") == job_id
+    assert claim("w2") is None  # lease still fresh
+    expire_lease(job_id)
+    assert claim("w2") == job_id
+    assert job(job_id).attempts == 2
+    assert not update_job(job_id, "w1", status=DONE)
+    assert update_job(job_id, "w2", status=DONE)
+
+
+def test_job_is_failed_once_its_attempts_are_used_up(monkeypatch):
+    drain()
+    monkeypatch.setattr(analysis_jobs, "ANALYSIS_MAX_ATTEMPTS", 1)
+    job_id = enqueue(b"%PDF", "crashy.pdf", {})
+    assert claim("w1") == job_id
+    expire_lease(job_id)
+    assert claim("w2") is None
+    failed = job(job_id)
+    assert failed.status == FAILED and failed.error.startswith("Worker lost")
+
+
+def test_released_jobs_go_back_to_the_queue_without_using_an_attempt():
+    drain()
+    job_id = enqueue(b"%PDF", "shutdown.pdf", {})
+    assert claim("w1") == job_id
+    assert analysis_jobs.release_worker_jobs("w1") == 1
+    released = job(job_id)
+    assert (released.status, released.attempts) == (QUEUED, 0)
+    assert claim("w2") == job_id
+    update_job(job_id, "w2", status=DONE)
+
+
+def test_job_without_pdf_data_is_marked_failed():
+    drain()
+    job_id = enqueue(b"%PDF", "empty.pdf", {})
+    with SessionLocal() as db:
+        db.query(AnalysisJob).filter(AnalysisJob.id == job_id).update({"pdf_data": None})
+        db.commit()
+    assert claim("w1") == job_id
+    pool = analysis_jobs.WorkerPool()
+    asyncio.run(analysis_jobs.JobWorker("w1", pool).process(job_id))
+    failed = job(job_id)
+    assert (failed.status, failed.error) == (FAILED, "Job has no PDF data.")
+    assert failed.finished_at is not None
+    assert pool.failed == 1
+    assert claim("w2") is None
@@ -0,0 +1,38 @@
+import uuid
+import audit_log
+from audit_log import AuditSink
+from database import SessionLocal
+from models import AiAuditLog
+
+
+def rows_for(workflow_id):
+    with SessionLocal() as db:
+        return db.query(AiAuditLog).filter(AiAuditLog.workflow_id == workflow_id).count()
+
+
+def test_emit_drops_events_once_the_queue_is_full(schema, monkeypatch):
+    sink = AuditSink(maxsize=2)
+    monkeypatch.setattr(sink, "start", lambda: None)  # no writer yet: the queue only fills
+    workflow_id = str(uuid.uuid4())
+    for _ in range(3):
+        sink.emit(workflow_id=workflow_id, step_name="vision_analysis")
+    assert (sink.stats()["queued"], sink.dropped) == (2, 1)
+
+    AuditSink.start(sink)
+    sink.stop()
+    assert rows_for(workflow_id) == 2
+    assert (sink.written, sink.dropped) == (2, 1)
+
+
+def test_stop_flushes_everything_queued(schema, monkeypatch):
+    # Neither flush trigger fires on its own within the test
+    monkeypatch.setattr(audit_log, "AUDIT_FLUSH_INTERVAL", 60.0)
+    monkeypatch.setattr(audit_log, "AUDIT_FLUSH_SIZE", 1000)
+    sink = AuditSink()
+    workflow_id = str(uuid.uuid4())
+    for i in range(5):
+        sink.emit(workflow_id=workflow_id, step_name="rag_retrieval", latency_ms=i)
+    assert rows_for(workflow_id) == 0
+    sink.stop()
+    assert rows_for(workflow_id) == 5
+    assert sink.stats()["queued"] == 0 and sink.flushes == 1
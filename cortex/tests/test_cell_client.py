@@ -0,0 +1,143 @@
+import asyncio
+import httpx
+import pytest
+from cell_client import CellClient, CircuitBreaker, CircuitOpenError
+
+
+def make_client(handler) -> CellClient:
+    client = CellClient("http://cell.test")
+    client._client = httpx.AsyncClient(base_url="http://cell.test", transport=httpx.MockTransport(handler))
+    return client
+
+
+def open_breaker(breaker: CircuitBreaker):
+    for _ in range(breaker.threshold):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def expire(breaker: CircuitBreaker):
+    breaker.opened_at -= breaker.reset_seconds + 1
+
+
+def test_breaker_opens_after_threshold_consecutive_failures():
+    breaker = CircuitBreaker(threshold=3, reset_seconds=30)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.before_call()
+    breaker.record_success()  # a success resets the count
+    assert breaker.failures == 0
+
+    open_breaker(breaker)
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.times_opened == 1
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = CircuitBreaker(threshold=1, reset_seconds=30)
+    open_breaker(breaker)
+    expire(breaker)
+
+    assert breaker.before_call() is True
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.before_call() is False
+
+
+def test_failed_trial_reopens():
+    breaker = CircuitBreaker(threshold=1, reset_seconds=30)
+    open_breaker(breaker)
+    expire(breaker)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_cancelled_half_open_trial_releases_the_breaker():
+    started = asyncio.Event()
+    healthy = False
+
+    async def handler(request):
+        if healthy:
+            return httpx.Response(200, json={"ok": True})
+        started.set()
+        await asyncio.sleep(60)
+
+    async def scenario():
+        nonlocal healthy
+        client = make_client(handler)
+        client.breaker.threshold = 1
+        open_breaker(client.breaker)
+        expire(client.breaker)
+
+        trial = asyncio.ensure_future(client.request("GET", "/health"))
+        await started.wait()
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        assert client.breaker.state == "half_open"
+
+        healthy = True
+        response = await client.request("GET", "/health")
+        assert response.json() == {"ok": True}
+        assert client.breaker.state == "closed"
+        await client.close()
+
+    asyncio.run(scenario())
+
+
+def test_unexpected_error_counts_as_failure_and_releases_trial():
+    async def handler(request):
+        raise httpx.DecodingError("bad gzip")
+
+    async def scenario():
+        client = make_client(handler)
+        client.breaker.threshold = 1
+        open_breaker(client.breaker)
+        expire(client.breaker)
+        with pytest.raises(httpx.DecodingError):
+            await client.request("GET", "/health")
+        assert client.breaker.state == "open"
+        expire(client.breaker)
+        assert client.breaker.before_call() is True  # a new trial is possible
+        await client.close()
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_stream_before_headers_releases_trial():
+    started = asyncio.Event()
+
+    async def handler(request):
+        started.set()
+        await asyncio.sleep(60)
+
+    async def scenario():
+        client = make_client(handler)
+        client.breaker.threshold = 1
+        open_breaker(client.breaker)
+        expire(client.breaker)
+
+        async def consume():
+            async with client.stream("POST", "/analyze-batch", []) as response:
+                await response.aread()
+
+        task = asyncio.ensure_future(consume())
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert client.breaker.before_call() is True
+        await client.close()
+
+    asyncio.run(scenario())
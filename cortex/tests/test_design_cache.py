@@ -0,0 +1,42 @@
+import pytest
+import design_cache
+from ttl_cache import TTLCache
+
+BUILDING = {"occupancy": "Business", "sqft": 12000, "num_stories": 2, "ahj": "South FL"}
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(design_cache, "_cache", TTLCache(maxsize=16, ttl=600))
+    monkeypatch.setattr(design_cache, "_ruleset_version", None)
+    monkeypatch.setattr(design_cache, "_invalidations", 0)
+
+
+def test_a_new_ruleset_version_clears_the_cache():
+    design_cache.put(BUILDING, {"devices": 10}, "2024.1")
+    assert design_cache.get(design_cache.design_key(BUILDING)) == {"devices": 10}
+    assert design_cache.stats()["invalidations"] == 0  # the first version seen clears nothing
+
+    design_cache.observe_version("2024.1")
+    assert design_cache.get(design_cache.design_key(BUILDING)) == {"devices": 10}
+
+    design_cache.observe_version("2024.2")
+    assert len(design_cache._cache) == 0
+    assert design_cache.get(design_cache.design_key(BUILDING)) is None
+    assert design_cache.stats()["ruleset_version"] == "2024.2"
+    assert design_cache.stats()["invalidations"] == 1
+
+
+def test_responses_without_a_version_keep_the_cache():
+    design_cache.put(BUILDING, {"devices": 10}, "2024.1")
+    design_cache.observe_version(None)
+    assert design_cache.get(design_cache.design_key(BUILDING)) == {"devices": 10}
+
+
+def test_inputs_the_cell_treats_alike_share_a_key_and_hits_are_copies():
+    design_cache.put(BUILDING, {"devices": [1, 2]}, "2024.1")
+    variant = dict(BUILDING, occupancy="business", ahj=" south-fl ", ai_overrides=None)
+    hit = design_cache.get(design_cache.design_key(variant))
+    assert hit == {"devices": [1, 2]}
+    hit["devices"].append(3)
+    assert design_cache.get(design_cache.design_key(BUILDING)) == {"devices": [1, 2]}
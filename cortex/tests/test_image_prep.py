@@ -0,0 +1,60 @@
+from PIL import Image, ImageDraw
+from image_prep import tile_boxes, trim_title_block
+
+W, H = 1000, 700
+
+
+def sheet():
+    img = Image.new("L", (W, H), 255)
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((5, 5, W - 6, H - 6), outline=0, width=3)  # sheet frame
+    return img, draw
+
+
+def test_plan_with_exterior_wall_near_the_right_edge_is_not_cropped():
+    img, draw = sheet()
+    # Building outline whose east wall runs almost the full sheet height at 90% width,
+    # with interior walls meeting it and a grid line running past it to the margin
+    draw.rectangle((60, 30, 900, 670), outline=0, width=6)
+    for y in (200, 420):
+        draw.line((60, y, 900, y), fill=0, width=4)
+    draw.line((20, 300, W - 20, 300), fill=0, width=1)
+    assert trim_title_block(img).size == (W, H)
+
+
+def test_title_block_divided_into_cells_is_cropped():
+    img, draw = sheet()
+    draw.rectangle((60, 60, 700, 640), outline=0, width=6)  # drawing
+    draw.line((820, 5, 820, H - 6), fill=0, width=3)  # title block border
+    for y in (150, 300, 560):
+        draw.line((820, y, W - 6, y), fill=0, width=2)  # cell dividers
+    for y in (80, 200, 350):
+        draw.text((840, y), "PROJECT  SHEET FA-101", fill=0)
+    width, height = trim_title_block(img).size
+    assert 815 <= width <= 820 and height == H  # cut at the border line
+
+
+def test_bottom_title_block_is_cropped():
+    img, draw = sheet()
+    draw.rectangle((60, 40, 940, 480), outline=0, width=6)
+    draw.line((5, 560, W - 6, 560), fill=0, width=3)
+    for x in (300, 650):
+        draw.line((x, 560, x, H - 6), fill=0, width=2)
+    width, height = trim_title_block(img).size
+    assert width == W and 555 <= height <= 560
+
+
+def test_tile_boxes_cover_the_image_with_overlap():
+    assert tile_boxes(1200, 900, 1600, 0.12) == [(0, 0, 1200, 900)]
+    boxes = tile_boxes(4000, 1600, 1600, 0.12)
+    assert len(boxes) == 3
+    assert boxes[0][0] == 0 and boxes[-1][2] == 4000
+    assert all(x1 - x0 == 1600 and (y0, y1) == (0, 1600) for x0, y0, x1, y1 in boxes)
+    for (_, _, right, _), (left, _, _, _) in zip(boxes, boxes[1:]):
+        assert right - left >= 1600 * 0.12
+
+
+def test_tile_boxes_grid_is_row_major():
+    boxes = tile_boxes(3000, 3000, 1600, 0.12)
+    assert len(boxes) == 4
+    assert [b[:2] for b in boxes] == [(0, 0), (1400, 0), (0, 1400), (1400, 1400)]
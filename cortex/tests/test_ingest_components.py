@@ -0,0 +1,84 @@
+import csv
+from database import SessionLocal
+from embeddings import EmbeddingBackend, StubEmbeddingBackend
+from ingest_components import ingest_csv
+from models import Component
+
+
+class FlakyBackend(EmbeddingBackend):
+    """Stub embeddings, except texts containing `fail_on` come back as zero vectors (retries exhausted)."""
+    name = "flaky"
+    max_batch_size = 1000
+
+    def __init__(self, fail_on: str):
+        self.fail_on = fail_on
+        self.stub = StubEmbeddingBackend()
+
+    def embed(self, texts, task_type="RETRIEVAL_QUERY"):
+        vectors = self.stub.embed(texts, task_type)
+        return [[0.0] * len(v) if self.fail_on in t else v for t, v in zip(texts, vectors)]
+
+
+def write_price_book(path, rows):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["Category", "Part Number", "Long Description", "MSRP/Trade Price"])
+        writer.writeheader()
+        for part, description in rows:
+            writer.writerow({"Category": "Detection", "Part Number": part,
+                             "Long Description": description, "MSRP/Trade Price": "$10.00"})
+
+
+def component(part_number):
+    with SessionLocal() as db:
+        return db.query(Component).filter(Component.part_number == part_number).one()
+
+
+def test_rows_with_failed_embeddings_are_retried_on_the_next_run(tmp_path):
+    path = tmp_path / "price_book.csv"
+    write_price_book(path, [("ING-SD-1", "photoelectric smoke detector"), ("ING-HD-1", "fixed heat detector")])
+
+    stats = ingest_csv(str(path), backend=FlakyBackend(fail_on="ING-HD-1"), batch_size=1)
+    assert (stats.embedded, stats.embed_failed) == (1, 1)
+    assert component("ING-HD-1").content_hash is None
+    assert component("ING-SD-1").content_hash is not None
+
+    stats = ingest_csv(str(path), backend=StubEmbeddingBackend())
+    assert stats.rows, "a run with failed embeddings must not be marked complete"
+    assert stats.embed_failed == 0
+    assert stats.updated == 1  # resumes after the last clean batch; only the failed row is redone
+    healed = component("ING-HD-1")
+    assert healed.content_hash is not None
+    assert any(healed.embedding)
+
+    assert ingest_csv(str(path), backend=StubEmbeddingBackend()).rows == 0  # complete now
+
+
+def test_standalone_run_asks_the_api_to_reindex(tmp_path, monkeypatch):
+    import httpx
+    import ingest_components
+    calls = []
+
+    def post(url, timeout):
+        calls.append(url)
+        return httpx.Response(200, request=httpx.Request("POST", url))
+
+    monkeypatch.setattr(ingest_components, "CORTEX_URL", "http://cortex:8000/")
+    monkeypatch.setattr(httpx, "post", post)
+    path = tmp_path / "price_book.csv"
+    write_price_book(path, [("NOTIFY-1", "duct smoke detector")])
+
+    ingest_csv(str(path), backend=StubEmbeddingBackend())
+    assert calls == ["http://cortex:8000/components/reindex"]
+    ingest_csv(str(path), backend=StubEmbeddingBackend(), resume=False)  # nothing changed
+    assert len(calls) == 1
+
+
+def test_unreadable_price_skips_the_row_not_the_run(tmp_path):
+    path = tmp_path / "price_book.csv"
+    write_price_book(path, [("PRICE-1", "horn strobe"), ("PRICE-2", "mini horn")])
+    text = path.read_text().replace("PRICE-1,horn strobe,$10.00", "PRICE-1,horn strobe,Call for price")
+    path.write_text(text)
+
+    stats = ingest_csv(str(path), backend=StubEmbeddingBackend())
+    assert (stats.rows, stats.skipped, stats.inserted) == (2, 1, 1)
+    assert component("PRICE-2").price == 10.0
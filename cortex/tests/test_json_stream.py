@@ -0,0 +1,62 @@
+import json
+from json_stream import JsonArrayStream
+
+DOC = json.dumps({
+    "sheet": "A-101",
+    "rooms": [
+        {"name": "Bedroom 1", "notes": "closet {walk-in} [typ.]", "sqft": 140},
+        {"name": "Hall \"A\"", "notes": "ends with a backslash \\", "doors": [1, 2]},
+        {"name": "Lobby", "tags": ["public", "assembly ]"]},
+    ],
+    "summary": "done",
+})
+ROOMS = json.loads(DOC)["rooms"]
+
+
+def feed_in_chunks(doc, size):
+    stream, items = JsonArrayStream("rooms"), []
+    for start in range(0, len(doc), size):
+        items.extend(stream.feed(doc[start:start + size]))
+    return stream, items
+
+
+def test_whole_document_in_one_chunk():
+    stream, items = feed_in_chunks(DOC, len(DOC))
+    assert items == ROOMS
+    assert stream.done
+
+
+def test_every_chunk_split_gives_the_same_elements():
+    for size in (1, 2, 3, 7, 16, 64):
+        stream, items = feed_in_chunks(DOC, size)
+        assert items == ROOMS, size
+        assert stream.done
+
+
+def test_elements_are_returned_as_soon_as_they_close():
+    stream = JsonArrayStream("rooms")
+    assert stream.feed('{"rooms": [{"name": "A"}, {"na') == [{"name": "A"}]
+    assert stream.feed('me": "B"}') == [{"name": "B"}]
+    assert not stream.done
+    assert stream.feed("]}") == []
+    assert stream.done
+
+
+def test_key_split_across_chunks_and_escaped_quotes():
+    stream = JsonArrayStream("rooms")
+    assert stream.feed('{"preamble": "x", "ro') == []
+    assert stream.feed('oms": ["say \\"hi\\", ok", "back\\\\') == ["say \"hi\", ok"]
+    assert stream.feed('slash"]') == ["back\\slash"]
+    assert stream.done
+
+
+def test_scalar_elements_and_invalid_elements_are_skipped():
+    stream = JsonArrayStream("rooms")
+    assert stream.feed('{"rooms": [1, true, nope, null, 2.5]}') == [1, True, None, 2.5]
+    assert stream.done
+
+
+def test_missing_key_returns_nothing():
+    stream = JsonArrayStream("rooms")
+    assert stream.feed('{"devices": [{"a": 1}]}') == []
+    assert not stream.done
@@ -0,0 +1,34 @@
+from kb_index import KnowledgeIndex, build_prompt_context
+from models import KnowledgeBase
+
+
+def store(db, chunks):
+    db.query(KnowledgeBase).delete()
+    db.add_all(KnowledgeBase(source="NFPA 72", section=section, content=content) for section, content in chunks)
+    db.commit()
+
+
+def test_prompt_context_respects_budget_and_skips_oversized_chunks():
+    chunks = [{"section": "17.7", "content": "x" * 400}, {"section": "29.8", "content": "smoke alarms"}]
+    context = build_prompt_context(chunks, budget=40)
+    assert "[29.8] smoke alarms" in context
+    assert "17.7" not in context
+    assert build_prompt_context([], budget=40) == ""
+
+
+def test_context_is_built_from_the_snapshot_it_was_given(db):
+    index = KnowledgeIndex()
+    assert index.version == "" and index.context_for_page("Bedroom") == ""
+    store(db, [("29.8.1", "smoke alarms in sleeping rooms")])
+    index.refresh(db)
+    old = index.current()
+    assert "29.8.1" in index.context_for_page("Bedroom 2")
+
+    # A reindex publishes a new build; a request holding the old one keeps seeing it
+    store(db, [("17.7.3", "smoke detector spacing on smooth ceilings")])
+    index.refresh(db)
+    assert index.version != old.version
+    assert "29.8.1" in index.context_for_page("Bedroom 2", old)
+    current = index.context_for_page("Bedroom 2")
+    assert "17.7.3" in current and "29.8.1" not in current
+    assert index.stats()["chunks"] == 1
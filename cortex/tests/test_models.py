@@ -0,0 +1,31 @@
+from models import split_project_data
+
+
+def test_legacy_blob_is_split_into_hot_columns_and_blobs():
+    rooms = [{"name": "Bedroom 1"}]
+    data = {
+        "input": {"occupancy": "Residential", "sqft": "12000", "num_stories": 4, "num_units": "n/a",
+                  "ai_overrides": rooms},
+        "result": {"system_type": "Addressable", "point_count": 212, "compliance_notes": []},
+    }
+    split = split_project_data(data)
+    assert split["occupancy"] == "Residential"
+    assert (split["sqft"], split["num_stories"], split["num_units"]) == (12000, 4, None)
+    assert (split["system_type"], split["point_count"]) == ("Addressable", 212)
+    assert split["ai_analysis"] == rooms
+    assert "ai_overrides" not in split["input_data"]
+    assert split["result_data"] is data["result"]
+    assert data["input"]["ai_overrides"] == rooms  # the caller's blob is left intact
+
+
+def test_point_count_falls_back_to_the_compliance_note():
+    result = {"compliance_notes": ["NFPA 72 applies", "System Load: 87 Estimated Addressable Points"]}
+    assert split_project_data({"result": result})["point_count"] == 87
+
+
+def test_empty_or_missing_data():
+    for data in (None, {}, {"input": None, "result": None}):
+        split = split_project_data(data)
+        assert split["input_data"] == {} and split["result_data"] == {}
+        assert split["ai_analysis"] is None and split["point_count"] is None
+        assert split["sqft"] is None and split["occupancy"] is None
@@ -0,0 +1,44 @@
+from datetime import datetime
+import pytest
+from fastapi import HTTPException, Response
+from database import SessionLocal, engine
+from main import decode_cursor, encode_cursor, list_projects
+from migrations import run_migrations
+from models import Project
+
+run_migrations(engine)
+
+
+def test_cursor_round_trip_is_url_safe():
+    created_at = datetime(2026, 5, 1, 12, 30, 15, 123456)
+    cursor = encode_cursor(created_at, "3f2c-id")
+    assert "=" not in cursor and "/" not in cursor and "+" not in cursor
+    assert decode_cursor(cursor) == (created_at, "3f2c-id")
+
+
+@pytest.mark.parametrize("cursor", ["not-base64!", "bm90IGpzb24", encode_cursor(datetime(2026, 1, 1), "x")[:-3]])
+def test_malformed_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor(cursor)
+    assert exc.value.status_code == 400
+
+
+def test_pages_cover_every_project_once_newest_first():
+    same_time = datetime(2026, 2, 1, 9, 0)
+    with SessionLocal() as db:
+        # Two projects share a timestamp: the id breaks the tie, so none is skipped or repeated
+        for i, created_at in enumerate([datetime(2026, 1, 1), same_time, same_time, datetime(2026, 3, 1),
+                                        datetime(2026, 4, 1)]):
+            db.add(Project(id=f"page-{i}", name=f"Paging {i}", created_at=created_at))
+        db.commit()
+
+    seen, cursor = [], None
+    with SessionLocal() as db:
+        while True:
+            response = Response()
+            page = list_projects(response, limit=2, cursor=cursor, name_prefix="Paging", db=db)
+            seen += [p["id"] for p in page]
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+    assert seen == ["page-4", "page-3", "page-2", "page-1", "page-0"]
@@ -0,0 +1,67 @@
+import os
+import sys
+import subprocess
+import report_cache
+from report_service import PDFReportService
+
+
+def write_report(root, project_id, etag, size, mtime):
+    directory = root / project_id
+    directory.mkdir(exist_ok=True)
+    path = directory / f"{etag}.pdf"
+    path.write_bytes(b"x" * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_sweep_evicts_least_recently_served_reports(tmp_path, monkeypatch):
+    monkeypatch.setattr(report_cache, "REPORT_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(report_cache, "REPORT_CACHE_MAX_FILES", 2)
+    oldest = write_report(tmp_path, "p1", "a", 10, 1000)
+    served = write_report(tmp_path, "p2", "b", 10, 2000)
+    newest = write_report(tmp_path, "p3", "c", 10, 3000)
+
+    assert report_cache.cached_path("p2", "b") == str(served)  # a hit refreshes its place
+    assert report_cache.sweep() == 1
+    assert not oldest.exists() and not (tmp_path / "p1").exists()
+    assert served.exists() and newest.exists()
+
+
+def test_sweep_keeps_total_size_under_the_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(report_cache, "REPORT_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(report_cache, "REPORT_CACHE_MAX_MB", 1)
+    for i in range(3):
+        write_report(tmp_path, f"p{i}", "v", 400 * 1024, 1000 + i)
+    assert report_cache.sweep() == 1
+    assert not (tmp_path / "p0").exists()
+    assert report_cache.cached_path("p0", "v") is None
+
+
+def test_report_shows_the_save_time_not_the_render_time():
+    assert PDFReportService._format_saved_at("2026-03-04T05:06:07") == "2026-03-04 05:06 UTC"
+    assert PDFReportService._format_saved_at(None) == "N/A"
+
+
+def test_etag_does_not_import_reportlab():
+    code = ("import sys, report_cache; report_cache.report_etag('p', {'name': 'x'}); "
+            "sys.exit('reportlab' in sys.modules)")
+    cortex_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    assert subprocess.run([sys.executable, "-c", code], cwd=cortex_dir).returncode == 0
+
+
+def test_open_report_survives_a_sweep(tmp_path, monkeypatch):
+    monkeypatch.setattr(report_cache, "REPORT_CACHE_DIR", str(tmp_path))
+    project = {"name": "Sweep Test", "data": {"input": {}, "result": {}}}
+    with report_cache.open_report("p1", project) as report:
+        monkeypatch.setattr(report_cache, "REPORT_CACHE_MAX_FILES", 0)
+        assert report_cache.sweep() == 1
+        assert report.read().startswith(b"%PDF")
+
+
+def test_open_report_renders_again_when_swept_before_open(tmp_path, monkeypatch):
+    real = write_report(tmp_path, "p1", "v", 10, 1000)
+    paths = [str(tmp_path / "p1" / "gone.pdf"), str(real)]
+    monkeypatch.setattr(report_cache, "render", lambda project_id, data: (paths.pop(0), "v"))
+    with report_cache.open_report("p1", {}) as report:
+        assert report.read() == b"x" * 10
+    assert paths == []
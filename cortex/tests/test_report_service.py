@@ -0,0 +1,51 @@
+import gc
+import weakref
+from pypdf import PdfReader
+import report_service
+from report_service import LazyFlowables, PDFReportService
+
+
+def project(rows):
+    return {"name": "Tower", "data": {"input": {}, "result": {
+        "bom_tier_a": ["Addressable FACP"], "bom_tier_b": [f"Smoke detector {i}" for i in range(rows)]}}}
+
+
+def test_lazy_flowables_pull_only_what_is_consumed():
+    pulled = []
+
+    def source():
+        for i in range(5):
+            pulled.append(i)
+            yield i
+
+    flowables = LazyFlowables(source())
+    assert pulled == [0, 1]
+    assert flowables[0] == 0
+    del flowables[0]
+    assert len(flowables) == 2 and pulled == [0, 1, 2]
+    flowables.insert(0, "split")
+    assert flowables[0] == "split"
+
+
+def test_bom_chunks_are_released_as_they_are_drawn(monkeypatch):
+    monkeypatch.setattr(report_service, "BOM_CHUNK_ROWS", 50)
+    built = []
+    original = PDFReportService._bom_tables
+
+    def tracked(rows):
+        for table in original(rows):
+            gc.collect()
+            assert sum(ref() is not None for ref in built) <= 1  # earlier chunks already dropped
+            built.append(weakref.ref(table))
+            yield table
+
+    monkeypatch.setattr(PDFReportService, "_bom_tables", staticmethod(tracked))
+    reader = PdfReader(PDFReportService().generate_report(project(400)))
+    assert len(built) == 9  # 401 rows in chunks of 50
+    text = "".join(page.extract_text() for page in reader.pages)
+    assert "Smoke detector 0" in text and "Smoke detector 399" in text
+
+
+def test_empty_bom_still_renders_the_header_table():
+    text = PdfReader(PDFReportService().generate_report(project(0))).pages[0].extract_text()
+    assert "Item Description" in text
@@ -0,0 +1,89 @@
+from component_index import ComponentIndex, component_tokens
+from models import Component
+from search_index import BM25Index, tokenize
+
+DOCS = [
+    "photoelectric smoke detector ceiling mount",
+    "fixed temperature heat detector",
+    "smoke alarm with low frequency sounder",
+    "horn strobe wall mount",
+    "smoke detector base with sounder",
+]
+
+
+def build():
+    return BM25Index.build([tokenize(d) for d in DOCS])
+
+
+def test_tokenize_lowercases_and_splits_on_punctuation():
+    assert tokenize("SD-355 Smoke/Heat") == ["sd", "355", "smoke", "heat"]
+    assert tokenize(None) == []
+
+
+def test_and_query_requires_every_word():
+    hits = [doc for doc, _ in build().search(["smoke", "detector"], limit=10)]
+    assert sorted(hits) == [0, 4]
+
+
+def test_or_query_ranks_documents_matching_more_words_first():
+    hits = build().search(["smoke", "sounder"], limit=10, require_all=False)
+    docs = [doc for doc, _ in hits]
+    assert set(docs) == {0, 2, 4}
+    assert set(docs[:2]) == {2, 4}
+    scores = [score for _, score in hits]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_prefix_matches_score_below_exact_matches():
+    index = BM25Index.build([["detector"], ["detectors"]])
+    hits = index.search(["detector"], limit=2)
+    assert [doc for doc, _ in hits] == [0, 1]
+    assert hits[0][1] > hits[1][1]
+
+
+def test_single_term_fast_path_matches_general_path():
+    index = build()
+    fast = index.search(["strobe"], limit=5)
+    assert [doc for doc, _ in fast] == [3]
+    assert index.search(["zzz"], limit=5) == []
+    assert index.search(["smoke", "zzz"], limit=5) == []  # AND with an unknown word
+
+
+def test_limit_and_stable_tie_order():
+    index = BM25Index.build([["horn"], ["horn"], ["horn"]])
+    assert index.search(["horn"], limit=2) == index.search(["horn"], limit=2)
+    assert [doc for doc, _ in index.search(["horn"], limit=2)] == [0, 1]
+
+
+def test_empty_index():
+    index = BM25Index.build([])
+    assert len(index) == 0
+    assert index.search(["smoke"]) == []
+
+
+def test_component_tokens_keep_whole_sku():
+    assert "sd-355" in component_tokens("SD-355", "Detection", "Smoke detector")
+
+
+def store(db, parts):
+    db.query(Component).delete()
+    db.add_all(Component(part_number=pn, category="Detection", description=description, price=1.0)
+               for pn, description in parts)
+    db.commit()
+
+
+def test_component_index_search_uses_one_consistent_snapshot(db):
+    index = ComponentIndex()
+    assert index.search(["smoke"]) == []
+    store(db, [("SD-1", "smoke detector"), ("HD-1", "heat detector")])
+    index.refresh(db)
+    assert [r["part_number"] for r in index.search(["SD-1"])] == ["SD-1"]
+
+    # A rebuild swaps index and payloads together; results always come from one build
+    old_snapshot = index._snapshot
+    store(db, [("HS-1", "horn strobe")])
+    index.refresh(db)
+    assert index._snapshot is not old_snapshot
+    assert index.search(["detector"]) == []
+    assert [r["part_number"] for r in index.search(["horn"])] == ["HS-1"]
+    assert index.stats()["documents"] == 1
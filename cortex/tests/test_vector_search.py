@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from models import Component
+from vector_search import EmbeddingMatrix, vector_search
+
+
+def store(db, vectors):
+    db.query(Component).delete()
+    db.add_all(Component(part_number=pn, category="Detection", description=pn, price=1.0, embedding=vec)
+               for pn, vec in vectors.items())
+    db.commit()
+
+
+def part_numbers(hits):
+    return [h["part_number"] for h in hits]
+
+
+def test_cosine_ranking_skips_zero_vectors(db):
+    store(db, {"A": [1.0, 0.0, 0.0], "B": [0.6, 0.8, 0.0], "ZERO": [0.0, 0.0, 0.0]})
+    matrix = EmbeddingMatrix()
+    assert matrix.refresh(db) == 2
+    hits = matrix.search([1.0, 0.1, 0.0], limit=5)
+    assert part_numbers(hits) == ["A", "B"]
+    assert hits[0]["score"] > hits[1]["score"]
+    assert matrix.search([0.0, 0.0, 0.0]) == []
+
+
+@pytest.mark.parametrize("limit", [0, -1])
+def test_non_positive_limit_returns_nothing(db, limit):
+    store(db, {"A": [1.0, 0.0]})
+    matrix = EmbeddingMatrix()
+    matrix.refresh(db)
+    assert matrix.search([1.0, 0.0], limit=limit) == []
+    assert vector_search(db, [1.0, 0.0], limit=limit) == []
+
+
+def test_search_after_invalidate_reloads_from_the_database(db):
+    store(db, {"A": [1.0, 0.0]})
+    matrix = EmbeddingMatrix()
+    matrix.refresh(db)
+    store(db, {"A": [1.0, 0.0], "B": [0.9, 0.1]})
+    assert part_numbers(matrix.search([1.0, 0.0])) == ["A"]  # still the loaded build
+    matrix.invalidate()
+    assert not matrix.ready
+    assert part_numbers(matrix.search([1.0, 0.0])) == ["A", "B"]
+    assert matrix.ready
+
+
+class RefreshingQuery(list):
+    """A query vector that triggers a rebuild at the moment the search converts it."""
+
+    def __init__(self, values, on_read):
+        super().__init__(values)
+        self.on_read = on_read
+
+    def __array__(self, dtype=None, copy=None):
+        self.on_read()
+        return np.array(list(self), dtype=dtype)
+
+
+def test_refresh_during_a_search_never_mixes_builds(db):
+    store(db, {"OLD-1": [1.0, 0.0], "OLD-2": [0.0, 1.0]})
+    matrix = EmbeddingMatrix()
+    matrix.refresh(db)
+
+    def rebuild():
+        # More rows in a different order: an old matrix with new payloads would mislabel hits
+        store(db, {"NEW-1": [0.0, 1.0], "NEW-2": [1.0, 0.0], "NEW-3": [0.7, 0.7]})
+        matrix.refresh(db)
+
+    hits = matrix.search(RefreshingQuery([1.0, 0.0], rebuild), limit=3)
+    assert part_numbers(hits) == ["OLD-1", "OLD-2"]
+    assert part_numbers(matrix.search([1.0, 0.0], limit=3)) == ["NEW-2", "NEW-3", "NEW-1"]
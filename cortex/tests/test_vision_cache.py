@@ -0,0 +1,72 @@
+import time
+from datetime import datetime, timedelta
+import vision_cache
+from database import SessionLocal, engine
+from migrations import run_migrations
+from models import VisionAnalysisCache
+from ttl_cache import TTLCache
+
+run_migrations(engine)
+
+
+def age_row(key, hours):
+    with SessionLocal() as db:
+        db.get(VisionAnalysisCache, key).created_at = datetime.utcnow() - timedelta(hours=hours)
+        db.commit()
+
+
+def test_entry_ttl_can_be_shorter_than_the_cache_ttl():
+    cache = TTLCache(maxsize=4, ttl=3600)
+    cache.set("fresh", 1)
+    cache.set("expired", 2, ttl=0)
+    cache.set("short", 3, ttl=-5)
+    assert cache.get("fresh") == 1
+    assert cache.get("expired") is None and cache.get("short") is None
+
+
+def test_in_process_copy_expires_with_the_row(monkeypatch):
+    monkeypatch.setattr(vision_cache, "_lru", TTLCache(maxsize=8, ttl=vision_cache.CACHE_TTL_HOURS * 3600))
+    key = vision_cache.image_key(b"sheet-ttl")
+    vision_cache.put({"rooms": []}, 10, key)
+    vision_cache._lru.clear()
+
+    # Loaded from a row with an hour left: the LRU copy must not outlive it by a full TTL
+    age_row(key, vision_cache.CACHE_TTL_HOURS - 1)
+    assert vision_cache.get(key) == {"data": {"rooms": []}, "image_size": 10}
+    _, expires_at = vision_cache._lru._data[key]
+    assert expires_at - time.monotonic() <= 3600
+
+    vision_cache._lru.clear()
+    age_row(key, vision_cache.CACHE_TTL_HOURS + 1)
+    assert vision_cache.get(key) is None
+
+
+def test_in_process_hits_keep_the_row_recently_used(monkeypatch):
+    monkeypatch.setattr(vision_cache, "_lru", TTLCache(maxsize=8, ttl=vision_cache.CACHE_TTL_HOURS * 3600))
+    hot, cold = vision_cache.image_key(b"sheet-hot"), vision_cache.image_key(b"sheet-cold")
+    vision_cache.put({"rooms": ["hot"]}, 10, hot)
+    vision_cache.put({"rooms": ["cold"]}, 10, cold)
+    with SessionLocal() as db:
+        db.get(VisionAnalysisCache, hot).last_hit_at = datetime.utcnow() - timedelta(days=3)
+        db.commit()
+
+    for _ in range(3):
+        assert vision_cache.get(hot) is not None  # served from memory
+    assert vision_cache.flush_hits() == 1
+    with SessionLocal() as db:
+        row = db.get(VisionAnalysisCache, hot)
+        assert row.hit_count == 3
+        assert row.last_hit_at > datetime.utcnow() - timedelta(minutes=1)
+
+    # With room for one row, prune keeps the sheet that is only ever hit in memory
+    monkeypatch.setattr(vision_cache, "CACHE_MAX_ROWS", 1)
+    with SessionLocal() as db:
+        db.query(VisionAnalysisCache).filter(VisionAnalysisCache.cache_key.notin_([hot, cold])).delete(
+            synchronize_session=False)
+        db.get(VisionAnalysisCache, cold).last_hit_at = datetime.utcnow() - timedelta(hours=1)
+        db.commit()
+    vision_cache.get(hot)
+    vision_cache.prune()
+    with SessionLocal() as db:
+        assert db.get(VisionAnalysisCache, hot) is not None
+        assert db.get(VisionAnalysisCache, cold) is None
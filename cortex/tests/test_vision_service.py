@@ -0,0 +1,67 @@
+import pytest
+from sqlalchemy import event
+import vision_service
+from component_index import ComponentIndex
+from models import Component
+from vision_service import VisionEngine
+
+CATALOG = {
+    "SD-1": ("Detection", "Photoelectric Smoke Detector"),
+    "SD-2": ("Detection", "Smoke Detector with Sounder Base"),
+    "HD-1": ("Detection", "Fixed Heat Detector 135F"),
+    "HS-1": ("Notification", "Horn Strobe Wall"),
+    "PS-1": ("Initiating", "Pull Station Dual Action"),
+    "DH-1": ("Door Hardware", "Magnetic Door Holder"),
+}
+
+
+@pytest.fixture
+def engine(db, monkeypatch):
+    db.query(Component).delete()
+    db.add_all(Component(part_number=pn, category=cat, description=desc, price=10.0)
+               for pn, (cat, desc) in CATALOG.items())
+    db.commit()
+    # SQL fallback: the shared in-memory index is not built
+    monkeypatch.setattr(vision_service, "component_index", ComponentIndex())
+    return VisionEngine()
+
+
+@pytest.fixture
+def statements(db):
+    seen = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        seen.append(statement)
+
+    event.listen(db.bind, "before_cursor_execute", record)
+    yield seen
+    event.remove(db.bind, "before_cursor_execute", record)
+
+
+def part_numbers(matches):
+    return sorted(m["part_number"] for m in matches)
+
+
+def test_queries_with_the_same_keyword_set_share_one_lookup(engine, db, statements, capsys):
+    queries = ["Smoke Detector", "smoke, detector", "Detector SMOKE", "Heat", "on"]
+    results = engine.retrieve_components_batch(db, queries, limit=5, mode="keyword")
+
+    assert "5 needs -> 2 distinct" in capsys.readouterr().out
+    assert len(statements) == 1 and statements[0].count("UNION ALL") == 1  # one round trip, two branches
+    assert part_numbers(results["Smoke Detector"]) == ["SD-1", "SD-2"]
+    assert results["smoke, detector"] == results["Smoke Detector"] == results["Detector SMOKE"]
+    assert part_numbers(results["Heat"]) == ["HD-1"]
+    assert results["on"] == []  # no keyword long enough to search
+    assert engine.retrieval_method == "keyword_search_ilike"
+
+
+def test_union_all_fallback_chunks_and_routes_each_branch(engine, db, statements, monkeypatch):
+    monkeypatch.setattr(vision_service, "BATCH_QUERY_SIZE", 2)
+    queries = ["Smoke", "Heat", "Strobe", "Pull Station", "Door Holder"]
+    results = engine.retrieve_components_batch(db, queries, limit=1, mode="keyword")
+
+    assert len(statements) == 3  # ceil(5 distinct / 2 per UNION ALL)
+    assert [s.count("UNION ALL") for s in statements] == [1, 1, 0]
+    assert all(len(matches) == 1 for matches in results.values())  # LIMIT applies per branch
+    assert results["Smoke"][0]["part_number"] in ("SD-1", "SD-2")
+    assert [results[q][0]["part_number"] for q in queries[1:]] == ["HD-1", "HS-1", "PS-1", "DH-1"]
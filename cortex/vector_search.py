@@ -0,0 +1,175 @@
+import os
+import time
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import sqlalchemy
+from sqlalchemy.orm import Session
+from database import ReadSessionLocal
+from models import Component
+from component_index import component_index
+
+# ANN Tuning (pgvector)
+HNSW_EF_SEARCH = int(os.getenv("PGVECTOR_HNSW_EF_SEARCH", "40"))
+# Weight of the vector score in hybrid mode (keyword gets 1 - alpha)
+HYBRID_ALPHA = float(os.getenv("RAG_HYBRID_ALPHA", "0.6"))
+# Candidates pulled from each retriever before hybrid re-ranking
+HYBRID_CANDIDATES = 50
+
+ANN_INDEX_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_components_embedding_hnsw "
+    "ON components USING hnsw (embedding vector_cosine_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_knowledge_base_embedding_hnsw "
+    "ON knowledge_base USING hnsw (embedding vector_cosine_ops)",
+]
+
+
+def ensure_ann_indexes(connection):
+    """Creates the pgvector HNSW indexes (Postgres only; no-op elsewhere)."""
+    if connection.dialect.name != "postgresql":
+        return
+    for ddl in ANN_INDEX_DDL:
+        connection.execute(sqlalchemy.text(ddl))
+
+
+def _serialize(part_number, category, description, price, score) -> Dict:
+    return {
+        "part_number": part_number,
+        "category": category,
+        "description": description,
+        "price": price,
+        "score": round(float(score), 4),
+    }
+
+
+class EmbeddingMatrix:
+    """
+    Brute-force cosine search for SQLite/dev: all component embeddings as one
+    L2-normalized float32 matrix, so a query is a single mat-vec product.
+    Rows with missing or all-zero embeddings (failed ingestion) are skipped.
+    Matrix and payloads are published as one immutable snapshot, so a search racing a
+    reload or `invalidate` never reads rows from one build against the other's matrix.
+    """
+
+    def __init__(self):
+        self._snapshot: Optional[Tuple[np.ndarray, List[tuple]]] = None
+        self._lock = threading.Lock()
+        self.build_ms = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._snapshot is not None
+
+    def refresh(self, db: Optional[Session] = None) -> int:
+        return len(self._load(db)[1])
+
+    def _load(self, db: Optional[Session] = None) -> Tuple[np.ndarray, List[tuple]]:
+        start = time.perf_counter()
+        owns_session = db is None
+        db = db or ReadSessionLocal()
+        try:
+            payloads, vectors = [], []
+            rows = db.query(
+                Component.part_number, Component.category, Component.description,
+                Component.price, Component.embedding
+            ).filter(Component.embedding.isnot(None)).yield_per(2000)
+            for r in rows:
+                vec = np.asarray(r.embedding, dtype=np.float32)
+                norm = np.linalg.norm(vec)
+                if norm == 0:
+                    continue
+                payloads.append((r.part_number, r.category, r.description, r.price))
+                vectors.append(vec / norm)
+        finally:
+            if owns_session:
+                db.close()
+
+        matrix = np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+        snapshot = (matrix, payloads)
+        with self._lock:
+            self._snapshot = snapshot
+            self.build_ms = int((time.perf_counter() - start) * 1000)
+        print(f"[CORTEX] Embedding matrix loaded: {len(payloads)} vectors in {self.build_ms}ms.")
+        return snapshot
+
+    def invalidate(self):
+        """Drops the loaded matrix; the next search reloads it from the DB."""
+        with self._lock:
+            self._snapshot = None
+
+    def search(self, query_vec: List[float], limit: int = 5) -> List[Dict]:
+        if limit <= 0:
+            return []
+        matrix, payloads = self._snapshot or self._load()
+        if matrix.size == 0:
+            return []
+        q = np.asarray(query_vec, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return []
+        sims = matrix @ (q / norm)
+        k = min(limit, sims.size)
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        return [_serialize(*payloads[i], sims[i]) for i in top]
+
+
+# Process-wide fallback matrix
+embedding_matrix = EmbeddingMatrix()
+
+
+def vector_search(db: Session, query_vec: List[float], limit: int = 5, exact: bool = False) -> List[Dict]:
+    """
+    Nearest components by cosine similarity.
+    Postgres goes through the HNSW index (`exact=True` disables it, for recall checks);
+    other dialects use the in-memory NumPy matrix.
+    """
+    if limit <= 0:
+        return []
+    if db.bind.dialect.name != "postgresql":
+        return embedding_matrix.search(query_vec, limit=limit)
+
+    distance = Component.embedding.cosine_distance(query_vec).label("distance")
+    # SET LOCAL would last for the caller's whole transaction; rolling back to a savepoint
+    # undoes it, so later queries on this session run with the default planner settings
+    savepoint = db.begin_nested()
+    try:
+        if exact:
+            db.execute(sqlalchemy.text("SET LOCAL enable_indexscan = off"))
+        else:
+            db.execute(sqlalchemy.text(f"SET LOCAL hnsw.ef_search = {int(HNSW_EF_SEARCH)}"))
+        rows = db.query(
+            Component.part_number, Component.category, Component.description, Component.price, distance
+        ).filter(Component.embedding.isnot(None)).order_by(distance).limit(limit).all()
+    finally:
+        savepoint.rollback()
+    return [_serialize(r.part_number, r.category, r.description, r.price, 1 - r.distance) for r in rows]
+
+
+def _min_max(scores: Dict[str, float]) -> Dict[str, float]:
+    if not scores:
+        return {}
+    lo, hi = min(scores.values()), max(scores.values())
+    if hi == lo:
+        return {k: 1.0 for k in scores}
+    return {k: (v - lo) / (hi - lo) for k, v in scores.items()}
+
+
+def hybrid_search(db: Session, keywords: List[str], query_vec: List[float], limit: int = 5,
+                  alpha: float = HYBRID_ALPHA) -> List[Dict]:
+    """
+    Keyword (BM25, any-term) and vector candidates, each min-max normalized and blended:
+    score = alpha * vector + (1 - alpha) * keyword.
+    """
+    keyword_hits = component_index.search(keywords, limit=HYBRID_CANDIDATES, require_all=False)
+    vector_hits = vector_search(db, query_vec, limit=HYBRID_CANDIDATES)
+
+    payloads = {}
+    for hit in keyword_hits + vector_hits:
+        payloads.setdefault(hit["part_number"], hit)
+    kw = _min_max({h["part_number"]: h["score"] for h in keyword_hits})
+    vec = _min_max({h["part_number"]: h["score"] for h in vector_hits})
+
+    blended = {pn: alpha * vec.get(pn, 0.0) + (1 - alpha) * kw.get(pn, 0.0) for pn in payloads}
+    ranked = sorted(blended.items(), key=lambda item: -item[1])[:limit]
+    return [dict(payloads[pn], score=round(score, 4)) for pn, score in ranked]
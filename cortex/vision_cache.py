@@ -0,0 +1,174 @@
+import os
+import copy
+import hashlib
+import time
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+from database import SessionLocal
+from models import VisionAnalysisCache
+from ttl_cache import TTLCache
+from vision_service import MODEL_NAME, PROMPT_VERSION
+
+# Eviction Policy
+CACHE_TTL_HOURS = float(os.getenv("VISION_CACHE_TTL_HOURS", "720"))  # 30 days
+CACHE_MAX_ROWS = int(os.getenv("VISION_CACHE_MAX_ROWS", "50000"))
+CACHE_LRU_SIZE = int(os.getenv("VISION_CACHE_LRU_SIZE", "512"))  # 0 disables the in-process layer
+PRUNE_EVERY = 100  # writes between DB eviction passes
+# In-process hits are written back to hit_count/last_hit_at in batches (prune orders by last_hit_at)
+HIT_FLUSH_EVERY = 50
+HIT_FLUSH_SECONDS = 60.0
+
+_lru = TTLCache(maxsize=CACHE_LRU_SIZE, ttl=CACHE_TTL_HOURS * 3600)
+_writes = 0
+_writes_lock = threading.Lock()
+_pending_hits: Counter = Counter()
+_hits_lock = threading.Lock()
+_last_hit_flush = time.monotonic()
+
+
+def _version_prefix() -> bytes:
+    return f"{MODEL_NAME}:{PROMPT_VERSION}:".encode()
+
+
+def _context_tag(context: str) -> bytes:
+    """Injected prompt context (code excerpts) changes the answer, so it is part of the key."""
+    return f"ctx={hashlib.sha256(context.encode()).hexdigest()}:".encode() if context else b""
+
+
+def image_key(image_bytes: bytes, context: str = "") -> str:
+    """Content address of a rendered page for the current model/prompt (and prompt context)."""
+    return hashlib.sha256(_version_prefix() + _context_tag(context) + image_bytes).hexdigest()
+
+
+def source_key(pdf_digest: str, page: int, render_settings: str, context: str = "") -> str:
+    """
+    Address of a page *before* rendering (PDF hash + page + render settings),
+    so an unchanged upload can skip rasterization entirely. `context` identifies what the
+    prompt context is built from (the knowledge index version), since the context itself
+    is only known after the page is read.
+    """
+    raw = _version_prefix() + _context_tag(context) + f"{pdf_digest}:{page}:{render_settings}".encode()
+    return "src:" + hashlib.sha256(raw).hexdigest()
+
+
+def pdf_digest(pdf_content: bytes) -> str:
+    return hashlib.sha256(pdf_content).hexdigest()
+
+
+def get(key: str) -> Optional[Dict[str, Any]]:
+    """
+    Returns a private copy of the cached analysis, or None.
+    Blocking (DB); call from the threadpool when on the event loop.
+    """
+    entry = _lru.get(key)
+    if entry is not None:
+        _record_hit(key)
+        return copy.deepcopy(entry)
+
+    with SessionLocal() as db:
+        row = db.get(VisionAnalysisCache, key)
+        if row is None:
+            return None
+        if row.created_at < datetime.utcnow() - timedelta(hours=CACHE_TTL_HOURS):
+            db.delete(row)
+            db.commit()
+            return None
+        row.hit_count = (row.hit_count or 0) + 1
+        row.last_hit_at = datetime.utcnow()
+        db.commit()
+        entry = {"data": row.result, "image_size": row.image_size}
+        # The in-process copy expires with the row, not a full TTL after this read
+        remaining = (row.created_at + timedelta(hours=CACHE_TTL_HOURS) - datetime.utcnow()).total_seconds()
+
+    _lru.set(key, entry, ttl=remaining)
+    return copy.deepcopy(entry)
+
+
+def _record_hit(key: str):
+    with _hits_lock:
+        _pending_hits[key] += 1
+        due = len(_pending_hits) >= HIT_FLUSH_EVERY or time.monotonic() - _last_hit_flush >= HIT_FLUSH_SECONDS
+    if due:
+        flush_hits()
+
+
+def flush_hits() -> int:
+    """Writes batched in-process hits to their rows, so prune() sees hot sheets as recently used."""
+    global _pending_hits, _last_hit_flush
+    with _hits_lock:
+        pending, _pending_hits = _pending_hits, Counter()
+        _last_hit_flush = time.monotonic()
+    if not pending:
+        return 0
+    by_count: Dict[int, list] = {}
+    for key, count in pending.items():
+        by_count.setdefault(count, []).append(key)
+    now = datetime.utcnow()
+    try:
+        with SessionLocal() as db:
+            for count, keys in by_count.items():
+                db.query(VisionAnalysisCache).filter(VisionAnalysisCache.cache_key.in_(keys)).update(
+                    {"hit_count": VisionAnalysisCache.hit_count + count, "last_hit_at": now},
+                    synchronize_session=False)
+            db.commit()
+    except Exception as e:
+        print(f"[CORTEX] Vision cache hit flush failed: {e}")
+        return 0
+    return len(pending)
+
+
+def put(data: Dict[str, Any], image_size: int, *keys: str):
+    """Stores one analysis under every given key (image key and/or source key)."""
+    global _writes
+    entry = {"data": copy.deepcopy(data), "image_size": image_size}
+    with SessionLocal() as db:
+        for key in keys:
+            db.merge(VisionAnalysisCache(
+                cache_key=key,
+                model_name=MODEL_NAME,
+                prompt_version=PROMPT_VERSION,
+                result=entry["data"],
+                image_size=image_size,
+                hit_count=0,
+                created_at=datetime.utcnow(),
+                last_hit_at=datetime.utcnow(),
+            ))
+            _lru.set(key, entry)
+        db.commit()
+
+    with _writes_lock:
+        _writes += 1
+        should_prune = _writes % PRUNE_EVERY == 0
+    if should_prune:
+        prune()
+
+
+def prune() -> int:
+    """Drops expired rows, then the least recently hit rows above CACHE_MAX_ROWS."""
+    flush_hits()
+    cutoff = datetime.utcnow() - timedelta(hours=CACHE_TTL_HOURS)
+    with SessionLocal() as db:
+        removed = db.query(VisionAnalysisCache).filter(
+            VisionAnalysisCache.created_at < cutoff
+        ).delete(synchronize_session=False)
+
+        overflow = db.query(VisionAnalysisCache.cache_key).order_by(
+            VisionAnalysisCache.last_hit_at.desc()
+        ).offset(CACHE_MAX_ROWS).all()
+        if overflow:
+            removed += db.query(VisionAnalysisCache).filter(
+                VisionAnalysisCache.cache_key.in_([k for (k,) in overflow])
+            ).delete(synchronize_session=False)
+        db.commit()
+
+    if removed:
+        _lru.clear()
+        print(f"[CORTEX] Vision cache pruned {removed} entries.")
+    return removed
+
+
+def stats() -> dict:
+    return {"lru": _lru.stats(), "pending_hits": len(_pending_hits), "ttl_hours": CACHE_TTL_HOURS,
+            "max_rows": CACHE_MAX_ROWS}
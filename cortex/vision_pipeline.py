@@ -0,0 +1,530 @@
+import os
+import io
+import json
+import asyncio
+import multiprocessing
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Dict, Any, Optional, Tuple
+from pypdf import PdfReader
+from audit_log import audit_sink
+from vision_service import FALLBACK_ANALYSIS, MODEL_NAME, get_vision_engine
+from image_prep import DEFAULT_SETTINGS, PrepSettings, Tile, prepare_page
+from json_stream import JsonArrayStream
+from kb_index import kb_index
+from ttl_cache import TTLCache
+import vision_cache
+
+# Pool Sizing (bounded so a 120-sheet set can't exhaust the worker)
+RASTER_WORKERS = int(os.getenv("VISION_RASTER_WORKERS", "2"))
+# Max concurrent Gemini calls across all requests on this worker
+MAX_CONCURRENCY = int(os.getenv("VISION_MAX_CONCURRENCY", "4"))
+MAX_PAGES = int(os.getenv("VISION_MAX_PAGES", "200"))
+RASTER_ERROR = "Could not convert page to image."
+
+# on_event(name, data) callback of `analyze_pdf`; called on the event loop, must not block
+EventCallback = Callable[[str, Dict[str, Any]], None]
+
+
+class PdfConversionError(Exception):
+    """The upload has no page that could be read or rasterized."""
+
+_raster_pool: Optional[ProcessPoolExecutor] = None
+_model_semaphore: Optional[asyncio.Semaphore] = None
+# Parsed PDFs inside each raster worker: the pages of one upload share a single parse
+_pdf_readers = TTLCache(maxsize=2)
+
+
+def get_raster_pool() -> ProcessPoolExecutor:
+    """Process-wide rasterization pool, created on first use."""
+    global _raster_pool
+    if _raster_pool is None:
+        # Spawned, not forked: a fork of the running API would copy its event loop, DB pools
+        # and locks (possibly held by another thread) into every worker
+        _raster_pool = ProcessPoolExecutor(max_workers=RASTER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _raster_pool
+
+
+def get_model_semaphore() -> asyncio.Semaphore:
+    """Process-wide limit on in-flight model calls (created inside the running loop)."""
+    global _model_semaphore
+    if _model_semaphore is None:
+        _model_semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    return _model_semaphore
+
+
+def shutdown_pools():
+    global _raster_pool
+    if _raster_pool is not None:
+        _raster_pool.shutdown(wait=False, cancel_futures=True)
+        _raster_pool = None
+
+
+def count_pages(pdf_content: bytes) -> int:
+    """Reads the page count from the PDF trailer without rendering anything."""
+    return len(PdfReader(io.BytesIO(pdf_content)).pages)
+
+
+def _write_temp_pdf(pdf_content: bytes) -> str:
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        tmp.write(pdf_content)
+        return tmp.name
+
+
+def _pdf_reader(pdf_path: str) -> PdfReader:
+    """The worker's parsed copy of `pdf_path` (pypdf loads the file into memory once)."""
+    stat = os.stat(pdf_path)
+    key = (pdf_path, stat.st_mtime_ns, stat.st_size)
+    reader = _pdf_readers.get(key)
+    if reader is None:
+        reader = PdfReader(pdf_path)
+        _pdf_readers.set(key, reader)
+    return reader
+
+
+def prepare_page_with_text(pdf_path: str, page_number: int, settings: PrepSettings = DEFAULT_SETTINGS,
+                           with_text: bool = True) -> Tuple[List[Tile], str]:
+    """Raster pool task: a page's tiles plus its text layer (room labels drive code retrieval)."""
+    tiles = prepare_page(pdf_path, page_number, settings)
+    text = ""
+    if with_text and tiles:
+        try:
+            text = _pdf_reader(pdf_path).pages[page_number - 1].extract_text() or ""
+        except Exception as e:
+            print(f"[CORTEX] Text extraction failed for page {page_number}: {e}")
+    return tiles, text
+
+
+async def _timed_analyze(vision, tile: Tile, code_context: str = "",
+                         on_room: Optional[Callable[[Dict[str, Any]], None]] = None):
+    """Model call for one tile, with the sheet's code excerpts ahead of the tile instructions.
+    With `on_room`, the response is streamed and each room is passed on as soon as its JSON
+    object is complete."""
+    prompt_context = "\n\n".join(part for part in (code_context, tile.prompt_context()) if part)
+    start = time.perf_counter()
+    async with get_model_semaphore():
+        if on_room is None:
+            raw = await vision.analyze_plan_async(tile.data, prompt_context, mime_type=tile.mime_type)
+        else:
+            rooms, parts = JsonArrayStream("rooms"), []
+            async for text in vision.analyze_plan_stream(tile.data, prompt_context, mime_type=tile.mime_type):
+                parts.append(text)
+                for room in rooms.feed(text):
+                    if isinstance(room, dict):
+                        on_room(room)
+            raw = "".join(parts)
+    return raw, int((time.perf_counter() - start) * 1000)
+
+
+def merge_tile_results(tile_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Combines the analyses of one sheet's tiles. Each tile owns the rooms labelled in it
+    (overlap strips are assigned by the prompt), so rooms are concatenated.
+    """
+    if len(tile_data) == 1:
+        return tile_data[0]
+    merged: Dict[str, Any] = {"rooms": []}
+    notes = []
+    for data in tile_data:
+        for field in ("occupancy", "scale_estimated"):
+            if not merged.get(field) and data.get(field):
+                merged[field] = data[field]
+        if isinstance(data.get("rooms"), list):
+            merged["rooms"].extend(data["rooms"])
+        if data.get("analysis_notes") and data["analysis_notes"] not in notes:
+            notes.append(data["analysis_notes"])
+    merged["analysis_notes"] = " ".join(notes)
+    return merged
+
+
+def select_pages(total_pages: int, all_pages: bool, max_pages: Optional[int] = None) -> List[int]:
+    """Returns the 1-based page numbers to analyze."""
+    if not all_pages:
+        return [1] if total_pages else []
+    limit = min(total_pages, max_pages or MAX_PAGES, MAX_PAGES)
+    return list(range(1, limit + 1))
+
+
+def parse_plan_response(ai_response: Any) -> Dict[str, Any]:
+    """Normalizes the raw `analyze_plan` output (dict or JSON string) into a dict."""
+    if isinstance(ai_response, dict):
+        # It's an error or pre-parsed dict
+        if "error" in ai_response:
+            print(f"[CORTEX] Vision Error: {ai_response['error']}")
+            return {}
+        return ai_response
+    try:
+        clean_json = ai_response.replace("```json", "").replace("```", "")
+        ai_data = json.loads(clean_json)
+        return ai_data if isinstance(ai_data, dict) else {}
+    except (json.JSONDecodeError, AttributeError):
+        print(f"[CORTEX] Failed to parse AI JSON: {ai_response}")
+        return {}
+
+
+def merge_page_results(page_results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merges per-page analyses into one `ai_analysis`.
+    Rooms are concatenated and tagged with their sheet; the first detected occupancy wins.
+    """
+    merged = {"occupancy": None, "scale_estimated": None, "rooms": [], "pages": []}
+    notes = []
+
+    for result in sorted(page_results, key=lambda r: r["page"]):
+        page = result["page"]
+        data = result.get("data") or {}
+
+        if not merged["occupancy"] and data.get("occupancy"):
+            merged["occupancy"] = data["occupancy"]
+        if not merged["scale_estimated"] and data.get("scale_estimated"):
+            merged["scale_estimated"] = data["scale_estimated"]
+
+        rooms = data.get("rooms") if isinstance(data.get("rooms"), list) else []
+        for room in rooms:
+            if isinstance(room, dict):
+                room.setdefault("page", page)
+                merged["rooms"].append(room)
+
+        if data.get("analysis_notes"):
+            notes.append(f"[Page {page}] {data['analysis_notes']}" if len(page_results) > 1 else data["analysis_notes"])
+
+        merged["pages"].append({
+            "page": page,
+            "occupancy": data.get("occupancy"),
+            "room_count": len(rooms),
+            "tiles": result.get("tiles", 1),
+            "image_size": result.get("image_size", 0),
+            "cached": result.get("cached", False),
+            "error": result.get("error"),
+        })
+
+    merged["analysis_notes"] = "\n".join(notes)
+    if merged["occupancy"] is None:
+        del merged["occupancy"]
+    if merged["scale_estimated"] is None:
+        del merged["scale_estimated"]
+    return merged
+
+
+async def count_pages_async(pdf_content: bytes) -> int:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, count_pages, pdf_content)
+
+
+async def analyze_pdf_pages(vision, pdf_content: bytes, pages: List[int], use_cache: bool = True,
+                            settings: PrepSettings = DEFAULT_SETTINGS,
+                            on_page: Optional[Callable[[Dict[str, Any]], None]] = None,
+                            on_room: Optional[Callable[[int, Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
+    """
+    Prepares the requested pages lazily on the process pool (target DPI, trimmed,
+    tiled, size-budgeted; see image_prep) and sends each tile through
+    `vision.analyze_plan_async` as soon as it is ready. Tiles of a sheet are analyzed
+    in parallel and merged back into one page result.
+
+    Nothing here blocks the event loop: rendering runs in the process pool, file and cache
+    I/O in the default executor, and model calls are awaited under `VISION_MAX_CONCURRENCY`.
+    At most `RASTER_WORKERS * 2` rendered pages per request are held in memory at a time.
+
+    Each sheet's prompt carries the NFPA clauses retrieved for the room types in its text
+    layer (see kb_index), within the KB prompt token budget.
+
+    Results are cached by source page (+ prep settings, knowledge index version) and by tile
+    image hash (+ injected code context); `use_cache=False` skips the lookups (fresh results
+    are still written back).
+    Returns one entry per page:
+    {"page", "data", "raw", "image_size", "tiles", "latency_ms", "cached", "error"}.
+    `on_page` (optional, non-blocking) receives each entry as soon as its page is done.
+    `on_room(page, room)` (optional, non-blocking) streams the model output and receives every
+    room as soon as it is parsed (cached sheets and tiles report theirs at once).
+    """
+    if not pages:
+        return []
+
+    loop = asyncio.get_running_loop()
+    raster_pool = get_raster_pool()
+    window = asyncio.Semaphore(RASTER_WORKERS * 2)
+    render_settings = settings.cache_tag()
+    # One knowledge index build for the whole request, so cache keys and contexts agree
+    kb = kb_index.current()
+    kb_version = kb.version if kb else ""
+
+    digest = await loop.run_in_executor(None, vision_cache.pdf_digest, pdf_content)
+    # pdf2image works from a path; writing once avoids pickling the PDF for every page.
+    pdf_path = await loop.run_in_executor(None, _write_temp_pdf, pdf_content)
+
+    async def cached_result(page: int, key: str, start: float) -> Optional[Dict[str, Any]]:
+        if not use_cache:
+            return None
+        try:
+            hit = await loop.run_in_executor(None, vision_cache.get, key)
+        except Exception as e:
+            print(f"[CORTEX] Vision cache read failed: {e}")
+            return None
+        if hit is None:
+            return None
+        if on_room is not None and isinstance(hit["data"].get("rooms"), list):
+            for room in hit["data"]["rooms"]:
+                if isinstance(room, dict):
+                    on_room(page, room)
+        return {"page": page, "data": hit["data"], "raw": None, "image_size": hit["image_size"],
+                "tiles": 1, "latency_ms": int((time.perf_counter() - start) * 1000), "cached": True, "error": None}
+
+    async def process_page(page: int) -> Dict[str, Any]:
+        start = time.perf_counter()
+        src_key = vision_cache.source_key(digest, page, render_settings, kb_version)
+        hit = await cached_result(page, src_key, start)
+        if hit:
+            return hit
+
+        async with window:
+            try:
+                tiles, page_text = await loop.run_in_executor(
+                    raster_pool, prepare_page_with_text, pdf_path, page, settings, bool(kb_version))
+            except Exception as e:
+                print(f"[CORTEX] Rasterization failed for page {page}: {e}")
+                tiles, page_text = [], ""
+            if not tiles:
+                return {"page": page, "data": {}, "raw": None, "image_size": 0, "tiles": 0,
+                        "latency_ms": 0, "cached": False, "error": RASTER_ERROR}
+
+            # In-memory retrieval, cached per room-type mix (hybrid mode may call the embedding model)
+            code_context = await loop.run_in_executor(None, kb_index.context_for_page, page_text, kb) \
+                if kb_version else ""
+            tile_results = await asyncio.gather(*(process_tile(page, tile, code_context, start) for tile in tiles))
+
+        errors = [r["error"] for r in tile_results if r["error"]]
+        data = merge_tile_results([r["data"] for r in tile_results if r["data"]]) if len(errors) < len(tiles) else {}
+        image_size = sum(len(t.data) for t in tiles)
+        fresh = [r for r in tile_results if not r["cached"]]
+        # The whole sheet goes under its source key only if every tile is a real, cacheable answer
+        if data and all(r["cached"] or r["cacheable"] for r in tile_results):
+            try:
+                await loop.run_in_executor(None, vision_cache.put, data, image_size, src_key)
+            except Exception as e:
+                print(f"[CORTEX] Vision cache write failed: {e}")
+
+        return {"page": page, "data": data,
+                "raw": tile_results[0]["raw"] if len(tiles) == 1 else [r["raw"] for r in tile_results],
+                "image_size": image_size, "tiles": len(tiles),
+                "latency_ms": max(r["latency_ms"] for r in tile_results),
+                "cached": not fresh, "error": errors[0] if errors else None}
+
+    async def process_tile(page: int, tile: Tile, code_context: str, start: float) -> Dict[str, Any]:
+        img_key = vision_cache.image_key(tile.data, code_context)
+        hit = await cached_result(page, img_key, start)
+        if hit:
+            return hit
+
+        try:
+            raw, latency_ms = await _timed_analyze(
+                vision, tile, code_context, on_room=(lambda room: on_room(page, room)) if on_room is not None else None)
+            error = raw.get("error") if isinstance(raw, dict) else None
+        except Exception as e:
+            print(f"CRITICAL ERROR in analyze_plan call (page {page}, tile {tile.index + 1}): {e}")
+            raw, latency_ms, error = {"error": str(e)}, 0, str(e)
+        data = parse_plan_response(raw)
+
+        # Only real model answers are cached (never errors or the offline fallback)
+        cacheable = bool(data) and not error and raw != FALLBACK_ANALYSIS
+        if cacheable:
+            try:
+                await loop.run_in_executor(None, vision_cache.put, data, len(tile.data), img_key)
+            except Exception as e:
+                print(f"[CORTEX] Vision cache write failed: {e}")
+
+        return {"data": data, "raw": raw, "latency_ms": latency_ms, "cached": False, "cacheable": cacheable,
+                "error": error}
+
+    async def tracked_page(page: int) -> Dict[str, Any]:
+        result = await process_page(page)
+        if on_page is not None:
+            on_page(result)
+        return result
+
+    try:
+        results = await asyncio.gather(*(tracked_page(page) for page in pages))
+    finally:
+        await loop.run_in_executor(None, os.unlink, pdf_path)
+
+    return sorted(results, key=lambda r: r["page"])
+
+
+def record_vision_audit(workflow_id: str, filename: str, file_size: int,
+                        page_results: List[Dict[str, Any]]):
+    """Queues one `vision_analysis` audit row per sheet (written in bulk by the audit sink)."""
+    for result in page_results:
+        audit_sink.emit(
+            workflow_id=workflow_id,
+            step_name="vision_analysis",
+            input_data={"filename": filename, "file_size": file_size, "page": result["page"],
+                        "cached": result.get("cached", False)},
+            output_data=result["data"] or {"raw": str(result["raw"])},
+            model_name=MODEL_NAME,
+            latency_ms=result["latency_ms"]
+        )
+
+
+def enrich_rooms(vision, db, rooms: List[Dict[str, Any]], workflow_id: str) -> List[Dict[str, Any]]:
+    """
+    RAG Step: attaches a matched catalog component to every need of every room.
+    All needs of the plan are resolved in one batched, deduplicated retrieval, and one
+    audit row per distinct need is queued on the audit sink.
+    `db` is the caller's session (the engine itself holds none).
+    Blocking (sync SQLAlchemy); callers on the event loop run it in the threadpool.
+    """
+    needs = []
+    for room in rooms:
+        if "needs" in room and isinstance(room["needs"], list):
+            needs.extend(n for n in room["needs"] if isinstance(n, str))
+    distinct_needs = list(dict.fromkeys(needs))
+
+    rag_start = time.perf_counter()
+    matches_by_need = vision.retrieve_components_batch(db, distinct_needs, limit=1) if distinct_needs else {}
+    latency_ms = int((time.perf_counter() - rag_start) * 1000)
+
+    # Log Step 2: RAG Retrieval (bulk)
+    for need in distinct_needs:
+        audit_sink.emit(
+            workflow_id=workflow_id,
+            step_name="rag_retrieval",
+            input_data={"query": need, "batch_size": len(distinct_needs)},
+            output_data={"matches": matches_by_need.get(need, [])},
+            model_name=vision.retrieval_method,
+            latency_ms=latency_ms
+        )
+
+    enriched_rooms = []
+    for room in rooms:
+        if "needs" in room and isinstance(room["needs"], list):
+            found_components = []
+            for need in room["needs"]:
+                matches = matches_by_need.get(need, []) if isinstance(need, str) else []
+                if matches:
+                    # Attach the top match
+                    found_components.append({
+                        "generic": need,
+                        "sku": matches[0]["part_number"],
+                        "desc": matches[0]["description"]
+                    })
+                else:
+                    found_components.append({"generic": need, "sku": "UNKNOWN", "desc": "No Match"})
+
+            room["components"] = found_components
+        enriched_rooms.append(room)
+    return enriched_rooms
+
+
+def page_summary(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Small per-sheet progress record (no model output)."""
+    rooms = (result.get("data") or {}).get("rooms")
+    return {
+        "page": result["page"],
+        "room_count": len(rooms) if isinstance(rooms, list) else 0,
+        "tiles": result.get("tiles", 1),
+        "cached": result.get("cached", False),
+        "latency_ms": result.get("latency_ms", 0),
+        "error": result.get("error"),
+    }
+
+
+async def analyze_pdf(pdf_content: bytes, filename: str, db, all_pages: bool = False,
+                      max_pages: Optional[int] = None, use_cache: bool = True,
+                      workflow_id: Optional[str] = None,
+                      on_event: Optional[EventCallback] = None,
+                      progressive: bool = False) -> Dict[str, Any]:
+    """
+    The whole /analyze-pdf pipeline: page selection, vision analysis (cached, tiled,
+    concurrent), audit rows, merge and RAG enrichment. Shared by the synchronous endpoint,
+    the streaming endpoint and the analysis job workers. `db` is a read session for retrieval.
+
+    `on_event` receives "start" {workflow_id, total_pages, pages}, one "page" per sheet
+    (see page_summary) as it finishes, and "enrich" {rooms} before retrieval.
+    With `progressive`, model output is streamed and parsed incrementally ("room" {page, room}
+    per room as it is read), and each sheet is enriched as soon as it is done ("components"
+    {page, index, room} per room) instead of all sheets in one batch at the end.
+    Raises PdfConversionError when nothing in the upload can be rasterized.
+    """
+    emit = on_event or (lambda name, data: None)
+    workflow_id = workflow_id or str(uuid.uuid4())
+    loop = asyncio.get_running_loop()
+
+    # Shared Vision Engine; on a cold process Vertex AI init + client creation happen here, off the loop
+    vision = get_vision_engine()
+    await loop.run_in_executor(None, vision.registry.model, vision.model_name)
+    # Code excerpts for the prompts (built at startup in the API; on first use in a job worker)
+    await loop.run_in_executor(None, kb_index.ensure_loaded)
+
+    # 1. Select Pages (page count comes from the PDF structure, nothing is rendered yet)
+    try:
+        total_pages = await count_pages_async(pdf_content)
+    except Exception as e:
+        print(f"Error reading PDF: {e}")
+        total_pages = 0
+    pages = select_pages(total_pages, all_pages, max_pages)
+    if not pages:
+        raise PdfConversionError("Could not convert PDF to Image.")
+
+    print(f"[CORTEX] PDF has {total_pages} pages. Analyzing {len(pages)}...")
+    emit("start", {"workflow_id": workflow_id, "total_pages": total_pages, "pages": pages})
+
+    # Progressive mode: per-sheet enrichment, one at a time (the session is not thread-safe)
+    enriched_by_page: Dict[int, List[Dict[str, Any]]] = {}
+    enrich_lock = asyncio.Lock()
+    enrich_tasks = []
+
+    async def enrich_page(result: Dict[str, Any]):
+        rooms = (result.get("data") or {}).get("rooms")
+        rooms = [dict(room, page=result["page"]) for room in rooms if isinstance(room, dict)] \
+            if isinstance(rooms, list) else []
+        if rooms:
+            async with enrich_lock:
+                rooms = await loop.run_in_executor(None, enrich_rooms, vision, db, rooms, workflow_id)
+        enriched_by_page[result["page"]] = rooms
+        for index, room in enumerate(rooms):
+            emit("components", {"page": result["page"], "index": index, "room": room})
+
+    def page_done(result: Dict[str, Any]):
+        emit("page", page_summary(result))
+        if progressive:
+            enrich_tasks.append(asyncio.ensure_future(enrich_page(result)))
+
+    # 2. Vision Analysis (RAG + Vision), page by page
+    try:
+        page_results = await analyze_pdf_pages(
+            vision, pdf_content, pages, use_cache=use_cache, on_page=page_done,
+            on_room=(lambda page, room: emit("room", {"page": page, "room": dict(room, page=page)}))
+            if progressive else None,
+        )
+        if all(r["error"] == RASTER_ERROR for r in page_results):
+            raise PdfConversionError("Could not convert PDF to Image.")
+        await asyncio.gather(*enrich_tasks)
+    finally:
+        for task in enrich_tasks:
+            task.cancel()
+
+    # Log Step 1: Vision Request/Response (one row per sheet, queued on the audit sink)
+    record_vision_audit(workflow_id, filename, len(pdf_content), page_results)
+
+    # 3. Merge per-page JSON into one analysis
+    ai_data = merge_page_results(page_results)
+    print(f"[CORTEX] Vision AI Result: {ai_data}")
+
+    # 4. Map to Standard Output & RAG Enrichment (sync DB work, kept off the event loop)
+    if progressive:
+        ai_data["rooms"] = [room for page in sorted(enriched_by_page) for room in enriched_by_page[page]]
+    else:
+        emit("enrich", {"rooms": len(ai_data.get("rooms", []))})
+        ai_data["rooms"] = await loop.run_in_executor(
+            None, enrich_rooms, vision, db, ai_data.get("rooms", []), workflow_id
+        )
+
+    return {
+        "occupancy": ai_data.get("occupancy", "Unknown"),
+        "sqft": 0,
+        "num_stories": 1,
+        "num_units": 0,
+        "sprinklered": False,
+        "ai_analysis": ai_data
+    }
@@ -1,34 +1,125 @@
 import os
 import io
-from typing import List, Dict, Any
-from pdf2image import convert_from_bytes
-from vertexai.generative_models import GenerativeModel, Part, Image
-import vertexai
+import time
+import threading
+from typing import AsyncIterator, List, Dict, Any, Optional
 from sqlalchemy.orm import Session
 from models import Component, KnowledgeBase
-from database import engine
+from component_index import component_index
+from vector_search import vector_search, hybrid_search
+from embeddings import embed_texts, embed_query
 import sqlalchemy
 
 # Constants
 PROJECT_ID = os.getenv("GCP_PROJECT", "cicuma-fire-1767585900")
 LOCATION = "us-central1"
+MODEL_NAME = "gemini-1.0-pro-vision"
+# Bump whenever the analyze_plan prompt changes so cached analyses are not reused
+PROMPT_VERSION = "1"
+# Distinct needs resolved per UNION ALL round trip
+BATCH_QUERY_SIZE = int(os.getenv("RAG_BATCH_QUERY_SIZE", "50"))
+# keyword | vector | hybrid
+RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "keyword")
 
-# Initialize Vertex AI
-try:
-    vertexai.init(project=PROJECT_ID, location=LOCATION)
-except Exception as e:
-    print(f"Warning: Failed to init Vertex AI: {e}")
+
+class ModelRegistry:
+    """
+    Process-wide Vertex AI state: `vertexai.init` and the SDK import run once, on first
+    use (or in `warm_up`), and each GenerativeModel is built once and shared by all
+    requests. Nothing touches the network or credentials at import time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._initialized = False
+        self._models: Dict[str, Any] = {}
+        self.init_ms: Optional[int] = None
+        self.model_ms: Dict[str, int] = {}
+        self.warmed_up = False
+        self.init_error: Optional[str] = None
+
+    def _init_vertex(self):
+        start = time.perf_counter()
+        import vertexai
+        try:
+            vertexai.init(project=PROJECT_ID, location=LOCATION)
+        except Exception as e:
+            self.init_error = str(e)
+            print(f"Warning: Failed to init Vertex AI: {e}")
+        self._initialized = True
+        self.init_ms = int((time.perf_counter() - start) * 1000)
+
+    def model(self, name: str = MODEL_NAME):
+        model = self._models.get(name)
+        if model is None:
+            with self._lock:
+                model = self._models.get(name)
+                if model is None:
+                    if not self._initialized:
+                        self._init_vertex()
+                    start = time.perf_counter()
+                    from vertexai.generative_models import GenerativeModel
+                    print(f"Initializing GenerativeModel {name}")
+                    model = GenerativeModel(name)
+                    self.model_ms[name] = int((time.perf_counter() - start) * 1000)
+                    self._models[name] = model
+        return model
+
+    def warm_up(self, name: str = MODEL_NAME):
+        """Builds the client ahead of the first request; failures are left for that request."""
+        try:
+            self.model(name)
+            self.warmed_up = True
+        except Exception as e:
+            print(f"Warning: Vision warm-up failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "initialized": self._initialized,
+            "init_ms": self.init_ms,
+            "init_error": self.init_error,
+            "models": dict(self.model_ms),
+            "warmed_up": self.warmed_up,
+        }
+
+
+model_registry = ModelRegistry()
+
+# Fallback for demo/dev if model is unavailable
+FALLBACK_ANALYSIS = """
+            {
+                "occupancy": "R-2 Residential",
+                "scale_estimated": "1/8 inch = 1 foot",
+                "rooms": [
+                    { "name": "Master Bed", "type": "Sleeping", "needs": ["LF Sounder", "Smoke"] },
+                    { "name": "Kitchen", "type": "Cooking", "needs": ["Heat Detector"] },
+                    { "name": "Living Room", "type": "Living", "needs": ["Strobe"] }
+                ],
+                "analysis_notes": "AI Model Unavailable. Using cached analysis for R-2 Layout logic."
+            }
+            """
 
 class VisionEngine:
-    def __init__(self, db: Session):
-        self.db = db
+    """
+    Stateless across requests: one instance per process (see `get_vision_engine`).
+    The model client comes from the registry and DB sessions are passed per call.
+    """
+
+    def __init__(self, model_name: str = MODEL_NAME, registry: ModelRegistry = model_registry):
+        self.model_name = model_name
+        self.registry = registry
+        # Retrieval method of the calling thread's last lookup (requests share the engine)
+        self._local = threading.local()
+
+    @property
+    def model(self):
         # Trying older stable vision model
-        print("Initializing VisionEngine with gemini-1.0-pro-vision")
-        self.model = GenerativeModel("gemini-1.0-pro-vision")
+        return self.registry.model(self.model_name)
 
     def convert_pdf_to_images(self, pdf_content: bytes) -> List[Any]:
         """Converts PDF bytes to a list of PIL Images."""
         try:
+            from pdf2image import convert_from_bytes
             # poppler_path might need to be specified if not in PATH, but apt-get installs it globally
             images = convert_from_bytes(pdf_content)
             return images
@@ -36,21 +127,15 @@ class VisionEngine:
             print(f"Error converting PDF to images: {e}")
             return []
 
-    def retrieve_relevant_components(self, query: str, limit: int = 5) -> List[Dict]:
-        """
-        Retrieves components using Keyword Search (Fallback since Vectors are empty).
-        """
-        # 1. Clean query
+    @staticmethod
+    def _keywords(query: str) -> List[str]:
         keywords = query.replace(",", " ").split()
-        keywords = [k for k in keywords if len(k) > 2] # Filter tiny words
-        
-        if not keywords:
-            return []
+        return [k for k in keywords if len(k) > 2] # Filter tiny words
 
-        # 2. Build SQL Query (ILIKE)
+    @staticmethod
+    def _keyword_filter(keywords: List[str]):
         # We want items where description OR category matches ALL keywords
         # e.g., "Smoke Detector" -> desc ILIKE %Smoke% AND desc ILIKE %Detector%
-        
         filters = []
         for word in keywords:
             filters.append(
@@ -60,34 +145,149 @@ class VisionEngine:
                     Component.part_number.ilike(f"%{word}%")
                 )
             )
-            
+        return sqlalchemy.and_(*filters)
+
+    @staticmethod
+    def _serialize(r) -> Dict:
+        return {
+            "part_number": r.part_number,
+            "category": r.category,
+            "description": r.description,
+            "price": r.price
+        }
+
+    @property
+    def retrieval_method(self) -> str:
+        """Method that served the most recent lookup (recorded in the audit log)."""
+        method = getattr(self._local, "method", None)
+        if method:
+            return method
+        return "keyword_bm25_index" if component_index.ready else "keyword_search_ilike"
+
+    def search_keyword_sql(self, db: Session, keywords: List[str], limit: int = 5) -> List[Dict]:
+        """ILIKE scan over the catalog (the pre-index path; kept for fallback and benchmarks)."""
         print(f"RAG Query: {keywords}")
         
         try:
             # Using AND logic for precision (must match all keywords)
-            results = self.db.query(Component).filter(
-                sqlalchemy.and_(*filters)
+            results = db.query(Component).filter(
+                self._keyword_filter(keywords)
             ).limit(limit).all()
             
-            return [
-                {
-                    "part_number": r.part_number,
-                    "category": r.category,
-                    "description": r.description,
-                    "price": r.price
-                }
-                for r in results
-            ]
+            return [self._serialize(r) for r in results]
         except Exception as e:
             print(f"RAG Error: {e}")
             return []
 
-    def analyze_plan(self, image_data: bytes, prompt_context: str = "") -> Dict[str, Any]:
+    def search_keyword(self, db: Session, keywords: List[str], limit: int = 5) -> List[Dict]:
+        if component_index.ready:
+            self._local.method = "keyword_bm25_index"
+            return component_index.search(keywords, limit=limit)
+        self._local.method = "keyword_search_ilike"
+        return self.search_keyword_sql(db, keywords, limit=limit)
+
+    def search_semantic(self, db: Session, keywords: List[str], query_vec: List[float], limit: int = 5,
+                        mode: str = "vector") -> List[Dict]:
+        """Vector (HNSW / NumPy) or hybrid keyword+vector retrieval for an embedded query."""
+        if mode == "hybrid" and component_index.ready:
+            self._local.method = "hybrid_bm25_vector"
+            return hybrid_search(db, keywords, query_vec, limit=limit)
+        self._local.method = "vector_cosine"
+        return vector_search(db, query_vec, limit=limit)
+
+    def retrieve_relevant_components(self, db: Session, query: str, limit: int = 5, mode: Optional[str] = None) -> List[Dict]:
+        """
+        Retrieves components for one need.
+        `mode` (default RAG_RETRIEVAL_MODE): "keyword" uses the in-memory BM25 index once it
+        is built (ILIKE scan otherwise); "vector" and "hybrid" embed the query and search
+        Component.embedding, falling back to keyword search if embedding fails.
+        """
+        mode = mode or RETRIEVAL_MODE
+        # 1. Clean query
+        keywords = self._keywords(query)
+        
+        if not keywords:
+            return []
+
+        if mode in ("vector", "hybrid"):
+            try:
+                return self.search_semantic(db, keywords, embed_query(" ".join(keywords)), limit=limit, mode=mode)
+            except Exception as e:
+                print(f"RAG Semantic Error (falling back to keyword): {e}")
+
+        return self.search_keyword(db, keywords, limit=limit)
+
+    def retrieve_components_batch(self, db: Session, queries: List[str], limit: int = 1,
+                                  mode: Optional[str] = None) -> Dict[str, List[Dict]]:
         """
-        Sends the floor plan image to Gemini 1.5 Pro Vision.
-        Returns structured JSON design parameters.
+        Resolves many queries at once. Queries are deduplicated by their normalized
+        keyword set; semantic modes embed all distinct sets in one request, and the SQL
+        fallback turns each distinct set into one LIMITed branch of a UNION ALL,
+        so a whole plan costs ceil(distinct / BATCH_QUERY_SIZE) round trips.
+        Returns {query: matches} for every input query.
         """
-        prompt = f"""
+        mode = mode or RETRIEVAL_MODE
+        # 1. Deduplicate ("Smoke", "smoke", "Smoke," all share one lookup)
+        keyword_sets = {}
+        for query in queries:
+            keywords = self._keywords(query)
+            if keywords:
+                keyword_sets.setdefault(tuple(sorted(k.lower() for k in keywords)), keywords)
+
+        distinct = list(keyword_sets.items())
+        matches_by_key = {key: [] for key, _ in distinct}
+        print(f"RAG Batch Query: {len(queries)} needs -> {len(distinct)} distinct")
+
+        # 2a. Semantic: one embedding request for every distinct need
+        if mode in ("vector", "hybrid") and distinct:
+            try:
+                vectors = embed_texts([" ".join(keywords) for _, keywords in distinct])
+                for (key, keywords), vec in zip(distinct, vectors):
+                    matches_by_key[key] = self.search_semantic(db, keywords, vec, limit=limit, mode=mode)
+                distinct = []
+            except Exception as e:
+                print(f"RAG Semantic Error (falling back to keyword): {e}")
+
+        # 2b. In-memory index: no DB round trip at all
+        if component_index.ready and distinct:
+            self._local.method = "keyword_bm25_index"
+            for key, keywords in distinct:
+                matches_by_key[key] = component_index.search(keywords, limit=limit)
+            distinct = []
+
+        # 2c. One UNION ALL per chunk, each branch tagged with its index
+        try:
+            if distinct:
+                self._local.method = "keyword_search_ilike"
+            for offset in range(0, len(distinct), BATCH_QUERY_SIZE):
+                chunk = distinct[offset:offset + BATCH_QUERY_SIZE]
+                branches = []
+                for idx, (_, keywords) in enumerate(chunk):
+                    subq = sqlalchemy.select(
+                        sqlalchemy.literal(idx).label("need_idx"),
+                        Component.part_number,
+                        Component.category,
+                        Component.description,
+                        Component.price,
+                    ).where(self._keyword_filter(keywords)).limit(limit).subquery()
+                    branches.append(sqlalchemy.select(subq))
+
+                stmt = branches[0] if len(branches) == 1 else sqlalchemy.union_all(*branches)
+                for row in db.execute(stmt):
+                    matches_by_key[chunk[row.need_idx][0]].append(self._serialize(row))
+        except Exception as e:
+            print(f"RAG Error: {e}")
+
+        # 3. Fan results back out to the original queries
+        results = {}
+        for query in queries:
+            keywords = self._keywords(query)
+            key = tuple(sorted(k.lower() for k in keywords))
+            results[query] = list(matches_by_key.get(key, [])) if keywords else []
+        return results
+
+    def _build_prompt(self, prompt_context: str = "") -> str:
+        return f"""
         You are a Senior Fire Protection Engineer designed to analyze architectural floor plans.
         
         {prompt_context}
@@ -110,9 +310,18 @@ class VisionEngine:
             "analysis_notes": "string"
         }}
         """
+
+    def analyze_plan(self, image_data: bytes, prompt_context: str = "",
+                    mime_type: str = "image/jpeg") -> Dict[str, Any]:
+        """
+        Sends the floor plan image to Gemini 1.5 Pro Vision.
+        Returns structured JSON design parameters.
+        """
+        prompt = self._build_prompt(prompt_context)
         
         try:
-            image_part = Part.from_data(data=image_data, mime_type="image/jpeg")
+            from vertexai.generative_models import Part
+            image_part = Part.from_data(data=image_data, mime_type=mime_type)
             
             response = self.model.generate_content(
                 [image_part, prompt],
@@ -123,16 +332,68 @@ class VisionEngine:
         except Exception as e:
             print(f"Error in Vision Analysis: {e}")
             # Fallback for demo/dev if model is unavailable
-            return """
-            {
-                "occupancy": "R-2 Residential",
-                "scale_estimated": "1/8 inch = 1 foot",
-                "rooms": [
-                    { "name": "Master Bed", "type": "Sleeping", "needs": ["LF Sounder", "Smoke"] },
-                    { "name": "Kitchen", "type": "Cooking", "needs": ["Heat Detector"] },
-                    { "name": "Living Room", "type": "Living", "needs": ["Strobe"] }
-                ],
-                "analysis_notes": "AI Model Unavailable. Using cached analysis for R-2 Layout logic."
-            }
-            """
+            return FALLBACK_ANALYSIS
+
+    async def analyze_plan_async(self, image_data: bytes, prompt_context: str = "",
+                                 mime_type: str = "image/jpeg") -> Dict[str, Any]:
+        """
+        Non-blocking variant of `analyze_plan` for use on the event loop.
+        """
+        prompt = self._build_prompt(prompt_context)
+        
+        try:
+            from vertexai.generative_models import Part
+            image_part = Part.from_data(data=image_data, mime_type=mime_type)
+            
+            response = await self.model.generate_content_async(
+                [image_part, prompt],
+                generation_config={"response_mime_type": "application/json"}
+            )
+            
+            return response.text
+        except Exception as e:
+            print(f"Error in Vision Analysis: {e}")
+            return FALLBACK_ANALYSIS
+
+
+    async def analyze_plan_stream(self, image_data: bytes, prompt_context: str = "",
+                                  mime_type: str = "image/jpeg") -> AsyncIterator[str]:
+        """
+        Streaming variant of `analyze_plan_async`: yields the response text as the model
+        generates it. If the call fails before any text, the fallback analysis is yielded.
+        """
+        prompt = self._build_prompt(prompt_context)
+        started = False
+
+        try:
+            from vertexai.generative_models import Part
+            image_part = Part.from_data(data=image_data, mime_type=mime_type)
+
+            responses = await self.model.generate_content_async(
+                [image_part, prompt],
+                generation_config={"response_mime_type": "application/json"},
+                stream=True,
+            )
+            async for chunk in responses:
+                started = True
+                yield chunk.text
+        except Exception as e:
+            if started:
+                raise
+            print(f"Error in Vision Analysis: {e}")
+            yield FALLBACK_ANALYSIS
+
+
+_engine: Optional[VisionEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_vision_engine() -> VisionEngine:
+    """The process-wide engine (cheap: the model client is created lazily by the registry)."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = VisionEngine()
+    return _engine
 